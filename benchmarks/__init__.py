@@ -0,0 +1,9 @@
+"""
+Бенчмарки производительности Imperceptible Protected Video Generator
+
+Запуск из корня проекта:
+    python -m benchmarks.tiled_gradients
+    python -m benchmarks.pipeline
+    python -m benchmarks.video_noise
+    python -m benchmarks.load_test
+"""
@@ -0,0 +1,394 @@
+#!/usr/bin/env python3
+"""
+Нагрузочный тест очереди и REST API (VideoProcessingQueue + server_app).
+
+Сервер запускается в отдельном процессе, process_video_task в нём
+подменяется фиктивным воркером (sleep или загрузка CPU в Python), а
+клиенты (asyncio + httpx) параллельно гоняют /upload (маленький, но
+настоящий ролик — сервер читает его параметры для модели стоимости),
+/task/{id}, /tasks и /stats. Для каждого размера базы (--task-counts) сервер стартует с
+заранее созданными завершёнными задачами, поэтому видно, как растут
+задержки с числом задач.
+
+В отчёте: p50/p99/max задержек по эндпоинтам, задержка диспетчеризации
+(создание задачи -> старт воркера), число и время save_tasks (запись JSON).
+
+Пример:
+    python -m benchmarks.load_test --clients 32 --uploads-per-client 5 \\
+        --task-counts 0 1000 10000 --work sleep --work-sec 0.5 --json load.json
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+ENDPOINTS = ("upload", "task", "tasks", "stats")
+FINAL_STATUSES = ("completed", "failed", "cancelled")
+
+
+def percentile(values, q: float):
+    """Перцентиль без интерполяции; None для пустого списка"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q * (len(ordered) - 1))))]
+
+
+def summarize(values, scale: float = 1000.0) -> dict:
+    """count / p50 / p99 / max (по умолчанию сек -> мс)"""
+    def ms(value):
+        return round(value * scale, 2) if value is not None else None
+    return {
+        "count": len(values),
+        "p50_ms": ms(percentile(values, 0.5)),
+        "p99_ms": ms(percentile(values, 0.99)),
+        "max_ms": ms(max(values) if values else None),
+    }
+
+
+# ──── СЕРВЕРНЫЙ ПРОЦЕСС ──────────────────────────────────────────────────────
+
+def serve(port: int, workdir: str, task_count: int, work: str, work_sec: float,
+          progress_steps: int, max_concurrent: int, verbose: bool, stop_event) -> None:
+    """Поднимает server_app с фиктивным воркером; статистику пишет в workdir/server_stats.json"""
+    # База сервера не загружается и не меняется: своя база до импорта очереди
+    os.environ["QUEUE_DB_FOLDER"] = workdir
+    import logging
+    import uvicorn
+    import server_app
+    import server_video_worker
+    from server_config import SERVER_CONFIG, TaskStatus
+    from queue_processor import processing_queue, ProcessingTask
+    
+    if not verbose:
+        # Логи сервера пишутся в server_logs — не засоряем их тысячами строк
+        logging.disable(logging.INFO)
+    
+    workdir = Path(workdir)
+    SERVER_CONFIG["max_concurrent_tasks"] = max_concurrent
+    server_app.INPUT_FOLDER = workdir
+    
+    # Отдельная база: task_count завершённых задач, затем чистая загрузка
+    queue = processing_queue
+    queue.reset((
+        ProcessingTask(
+            task_id=f"seed{i:08d}", input_video=f"seed_{i}.mp4",
+            status=TaskStatus.COMPLETED, created_at=f"2000-01-01T00:00:{i % 60:02d}.{i:06d}",
+            output_video=f"seed_{i}_protected.mp4", progress=100.0,
+            user_id=f"seed{i % 50}", completed_at="2000-01-01 00:01:00"
+        )
+        for i in range(task_count)
+    ))
+    queue.save_tasks()
+    
+    stats = {"save_sec": [], "save_tasks": [], "save_bytes": [], "dispatch_sec": [], "worker_errors": 0}
+    created = {}
+    
+    save_tasks = queue.save_tasks
+    
+    def timed_save_tasks() -> None:
+        started = time.perf_counter()
+        save_tasks()
+        stats["save_sec"].append(time.perf_counter() - started)
+        stats["save_tasks"].append(len(queue.tasks))
+        try:
+            stats["save_bytes"].append(queue.tasks_db.stat().st_size)
+        except OSError:
+            pass
+    
+    admit_and_create = queue.admit_and_create
+    
+    def timed_admit_and_create(*args, **kwargs):
+        started = time.monotonic()
+        task_id, retry_after = admit_and_create(*args, **kwargs)
+        if task_id is not None:
+            created[task_id] = started
+        return task_id, retry_after
+    
+    def fake_worker(task_id: str) -> bool:
+        """Повторяет обновления очереди настоящего воркера, без обработки видео"""
+        stats["dispatch_sec"].append(time.monotonic() - created.pop(task_id, time.monotonic()))
+        try:
+            queue.update_task(task_id, status=TaskStatus.PROCESSING, started_at=f"{time.time()}")
+            for step in range(progress_steps):
+                deadline = time.perf_counter() + work_sec / progress_steps
+                if work == "burn":
+                    while time.perf_counter() < deadline:
+                        sum(i * i for i in range(1000))
+                else:
+                    time.sleep(work_sec / progress_steps)
+                queue.report_progress(task_id, progress=100.0 * (step + 1) / progress_steps)
+            task = queue.get_task(task_id)
+            (workdir / task.input_video).unlink(missing_ok=True)
+            queue.update_task(
+                task_id, status=TaskStatus.COMPLETED, output_video=f"{task_id}_protected.mp4",
+                progress=100.0, completed_at=time.strftime("%Y-%m-%d %H:%M:%S")
+            )
+            return True
+        except Exception:
+            stats["worker_errors"] += 1
+            queue.update_task(task_id, status=TaskStatus.FAILED, error_message="fake worker error")
+            return False
+    
+    queue.save_tasks = timed_save_tasks
+    queue.admit_and_create = timed_admit_and_create
+    # Задачи забирают воркеры очереди (queue_worker_loop -> process_video_task)
+    server_video_worker.process_video_task = fake_worker
+    
+    server = uvicorn.Server(uvicorn.Config(
+        server_app.app, host="127.0.0.1", port=port, log_level="warning", access_log=False
+    ))
+    
+    def stop_when_asked() -> None:
+        # Не SIGTERM: uvicorn повторно поднимает пойманный сигнал после остановки
+        stop_event.wait()
+        server.should_exit = True
+    
+    threading.Thread(target=stop_when_asked, daemon=True).start()
+    server.run()
+    
+    # Сервер остановлен: ждём воркеры и сохраняем статистику
+    for thread in threading.enumerate():
+        if thread is not threading.current_thread() and not thread.daemon:
+            thread.join(timeout=5)
+    with open(workdir / "server_stats.json", "w", encoding="utf-8") as f:
+        json.dump(stats, f)
+
+
+# ──── КЛИЕНТЫ ────────────────────────────────────────────────────────────────
+
+def make_payload(frames: int) -> bytes:
+    """Маленький mp4 (64x48, mp4v) — проходит проверку /upload"""
+    import cv2
+    import numpy as np
+    
+    with tempfile.TemporaryDirectory(prefix="mc_load_clip_") as tmp:
+        path = Path(tmp) / "clip.mp4"
+        writer = cv2.VideoWriter(str(path), cv2.VideoWriter_fourcc(*"mp4v"), 10, (64, 48))
+        for i in range(frames):
+            writer.write(np.full((48, 64, 3), i * 255 // max(1, frames), dtype=np.uint8))
+        writer.release()
+        return path.read_bytes()
+
+
+async def run_client(client: httpx.AsyncClient, client_id: int, args, latencies: dict,
+                     counters: dict, completion: list) -> None:
+    """Один клиент: upload -> опрос статуса до завершения, между опросами /tasks и /stats"""
+    rng = random.Random(client_id)
+    payload = args.payload
+    
+    async def timed(endpoint: str, method: str, url: str, **kwargs) -> httpx.Response:
+        started = time.perf_counter()
+        try:
+            response = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            counters["errors"] += 1
+            raise
+        latencies[endpoint].append(time.perf_counter() - started)
+        if response.status_code >= 500:
+            counters["errors"] += 1
+        return response
+    
+    for _ in range(args.uploads_per_client):
+        uploaded = time.perf_counter()
+        while True:
+            response = await timed(
+                "upload", "POST", "/upload",
+                params={"user_id": f"load{client_id}"},
+                files={"file": (f"load_{client_id}.mp4", payload, "video/mp4")},
+            )
+            if response.status_code != 429:
+                break
+            counters["rejected"] += 1
+            await asyncio.sleep(args.busy_retry_sec)
+        if response.status_code != 200:
+            continue
+        task_id = response.json()["task_id"]
+        
+        while True:
+            await asyncio.sleep(args.poll_interval)
+            response = await timed("task", "GET", f"/task/{task_id}")
+            if response.status_code == 200 and response.json()["task"]["status"] in FINAL_STATUSES:
+                completion.append(time.perf_counter() - uploaded)
+                break
+            if time.perf_counter() - uploaded > args.task_timeout:
+                counters["timeouts"] += 1
+                break
+            if rng.random() < args.list_ratio:
+                await timed("tasks", "GET", "/tasks", params={"limit": 50})
+            if rng.random() < args.stats_ratio:
+                await timed("stats", "GET", "/stats")
+
+
+async def run_load(base_url: str, args) -> dict:
+    latencies = {endpoint: [] for endpoint in ENDPOINTS}
+    counters = {"rejected": 0, "errors": 0, "timeouts": 0}
+    completion = []
+    limits = httpx.Limits(max_connections=args.clients, max_keepalive_connections=args.clients)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        started = time.perf_counter()
+        results = await asyncio.gather(*(
+            run_client(client, client_id, args, latencies, counters, completion)
+            for client_id in range(args.clients)
+        ), return_exceptions=True)
+        wall = time.perf_counter() - started
+    failures = [repr(result) for result in results if isinstance(result, Exception)]
+    return {
+        "wall_sec": round(wall, 3),
+        "tasks_completed": len(completion),
+        "tasks_per_second": round(len(completion) / wall, 2) if wall > 0 else None,
+        "rejected_429": counters["rejected"],
+        "errors": counters["errors"],
+        "timeouts": counters["timeouts"],
+        "client_failures": failures[:5],
+        "endpoints": {endpoint: summarize(values) for endpoint, values in latencies.items()},
+        "task_turnaround": summarize(completion),
+    }
+
+
+async def wait_ready(base_url: str, process, timeout: float = 120) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url, timeout=2) as client:
+        while time.monotonic() < deadline:
+            if not process.is_alive():
+                raise RuntimeError("Сервер завершился при запуске")
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("Сервер не ответил на /health")
+
+
+def run_phase(task_count: int, port: int, args) -> dict:
+    """Сервер с task_count задачами в базе -> нагрузка -> статистика сервера"""
+    workdir = Path(tempfile.mkdtemp(prefix="mc_load_"))
+    context = multiprocessing.get_context("spawn")
+    stop_event = context.Event()
+    process = context.Process(target=serve, args=(
+        port, str(workdir), task_count, args.work, args.work_sec,
+        args.progress_steps, args.max_concurrent or args.clients, args.verbose, stop_event
+    ))
+    process.start()
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        asyncio.run(wait_ready(base_url, process))
+        phase = asyncio.run(run_load(base_url, args))
+    finally:
+        stop_event.set()
+        process.join(timeout=60)
+        if process.is_alive():
+            process.terminate()
+            process.join()
+    
+    server_stats = {}
+    stats_path = workdir / "server_stats.json"
+    if stats_path.exists():
+        with open(stats_path, encoding="utf-8") as f:
+            server_stats = json.load(f)
+    for path in workdir.iterdir():
+        path.unlink()
+    workdir.rmdir()
+    
+    save_sec = server_stats.get("save_sec", [])
+    save_bytes = server_stats.get("save_bytes", [])
+    phase.update({
+        "seed_tasks": task_count,
+        "dispatch": summarize(server_stats.get("dispatch_sec", [])),
+        "persistence": {
+            **summarize(save_sec),
+            "total_sec": round(sum(save_sec), 3),
+            "share_of_wall": round(sum(save_sec) / phase["wall_sec"], 3) if phase["wall_sec"] else None,
+            "db_mb": round(max(save_bytes) / (1024 * 1024), 2) if save_bytes else None,
+        },
+        "worker_errors": server_stats.get("worker_errors"),
+    })
+    return phase
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест очереди и REST API с фиктивным воркером")
+    parser.add_argument("--clients", type=int, default=16, help="Параллельных клиентов")
+    parser.add_argument("--uploads-per-client", type=int, default=3)
+    parser.add_argument("--task-counts", type=int, nargs="+", default=[0, 1000, 10000],
+                        help="Завершённых задач в базе перед запуском (по фазам)")
+    parser.add_argument("--work", choices=["sleep", "burn"], default="sleep",
+                        help="Фиктивная обработка: sleep или загрузка CPU (держит GIL)")
+    parser.add_argument("--work-sec", type=float, default=0.5, help="Длительность фиктивной обработки")
+    parser.add_argument("--progress-steps", type=int, default=10, help="Обновлений прогресса на задачу")
+    parser.add_argument("--max-concurrent", type=int, default=None,
+                        help="max_concurrent_tasks сервера (по умолчанию = --clients)")
+    parser.add_argument("--poll-interval", type=float, default=0.1)
+    parser.add_argument("--list-ratio", type=float, default=0.3, help="Доля опросов с запросом /tasks")
+    parser.add_argument("--stats-ratio", type=float, default=0.3, help="Доля опросов с запросом /stats")
+    parser.add_argument("--busy-retry-sec", type=float, default=0.2, help="Пауза после 429")
+    parser.add_argument("--task-timeout", type=float, default=120, help="Сколько ждать завершения задачи")
+    parser.add_argument("--clip-frames", type=int, default=10, help="Кадров в загружаемом ролике")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--verbose", action="store_true", help="Не глушить INFO логи сервера")
+    parser.add_argument("--json", dest="json_path", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+    args.payload = make_payload(args.clip_frames)
+    
+    print("\n" + "="*70)
+    print(f"🔬 Нагрузка: clients={args.clients}, uploads/client={args.uploads_per_client}, "
+          f"work={args.work} {args.work_sec}s, cpus={os.cpu_count()}")
+    print("="*70)
+    
+    phases = []
+    for task_count in args.task_counts:
+        phase = run_phase(task_count, args.port, args)
+        phases.append(phase)
+        
+        print(f"\n── База: {task_count} задач, {phase['tasks_completed']} выполнено за {phase['wall_sec']:.1f}s "
+              f"({phase['tasks_per_second']} задач/с), 429: {phase['rejected_429']}, ошибок: {phase['errors']}, "
+              f"таймаутов: {phase['timeouts']}")
+        print(f"{'':>12} {'count':>7} {'p50 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        rows = dict(phase["endpoints"])
+        rows["dispatch"] = phase["dispatch"]
+        rows["save_tasks"] = phase["persistence"]
+        for name, row in rows.items():
+            if row["count"]:
+                print(f"{name:>12} {row['count']:>7} {row['p50_ms']:>9.2f} {row['p99_ms']:>9.2f} {row['max_ms']:>9.2f}")
+        persistence = phase["persistence"]
+        print(f"JSON: {persistence['total_sec']:.2f}s записи ({persistence['share_of_wall'] or 0:.0%} времени), "
+              f"база {persistence['db_mb']} MB")
+        for failure in phase["client_failures"]:
+            print(f"[WARN] Клиент: {failure}")
+    
+    report = {
+        "benchmark": "load_test",
+        "clients": args.clients,
+        "uploads_per_client": args.uploads_per_client,
+        "work": args.work,
+        "work_sec": args.work_sec,
+        "progress_steps": args.progress_steps,
+        "cpus": os.cpu_count(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "phases": phases,
+    }
+    
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n✓ Результаты сохранены: {args.json_path}")
+    
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
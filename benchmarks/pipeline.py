@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Сквозной бенчмарк конвейера на синтетических видео.
+
+Клипы генерируются ffmpeg (testsrc2 + sine) для набора разрешений,
+длительностей и частот кадров, поэтому результаты воспроизводимы без
+внешних файлов. Для каждого клипа замеряются этапы:
+    
+    video     — VideoProcessor.process_video (decode / модель / запись PNG)
+    audio     — extract_audio + AudioProcessor (WAV маскирование, scan потока)
+    assembly  — assemble_video (кадры + аудио -> mp4)
+    task      — целиком process_video_task через очередь сервера
+
+В отчёте (JSON) — кадров/сек, время и CPU по этапам, пиковый RSS и
+пиковый объём временных файлов; --baseline сравнивает с прошлым отчётом.
+
+Пример:
+    python -m benchmarks.pipeline --resolutions 640x360 1280x720 --durations 2 --fps 25 \\
+        --json bench.json
+    python -m benchmarks.pipeline --json new.json --baseline bench.json
+"""
+
+import argparse
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+import cv2
+import numpy as np
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import media_cleaner
+from media_cleaner import (
+    CONFIG, VideoProcessor, AudioProcessor, extract_audio, assemble_video, init_device
+)
+from task_metrics import TaskMetrics, peak_rss_mb
+
+STAGES = ("video", "audio", "assembly", "task")
+MB = 1024 * 1024
+
+
+def make_clip(ffmpeg: str, path: Path, width: int, height: int, duration: float,
+              fps: int, sample_rate: int = 48000) -> Path:
+    """Синтетический клип: testsrc2 (движущийся тестовый узор) + sine, bitexact."""
+    subprocess.run([
+        ffmpeg, "-y", "-hide_banner", "-loglevel", "error",
+        "-f", "lavfi", "-i", f"testsrc2=size={width}x{height}:rate={fps}:duration={duration}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:beep_factor=4:sample_rate={sample_rate}:duration={duration}",
+        "-c:v", "libx264", "-preset", "veryfast", "-pix_fmt", "yuv420p", "-threads", "1",
+        "-c:a", "aac", "-shortest",
+        "-map_metadata", "-1", "-fflags", "+bitexact", "-flags:v", "+bitexact", "-flags:a", "+bitexact",
+        str(path)
+    ], check=True)
+    return path
+
+
+class DiskSampler:
+    """Пиковый прирост объёма файлов в папках за время блока (фоновый опрос)"""
+    
+    def __init__(self, *roots, interval: float = 0.2):
+        self.roots = [Path(root) for root in roots]
+        self.interval = interval
+        self.baseline = 0
+        self.peak = 0
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="DiskSampler")
+    
+    def usage(self) -> int:
+        total = 0
+        for root in self.roots:
+            for dirpath, _, filenames in os.walk(root):
+                for name in filenames:
+                    try:
+                        total += os.path.getsize(os.path.join(dirpath, name))
+                    except OSError:
+                        pass  # Файл удалён между листингом и stat
+        return total
+    
+    def _run(self) -> None:
+        while not self.stop.wait(self.interval):
+            self.peak = max(self.peak, self.usage())
+    
+    def __enter__(self):
+        self.baseline = self.peak = self.usage()
+        self.thread.start()
+        return self
+    
+    def __exit__(self, *exc):
+        self.stop.set()
+        self.thread.join()
+        self.peak = max(self.peak, self.usage())
+    
+    @property
+    def peak_mb(self) -> float:
+        return round((self.peak - self.baseline) / MB, 2)
+
+
+def seed_everything(seed: int = 0) -> None:
+    """EOT использует np.random и torch — фиксируем для повторяемости"""
+    random.seed(seed)
+    np.random.seed(seed)
+    torch.manual_seed(seed)
+
+
+def bench_stages(clip: Path, workdir: Path, args) -> dict:
+    """Этапы video / audio / assembly по отдельности на одном клипе"""
+    cap = cv2.VideoCapture(str(clip))
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+    cap.release()
+    
+    metrics = TaskMetrics()
+    temp_folder = None
+    audio_wav = workdir / f"{clip.stem}_audio.wav"
+    audio_adv = workdir / f"{clip.stem}_audio_adv.wav"
+    
+    if "video" in args.stages:
+        seed_everything()
+        processor = VideoProcessor(epsilon=args.epsilon, tiled=args.tiled)
+        timings = {}
+        with metrics.stage("video") as stage:
+            with DiskSampler(workdir) as disk:
+                temp_folder, noisy_frames = processor.process_video(
+                    str(clip), start_frame=1, end_frame=total_frames,
+                    every_n_frames=args.every_n_frames, timings=timings
+                )
+            stage.update(
+                frames=total_frames,
+                noisy_frames=noisy_frames,
+                bytes_read=clip.stat().st_size,
+                temp_disk_mb=disk.peak_mb,
+                **{key: round(value, 3) for key, value in timings.items()}
+            )
+    
+    if "audio" in args.stages:
+        with metrics.stage("audio") as stage:
+            t0 = time.perf_counter()
+            extract_audio(str(clip), str(audio_wav))
+            t1 = time.perf_counter()
+            AudioProcessor.add_imperceptible_audio_noise(str(audio_wav), str(audio_adv), args.audio_level)
+            t2 = time.perf_counter()
+            AudioProcessor.scan_audio_stream(str(clip))
+            t3 = time.perf_counter()
+            stage.update(
+                bytes_written=audio_wav.stat().st_size + audio_adv.stat().st_size,
+                extract_sec=round(t1 - t0, 3),
+                mask_sec=round(t2 - t1, 3),
+                scan_sec=round(t3 - t2, 3)
+            )
+    
+    if "assembly" in args.stages:
+        output = workdir / f"{clip.stem}_out.mp4"
+        with metrics.stage("assembly") as stage:
+            assemble_video(temp_folder, str(audio_adv), fps, str(output), use_gpu=args.gpu)
+            stage.update(frames=total_frames, bytes_written=output.stat().st_size)
+    
+    if temp_folder:
+        shutil.rmtree(temp_folder, ignore_errors=True)
+    
+    return metrics.to_dict()["stages"]
+
+
+def bench_task(clip: Path, workdir: Path, args) -> dict:
+    """Задача целиком через process_video_task (как на сервере)"""
+    # Импорт здесь: модули сервера создают папки и загружают очередь.
+    # Своя база до импорта: processing_queue при загрузке возобновляет или
+    # помечает FAILED зависшие задачи сервера и удаляет их чекпоинты
+    os.environ["QUEUE_DB_FOLDER"] = str(workdir / "queue_db")
+    import server_config
+    from queue_processor import processing_queue
+    from server_video_worker import process_video_task
+    
+    server_config.SERVER_CONFIG["ffmpeg_path"] = CONFIG["ffmpeg_path"]
+    
+    name = f"bench_{clip.name}"
+    shutil.copy(clip, server_config.INPUT_FOLDER / name)
+    task_id = processing_queue.create_task(
+        name, epsilon=args.epsilon, audio_level=args.audio_level,
+        every_n_frames=args.every_n_frames, user_id="benchmark"
+    )
+    
+    seed_everything()
+    with DiskSampler(server_config.INPUT_FOLDER, server_config.TEMP_FOLDER) as disk:
+        started = time.perf_counter()
+        ok = process_video_task(task_id)
+        wall = time.perf_counter() - started
+    
+    task = processing_queue.get_task(task_id)
+    if task.output_video:
+        (server_config.OUTPUT_FOLDER / task.output_video).unlink(missing_ok=True)
+    (server_config.INPUT_FOLDER / name).unlink(missing_ok=True)
+    
+    stages = (task.metrics or {}).get("stages", {})
+    frames = stages.get("video", {}).get("frames", 0)
+    return {
+        "ok": ok,
+        "status": task.status,
+        "error": task.error_message,
+        "wall_sec": round(wall, 3),
+        "fps": round(frames / wall, 2) if frames and wall > 0 else None,
+        "temp_disk_mb": disk.peak_mb,
+        "stages": stages,
+    }
+
+
+def case_key(case: dict) -> str:
+    width, height = case["resolution"]
+    return f"{width}x{height}@{case['fps']}fps/{case['duration']}s"
+
+
+def compare(report: dict, baseline: dict) -> None:
+    """Печатает изменение времени этапов относительно прошлого отчёта"""
+    previous = {case_key(case): case for case in baseline.get("cases", [])}
+    print("\n" + "="*70)
+    print("📈 Сравнение с baseline (wall_sec, + — медленнее)")
+    print("="*70)
+    for case in report["cases"]:
+        old = previous.get(case_key(case))
+        if not old:
+            print(f"{case_key(case)}: нет в baseline")
+            continue
+        for stage, values in case["stages"].items():
+            before = old["stages"].get(stage, {}).get("wall_sec")
+            now = values.get("wall_sec")
+            if before and now:
+                print(f"{case_key(case):<28} {stage:<10} {before:>8.3f} -> {now:>8.3f}  "
+                      f"{(now - before) / before * 100:+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной бенчмарк конвейера на синтетических видео")
+    parser.add_argument("--resolutions", nargs="+", default=["640x360", "1280x720"], help="Размеры WxH")
+    parser.add_argument("--durations", type=float, nargs="+", default=[2.0], help="Длительности (сек)")
+    parser.add_argument("--fps", type=int, nargs="+", default=[25], help="Частоты кадров")
+    parser.add_argument("--stages", nargs="+", choices=STAGES, default=list(STAGES))
+    parser.add_argument("--every-n-frames", type=int, default=10)
+    parser.add_argument("--epsilon", type=float, default=CONFIG["epsilon_video"])
+    parser.add_argument("--audio-level", default="слабый")
+    parser.add_argument("--tiled", action="store_true", help="Тайловый режим градиентов")
+    parser.add_argument("--gpu", action="store_true", help="Аппаратный кодер при сборке (если есть)")
+    parser.add_argument("--device", default="cpu", choices=["cpu", "gpu", "auto"])
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    parser.add_argument("--random-weights", action="store_true",
+                        help="ResNet18 без предобученных весов (то же время, без загрузки весов)")
+    parser.add_argument("--ffmpeg", default=CONFIG["ffmpeg_path"], help="Путь к ffmpeg")
+    parser.add_argument("--keep", action="store_true", help="Не удалять рабочую папку с клипами")
+    parser.add_argument("--json", dest="json_path", help="Сохранить результаты в JSON")
+    parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+    args = parser.parse_args()
+    
+    if "assembly" in args.stages and not {"video", "audio"} <= set(args.stages):
+        parser.error("этап assembly требует этапов video и audio")
+    
+    CONFIG["ffmpeg_path"] = args.ffmpeg
+    init_device(args.device)
+    if args.random_weights or media_cleaner._model is None:
+        from torchvision import models
+        media_cleaner._model = models.resnet18(weights=None).to(media_cleaner.DEVICE).eval().requires_grad_(False)
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    
+    workdir = Path(tempfile.mkdtemp(prefix="mc_bench_"))
+    cases = []
+    
+    print("\n" + "="*70)
+    print(f"🔬 Конвейер: device={media_cleaner.DEVICE}, threads={torch.get_num_threads()}, "
+          f"every_n_frames={args.every_n_frames}, stages={' '.join(args.stages)}")
+    print("="*70)
+    
+    try:
+        for resolution in args.resolutions:
+            width, height = (int(v) for v in resolution.lower().split("x"))
+            for duration in args.durations:
+                for fps in args.fps:
+                    clip = make_clip(args.ffmpeg, workdir / f"clip_{width}x{height}_{fps}fps_{duration:g}s.mp4",
+                                     width, height, duration, fps)
+                    case = {"resolution": [width, height], "duration": duration, "fps": fps,
+                            "clip_bytes": clip.stat().st_size, "stages": {}}
+                    
+                    if set(args.stages) - {"task"}:
+                        case["stages"].update(bench_stages(clip, workdir, args))
+                    if "task" in args.stages:
+                        case["stages"]["task"] = bench_task(clip, workdir, args)
+                    case["peak_rss_mb"] = peak_rss_mb()
+                    cases.append(case)
+                    
+                    summary = "  ".join(
+                        f"{stage}={values.get('wall_sec', 0):.2f}s"
+                        + (f" ({values['fps']:.1f} fps)" if values.get("fps") else "")
+                        for stage, values in case["stages"].items()
+                    )
+                    print(f"{case_key(case):<28} {summary}")
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+    
+    report = {
+        "benchmark": "pipeline",
+        "device": str(media_cleaner.DEVICE),
+        "threads": torch.get_num_threads(),
+        "torch": torch.__version__,
+        "opencv": cv2.__version__,
+        "random_weights": args.random_weights,
+        "every_n_frames": args.every_n_frames,
+        "epsilon": args.epsilon,
+        "audio_level": args.audio_level,
+        "tiled": args.tiled,
+        # peak_rss_mb — пик процесса с начала запуска (для точного пика — один клип на запуск)
+        "cases": cases,
+    }
+    
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n✓ Результаты сохранены: {args.json_path}")
+    
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            compare(report, json.load(f))
+    
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
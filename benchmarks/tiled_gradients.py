@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк тайлового режима градиентов: тайлов в секунду vs размер батча (CPU).
+
+Кадр высокого разрешения режется на тайлы ~224x224, все тайлы проходят
+forward/backward батчами по tile_batch_size. Скрипт измеряет, как пропускная
+способность зависит от размера батча.
+
+Пример:
+    python -m benchmarks.tiled_gradients --resolution 3840x2160 --batch-sizes 1 4 8 16 32
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from media_cleaner import init_device, VideoProcessor, CONFIG
+
+
+def make_frame(width: int, height: int, seed: int = 0) -> np.ndarray:
+    """Синтетический BGR кадр: градиент + шум, чтобы модель не видела пустой кадр."""
+    rng = np.random.default_rng(seed)
+    ramp_x = np.linspace(0, 255, width, dtype=np.float32)[None, :, None]
+    ramp_y = np.linspace(0, 255, height, dtype=np.float32)[:, None, None]
+    frame = (ramp_x * 0.5 + ramp_y * 0.3) + rng.normal(0, 20, (height, width, 3))
+    return np.clip(frame, 0, 255).astype(np.uint8)
+
+
+def bench_batch_size(frame: np.ndarray, batch_size: int, num_eot: int,
+                     tile_size: int, repeats: int) -> dict:
+    """Замеряет тайловый градиент одного кадра для заданного размера батча."""
+    vp = VideoProcessor(num_eot=num_eot, tiled=True,
+                        tile_size=tile_size, tile_batch_size=batch_size)
+    h, w = frame.shape[:2]
+    tiles = vp.tile_grid(h, w)
+    
+    frame_t = torch.from_numpy(frame.astype(np.float32) / 255.0).permute(2, 0, 1)
+    mean = torch.tensor([0.485, 0.456, 0.406]).view(3, 1, 1)
+    std = torch.tensor([0.229, 0.224, 0.225]).view(3, 1, 1)
+    frame_norm = ((frame_t - mean) / std).unsqueeze(0).to(vp.device)
+    
+    # Прогрев (аллокации, выбор алгоритмов)
+    vp._tiled_gradient(frame_norm, tiles[:batch_size])
+    
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        vp._tiled_gradient(frame_norm, tiles)
+        timings.append(time.perf_counter() - start)
+    
+    best = min(timings)
+    return {
+        "batch_size": batch_size,
+        "tiles": len(tiles),
+        "frame_seconds_best": round(best, 4),
+        "frame_seconds_mean": round(sum(timings) / len(timings), 4),
+        "tiles_per_second": round(len(tiles) / best, 2),
+        "tile_eot_passes_per_second": round(len(tiles) * num_eot / best, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк тайлового режима (тайлов/сек vs batch size)")
+    parser.add_argument("--resolution", default="3840x2160", help="Размер кадра WxH (по умолчанию 3840x2160)")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--num-eot", type=int, default=CONFIG["num_eot_transforms"])
+    parser.add_argument("--tile-size", type=int, default=CONFIG["tile_size"])
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--threads", type=int, default=None, help="torch.set_num_threads")
+    parser.add_argument("--json", dest="json_path", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+    
+    width, height = (int(v) for v in args.resolution.lower().split("x"))
+    
+    init_device("cpu")
+    if args.threads:
+        torch.set_num_threads(args.threads)
+    
+    frame = make_frame(width, height)
+    
+    print("\n" + "="*70)
+    print(f"🔬 Тайловый режим: {width}x{height}, tile={args.tile_size}, "
+          f"num_eot={args.num_eot}, threads={torch.get_num_threads()}")
+    print("="*70)
+    print(f"{'batch':>6} {'tiles':>6} {'sec/frame':>10} {'tiles/s':>9}")
+    
+    results = []
+    for bs in args.batch_sizes:
+        row = bench_batch_size(frame, bs, args.num_eot, args.tile_size, args.repeats)
+        results.append(row)
+        print(f"{row['batch_size']:>6} {row['tiles']:>6} {row['frame_seconds_best']:>10.3f} "
+              f"{row['tiles_per_second']:>9.2f}")
+    
+    report = {
+        "benchmark": "tiled_gradients",
+        "device": "cpu",
+        "resolution": [width, height],
+        "tile_size": args.tile_size,
+        "num_eot": args.num_eot,
+        "threads": torch.get_num_threads(),
+        "torch": torch.__version__,
+        "results": results,
+    }
+    
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n✓ Результаты сохранены: {args.json_path}")
+    
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Микро-бенчмарк add_imperceptible_video_noise под torch.profiler.
+
+Перебирает разрешения (480p–4K), num_eot, размеры батча тайлов, число
+потоков и точность (fp32 / bf16 / fp16 через torch.autocast). Для каждой
+комбинации:
+  - время кадра без профайлера (best / mean по --repeats);
+  - разбивка по участкам под профайлером: рабочий код не размечен, участки
+    record_function навешиваются здесь (label_sections) — gradient (EOT-градиент,
+    в тайловом режиме со сшивкой тайлов), distortion, forward; backward —
+    остаток градиента, prepost — кадр без градиента (cvtColor, нормализация,
+    интерполяция, FGSM);
+  - при --trace-dir — Chrome trace (chrome://tracing, ui.perfetto.dev).
+
+add_imperceptible_video_noise при ошибке возвращает исходный кадр, поэтому
+неизменённый кадр считается ошибкой комбинации (например, fp16 autocast
+на CPU), а не быстрым успехом.
+
+Размер батча имеет смысл только в тайловом режиме (--tiled): кадр
+обрабатывается целиком, батч — это tile_batch_size.
+
+Пример:
+    python -m benchmarks.video_noise --resolutions 480p 1080p 4k --num-eot 1 4 \\
+        --threads 1 4 --precisions fp32 bf16 --json noise.json --trace-dir traces
+"""
+
+import argparse
+import itertools
+import json
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from torch import nn
+from torch.profiler import profile, record_function, ProfilerActivity
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import media_cleaner
+from media_cleaner import init_device, VideoProcessor, CONFIG
+from benchmarks.tiled_gradients import make_frame
+
+RESOLUTIONS = {
+    "480p": (854, 480),
+    "720p": (1280, 720),
+    "1080p": (1920, 1080),
+    "1440p": (2560, 1440),
+    "4k": (3840, 2160),
+}
+PRECISIONS = {
+    "fp32": None,
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16,
+}
+# Участки разбивки кадра (мс); backward и prepost — разности измеренных участков
+SECTIONS = ("frame", "gradient", "distortion", "forward", "backward", "prepost")
+
+
+def parse_resolution(value: str) -> tuple:
+    """'1080p' / '4k' или WxH"""
+    if value.lower() in RESOLUTIONS:
+        return RESOLUTIONS[value.lower()]
+    width, height = (int(v) for v in value.lower().split("x"))
+    return width, height
+
+
+class _LabelledModel(nn.Module):
+    """Модель, forward которой виден в профайлере отдельным участком"""
+    
+    def __init__(self, model: nn.Module, name: str):
+        super().__init__()
+        self.model = model
+        self.name = name
+    
+    def forward(self, x):
+        with record_function(self.name):
+            return self.model(x)
+
+
+def _labelled(fn, name: str, depth: list):
+    """fn внутри record_function(name); вложенные вызовы (тайлы → EOT) не размечаются повторно"""
+    def wrapper(*args, **kwargs):
+        if depth[0]:
+            return fn(*args, **kwargs)
+        depth[0] += 1
+        try:
+            with record_function(name):
+                return fn(*args, **kwargs)
+        finally:
+            depth[0] -= 1
+    return wrapper
+
+
+def label_sections(vp: VideoProcessor) -> None:
+    """Размечает участки градиента на экземпляре VideoProcessor (только для бенчмарка)"""
+    depth = [0]
+    vp._eot_gradient = _labelled(vp._eot_gradient, "gradient", depth)
+    vp._tiled_gradient = _labelled(vp._tiled_gradient, "gradient", depth)
+    vp.model = _LabelledModel(vp.model, "forward")
+
+
+def run_frame(vp: VideoProcessor, frame: np.ndarray, precision: str) -> np.ndarray:
+    dtype = PRECISIONS[precision]
+    with record_function("frame"):
+        if dtype is None:
+            return vp.add_imperceptible_video_noise(frame)
+        with torch.autocast(device_type=vp.device.type, dtype=dtype):
+            return vp.add_imperceptible_video_noise(frame)
+
+
+def check_frame(frame: np.ndarray, result: np.ndarray) -> None:
+    """add_imperceptible_video_noise глотает ошибки и возвращает исходный кадр"""
+    if result is frame or np.array_equal(result, frame):
+        raise RuntimeError("кадр не изменён: ошибка обработки или нулевой градиент (см. лог)")
+
+
+def bench_case(frame: np.ndarray, num_eot: int, batch_size: int, precision: str,
+               tiled: bool, repeats: int, trace_path: Path = None) -> dict:
+    """Замер одного кадра: время без профайлера + разбивка по участкам под профайлером."""
+    vp = VideoProcessor(num_eot=num_eot, tiled=tiled, tile_batch_size=batch_size)
+    label_sections(vp)
+    
+    # Прогрев (аллокации, выбор алгоритмов)
+    check_frame(frame, run_frame(vp, frame, precision))
+    
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = run_frame(vp, frame, precision)
+        timings.append(time.perf_counter() - start)
+        check_frame(frame, result)
+    
+    activities = [ProfilerActivity.CPU]
+    if vp.device.type == "cuda":
+        activities.append(ProfilerActivity.CUDA)
+    
+    with profile(activities=activities) as prof:
+        run_frame(vp, frame, precision)
+    
+    if trace_path:
+        prof.export_chrome_trace(str(trace_path))
+    
+    # Время участков (мс, CPU wall включая вложенные операции)
+    events = {event.key: event for event in prof.key_averages()}
+    
+    def section_ms(name: str, attr: str) -> float:
+        event = events.get(name)
+        return getattr(event, attr) / 1000 if event is not None else 0.0
+    
+    clocks = [("", "cpu_time_total")]
+    if vp.device.type == "cuda":
+        clocks.append(("_cuda", "device_time_total"))
+    
+    sections = {}
+    for suffix, attr in clocks:
+        measured = {name: section_ms(name, attr) for name in ("frame", "gradient", "distortion", "forward")}
+        measured["backward"] = measured["gradient"] - measured["distortion"] - measured["forward"]
+        measured["prepost"] = measured["frame"] - measured["gradient"]
+        sections.update({f"{name}{suffix}": round(value, 2) for name, value in measured.items()})
+    
+    best = min(timings)
+    return {
+        "frame_seconds_best": round(best, 4),
+        "frame_seconds_mean": round(sum(timings) / len(timings), 4),
+        "frames_per_second": round(1 / best, 2),
+        "sections_ms": sections,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Микро-бенчмарк add_imperceptible_video_noise (torch.profiler)")
+    parser.add_argument("--resolutions", nargs="+", default=["480p", "720p", "1080p", "4k"],
+                        help="480p/720p/1080p/1440p/4k или WxH")
+    parser.add_argument("--num-eot", type=int, nargs="+", default=[CONFIG["num_eot_transforms"]])
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[CONFIG["tile_batch_size"]],
+                        help="tile_batch_size (только с --tiled)")
+    parser.add_argument("--threads", type=int, nargs="+", default=[torch.get_num_threads()],
+                        help="Значения torch.set_num_threads")
+    parser.add_argument("--precisions", nargs="+", choices=list(PRECISIONS), default=["fp32"])
+    parser.add_argument("--tiled", action="store_true", help="Тайловый режим градиентов")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--device", default="cpu", choices=["cpu", "gpu", "auto"])
+    parser.add_argument("--random-weights", action="store_true",
+                        help="ResNet18 без предобученных весов (то же время, без загрузки весов)")
+    parser.add_argument("--trace-dir", help="Папка для Chrome trace каждой комбинации")
+    parser.add_argument("--json", dest="json_path", help="Сохранить результаты в JSON")
+    args = parser.parse_args()
+    
+    init_device(args.device)
+    if args.random_weights or media_cleaner._model is None:
+        from torchvision import models
+        media_cleaner._model = models.resnet18(weights=None).to(media_cleaner.DEVICE).eval().requires_grad_(False)
+    
+    # random_distortion вызывается из _eot_gradient через глобальное имя модуля
+    media_cleaner.random_distortion = _labelled(media_cleaner.random_distortion, "distortion", [0])
+    
+    trace_dir = Path(args.trace_dir) if args.trace_dir else None
+    if trace_dir:
+        trace_dir.mkdir(parents=True, exist_ok=True)
+    
+    batch_sizes = args.batch_sizes if args.tiled else [CONFIG["tile_batch_size"]]
+    
+    print("\n" + "="*70)
+    print(f"🔬 add_imperceptible_video_noise: device={media_cleaner.DEVICE}, tiled={args.tiled}, "
+          f"repeats={args.repeats}")
+    print("="*70)
+    print(f"{'resolution':>11} {'eot':>4} {'batch':>6} {'thr':>4} {'prec':>5} {'sec/frame':>10}  "
+          + " ".join(f"{name[:8]:>8}" for name in SECTIONS))
+    
+    results = []
+    for resolution in args.resolutions:
+        width, height = parse_resolution(resolution)
+        frame = make_frame(width, height)
+        for num_eot, batch_size, threads, precision in itertools.product(
+                args.num_eot, batch_sizes, args.threads, args.precisions):
+            torch.set_num_threads(threads)
+            torch.manual_seed(0)
+            np.random.seed(0)
+            
+            batch_tag = f"_b{batch_size}" if args.tiled else ""
+            case = f"{width}x{height}_eot{num_eot}{batch_tag}_t{threads}_{precision}"
+            trace_path = trace_dir / f"{case}.json" if trace_dir else None
+            row = {
+                "resolution": [width, height],
+                "num_eot": num_eot,
+                "batch_size": batch_size if args.tiled else None,
+                "threads": threads,
+                "precision": precision,
+            }
+            try:
+                row.update(bench_case(frame, num_eot, batch_size, precision, args.tiled,
+                                      args.repeats, trace_path))
+            except RuntimeError as e:
+                # Например, fp16 autocast на CPU старых версий torch
+                row["error"] = str(e).splitlines()[0]
+                print(f"{width}x{height:<5} {num_eot:>4} {batch_size:>6} {threads:>4} {precision:>5}  [ERROR] {row['error']}")
+                results.append(row)
+                continue
+            if trace_path:
+                row["trace"] = str(trace_path)
+            results.append(row)
+            
+            sections = row["sections_ms"]
+            print(f"{width}x{height:<5} {num_eot:>4} {batch_size if args.tiled else '-':>6} {threads:>4} "
+                  f"{precision:>5} {row['frame_seconds_best']:>10.3f}  "
+                  + " ".join(f"{sections.get(name, 0):>8.1f}" for name in SECTIONS))
+    
+    print("\nУчастки — мс на кадр (CPU wall, под профайлером)")
+    
+    report = {
+        "benchmark": "video_noise",
+        "device": str(media_cleaner.DEVICE),
+        "tiled": args.tiled,
+        "random_weights": args.random_weights,
+        "torch": torch.__version__,
+        "results": results,
+    }
+    
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n✓ Результаты сохранены: {args.json_path}")
+    
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -56,7 +56,6 @@ def check_dependencies():
         'torch': 'torch',
         'torchvision': 'torchvision',
         'PIL': 'Pillow',
-        'librosa': 'librosa',
         'soundfile': 'soundfile',
         'numpy': 'numpy',
         'tqdm': 'tqdm'
@@ -109,7 +108,6 @@ def build_exe():
         "--add-data", f"ffmpeg{os.pathsep}ffmpeg",  # Включаем ffmpeg
         "--hidden-import=cv2",          # Скрытый импорт OpenCV
         "--hidden-import=torch",        # Скрытый импорт PyTorch
-        "--hidden-import=librosa",      # Скрытый импорт librosa
         "--hidden-import=soundfile",    # Скрытый импорт soundfile
         "--collect-all=torch",          # Собрать все файлы torch
         "--collect-all=torchvision",    # Собрать все файлы torchvision
@@ -4,19 +4,77 @@
 """
 
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+import csv
+import glob
 import json
 import argparse
+import random
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+from email.utils import parsedate_to_datetime
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
+from itertools import islice
 import time
 
+# Форматы видео для пакетной обработки папки
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.avi', '.mkv', '.webm'}
+
+# Статусы ответа, после которых запрос имеет смысл повторить
+RETRY_STATUSES = {429, 502, 503, 504}
+
+FINAL_STATUSES = {'completed', 'failed', 'cancelled'}
+
+# Поля задачи при опросе статусов пакета (компактный ответ /tasks)
+BATCH_POLL_FIELDS = ['task_id', 'status', 'progress', 'error_message']
+
+# Поля манифеста пакетной обработки (CSV)
+MANIFEST_FIELDS = [
+    'file', 'task_id', 'status', 'progress', 'attempts',
+    'output', 'error', 'uploaded_at', 'finished_at', 'elapsed_sec',
+]
+
+
+def _retry_after(response) -> Optional[float]:
+    """Задержка из заголовка Retry-After (секунды или HTTP-дата)"""
+    if response is None:
+        return None
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now().astimezone()).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+
+def _not_sent(error: requests.RequestException) -> bool:
+    """Запрос точно не дошёл до сервера: соединение так и не установлено"""
+    if isinstance(error, requests.ConnectTimeout):
+        return True
+    reason = getattr(error.args[0], 'reason', None) if error.args else None
+    return isinstance(error, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
 
 class MediaCleanerClient:
     """Клиент для работы с API сервера"""
     
-    def __init__(self, server_url: str = "http://localhost:8000"):
+    def __init__(self, server_url: str = "http://localhost:8000", pool_size: int = 10):
         self.server_url = server_url.rstrip("/")
         self.session = requests.Session()
+        self.set_pool_size(pool_size)
+    
+    def set_pool_size(self, pool_size: int) -> None:
+        """Размер пула keep-alive соединений сессии (для параллельных запросов)"""
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
     
     def upload_video(self, 
                     video_path: str,
@@ -25,7 +83,9 @@ class MediaCleanerClient:
                     audio_level: Optional[str] = "слабый",
                     every_n_frames: int = 10,
                     user_id: Optional[str] = None,
-                    notes: Optional[str] = None) -> dict:
+                    notes: Optional[str] = None,
+                    priority: Optional[str] = None,
+                    verbose: bool = True) -> dict:
         """
         Загрузить видео на сервер
         
@@ -37,6 +97,8 @@ class MediaCleanerClient:
             every_n_frames: Применять к каждому N-му кадру
             user_id: ID пользователя
             notes: Заметки
+            priority: Класс приоритета ("interactive" / "batch"), по умолчанию — серверный
+            verbose: Печатать ход загрузки
         
         Returns:
             Ответ сервера с task_id
@@ -46,7 +108,8 @@ class MediaCleanerClient:
         if not video_path.exists():
             raise FileNotFoundError(f"Файл не найден: {video_path}")
         
-        print(f"📤 Загрузка видео: {video_path.name}")
+        if verbose:
+            print(f"📤 Загрузка видео: {video_path.name}")
         
         with open(video_path, 'rb') as f:
             files = {'file': (video_path.name, f)}
@@ -61,6 +124,8 @@ class MediaCleanerClient:
                 params['user_id'] = user_id
             if notes:
                 params['notes'] = notes
+            if priority:
+                params['priority'] = priority
             
             response = self.session.post(
                 f"{self.server_url}/upload",
@@ -71,35 +136,103 @@ class MediaCleanerClient:
         response.raise_for_status()
         result = response.json()
         
-        if result['status'] == 'success':
+        if result['status'] == 'success' and verbose:
             print(f"✅ Видео загружено успешно!")
             print(f"📌 Task ID: {result['task_id']}")
             print(f"📊 Статус: {result['task']['status_text']}")
         
         return result
     
-    def get_task_status(self, task_id: str) -> dict:
+    def get_task_status(self, task_id: str, wait_seconds: Optional[float] = None,
+                        since_version: Optional[int] = None) -> dict:
         """
         Получить статус задачи
         
         Args:
             task_id: ID задачи
+            wait_seconds: Long-poll — ждать изменения задачи до N секунд
+            since_version: Версия задачи, уже известная клиенту
         
         Returns:
             Информация о задаче
         """
-        response = self.session.get(f"{self.server_url}/task/{task_id}")
+        params = {}
+        timeout = None
+        if wait_seconds:
+            params['wait_seconds'] = wait_seconds
+            timeout = (10, wait_seconds + 30)
+        if since_version is not None:
+            params['since_version'] = since_version
+        
+        response = self.session.get(f"{self.server_url}/task/{task_id}", params=params, timeout=timeout)
         response.raise_for_status()
         return response.json()['task']
     
-    def wait_for_completion(self, task_id: str, check_interval: int = 5, timeout: int = 3600) -> dict:
+    def watch_task(self, task_id: str, read_timeout: float = 60):
+        """
+        Поток состояний задачи через SSE (/task/{id}/events)
+        
+        Args:
+            task_id: ID задачи
+            read_timeout: Таймаут чтения (сервер шлёт keepalive чаще)
+        
+        Yields:
+            Состояние задачи при каждом изменении (до завершения)
+        """
+        with self.session.get(
+            f"{self.server_url}/task/{task_id}/events",
+            stream=True,
+            headers={'Accept': 'text/event-stream'},
+            timeout=(10, read_timeout)
+        ) as response:
+            response.raise_for_status()
+            data_lines = []
+            for line in response.iter_lines(decode_unicode=True):
+                if line is None:
+                    continue
+                if line.startswith('data:'):
+                    data_lines.append(line[5:].lstrip())
+                elif not line and data_lines:
+                    yield json.loads("\n".join(data_lines))
+                    data_lines = []
+    
+    def _report_finished(self, task: dict, elapsed_min: int) -> bool:
+        """Печатает итог задачи; True если задача завершена"""
+        if task['status'] == 'completed':
+            print(f"\n✅ Задача завершена за {elapsed_min} минут!")
+            print(f"📁 Выходной файл: {task['output_video']}")
+            return True
+        
+        elif task['status'] == 'failed':
+            print(f"\n❌ Задача завершена с ошибкой!")
+            print(f"❌ Ошибка: {task['error_message']}")
+            return True
+        
+        elif task['status'] == 'cancelled':
+            print(f"\n🚫 Задача отменена")
+            return True
+        
+        return False
+    
+    def _report_progress(self, task: dict, elapsed_min: int) -> None:
+        eta = task.get('eta_seconds')
+        eta_text = f" | Осталось: ~{eta:.0f}с" if eta else ""
+        print(f"\r⏳ Обработка... {task['progress']:.0f}% | Статус: {task['status_text']} | Прошло: {elapsed_min}м{eta_text}", end='')
+    
+    def wait_for_completion(self, task_id: str, check_interval: int = 5, timeout: int = 3600,
+                            use_events: bool = True, long_poll: float = 30,
+                            min_interval: float = 1.0) -> dict:
         """
         Ждать завершения обработки
         
         Args:
             task_id: ID задачи
-            check_interval: Интервал проверки в секундах
+            check_interval: Минимальный интервал между запросами, если сервер не держит long-poll
             timeout: Максимальное время ожидания в секундах
+            use_events: Получать обновления через SSE; при ошибке — long-poll /task/{id}
+            long_poll: Сколько сервер держит запрос в ожидании изменения (сек)
+            min_interval: Минимальный интервал между запросами при частых изменениях
+                          (изменения за это время придут следующим ответом сразу)
         
         Returns:
             Информация о завершённой задаче
@@ -107,42 +240,59 @@ class MediaCleanerClient:
         
         start_time = time.time()
         
+        if use_events:
+            task = None
+            try:
+                for task in self.watch_task(task_id):
+                    elapsed = time.time() - start_time
+                    if self._report_finished(task, int(elapsed / 60)):
+                        return task
+                    self._report_progress(task, int(elapsed / 60))
+                    
+                    if elapsed > timeout:
+                        print(f"\n⏱️  Таймаут: обработка заняла больше {timeout//60} минут")
+                        return task
+            except (requests.RequestException, ValueError) as e:
+                print(f"\n⚠️  Поток событий недоступен ({e}), переход на опрос")
+        
+        version = None
         while True:
-            task = self.get_task_status(task_id)
+            requested = time.time()
+            # Первый запрос — текущее состояние, дальше ждём изменений относительно version
+            task = self.get_task_status(task_id, wait_seconds=long_poll if version is not None else None,
+                                        since_version=version)
             
             elapsed = time.time() - start_time
             elapsed_min = int(elapsed / 60)
             
-            if task['status'] == 'completed':
-                print(f"\n✅ Задача завершена за {elapsed_min} минут!")
-                print(f"📁 Выходной файл: {task['output_video']}")
-                return task
-            
-            elif task['status'] == 'failed':
-                print(f"\n❌ Задача завершена с ошибкой!")
-                print(f"❌ Ошибка: {task['error_message']}")
-                return task
-            
-            elif task['status'] == 'cancelled':
-                print(f"\n🚫 Задача отменена")
+            if self._report_finished(task, elapsed_min):
                 return task
             
             # Показываем прогресс
-            print(f"\r⏳ Обработка... {task['progress']:.0f}% | Статус: {task['status_text']} | Прошло: {elapsed_min}м", end='')
+            self._report_progress(task, elapsed_min)
             
             if elapsed > timeout:
                 print(f"\n⏱️  Таймаут: обработка заняла больше {timeout//60} минут")
                 return task
             
-            time.sleep(check_interval)
+            # Сервер без long-poll (или без версий) отвечает сразу — не опрашиваем чаще check_interval
+            since_request = time.time() - requested
+            if task.get('version') == version:
+                if since_request < check_interval:
+                    time.sleep(check_interval - since_request)
+            elif since_request < min_interval:
+                time.sleep(min_interval - since_request)
+            version = task.get('version')
     
-    def download_result(self, task_id: str, output_path: Optional[str] = None) -> str:
+    def download_result(self, task_id: str, output_path: Optional[str] = None,
+                        verbose: bool = True) -> str:
         """
         Скачать обработанное видео
         
         Args:
             task_id: ID задачи
             output_path: Путь для сохранения (по умолчанию текущая папка)
+            verbose: Печатать ход скачивания
         
         Returns:
             Путь к скачанному файлу
@@ -159,7 +309,8 @@ class MediaCleanerClient:
         else:
             filepath = Path(filename)
         
-        print(f"📥 Скачивание файла: {filename}")
+        if verbose:
+            print(f"📥 Скачивание файла: {filename}")
         
         response = self.session.get(f"{self.server_url}/download/{task_id}", stream=True)
         response.raise_for_status()
@@ -172,33 +323,63 @@ class MediaCleanerClient:
                 f.write(chunk)
                 downloaded += len(chunk)
                 
-                if total_size:
+                if total_size and verbose:
                     percent = (downloaded / total_size) * 100
                     print(f"\r  {downloaded//(1024*1024)}MB / {total_size//(1024*1024)}MB ({percent:.1f}%)", end='')
         
-        print(f"\n✅ Файл сохранён: {filepath}")
+        if verbose:
+            print(f"\n✅ Файл сохранён: {filepath}")
         return str(filepath)
     
-    def list_tasks(self, user_id: Optional[str] = None, status: Optional[str] = None) -> list:
+    def iter_tasks(self, user_id: Optional[str] = None, status: Optional[str] = None,
+                   page_size: int = 100, fields: Optional[list] = None):
         """
-        Получить список задач
+        Перебрать задачи постранично (новые первыми), следуя next_cursor
         
         Args:
             user_id: Фильтр по ID пользователя
             status: Фильтр по статусу
+            page_size: Размер страницы
+            fields: Список полей задачи (компактный ответ)
         
-        Returns:
-            Список задач
+        Yields:
+            Задачи
         """
-        params = {}
+        params = {'limit': page_size}
         if user_id:
             params['user_id'] = user_id
         if status:
             params['status'] = status
+        if fields:
+            params['fields'] = ",".join(fields)
         
-        response = self.session.get(f"{self.server_url}/tasks", params=params)
-        response.raise_for_status()
-        return response.json()['tasks']
+        while True:
+            response = self.session.get(f"{self.server_url}/tasks", params=params)
+            response.raise_for_status()
+            data = response.json()
+            yield from data['tasks']
+            
+            if not data.get('next_cursor'):
+                return
+            params['cursor'] = data['next_cursor']
+    
+    def list_tasks(self, user_id: Optional[str] = None, status: Optional[str] = None,
+                   limit: Optional[int] = None, fields: Optional[list] = None) -> list:
+        """
+        Получить список задач
+        
+        Args:
+            user_id: Фильтр по ID пользователя
+            status: Фильтр по статусу
+            limit: Максимум задач (None — все страницы)
+            fields: Список полей задачи
+        
+        Returns:
+            Список задач
+        """
+        page_size = min(limit, 500) if limit else 100
+        tasks = self.iter_tasks(user_id=user_id, status=status, page_size=page_size, fields=fields)
+        return list(islice(tasks, limit))
     
     def cancel_task(self, task_id: str) -> dict:
         """
@@ -220,6 +401,225 @@ class MediaCleanerClient:
         response.raise_for_status()
         return response.json()
     
+    def with_retry(self, fn: Callable, retries: int = 3, backoff: float = 2.0,
+                   max_backoff: float = 60.0, deadline: Optional[float] = None,
+                   idempotent: bool = True):
+        """
+        Выполнить запрос с повторами.
+        
+        Повторяются ошибки сети и ответы 429/502/503/504 с экспоненциальной
+        задержкой (с джиттером). Ответ 429 — занятость сервера: ждём Retry-After
+        и не расходуем попытки, пока не наступит deadline (time.time()).
+        Неидемпотентный запрос (загрузка) повторяется только после 429 и если
+        соединение не установилось: иначе сервер мог уже создать задачу.
+        
+        Args:
+            fn: Функция запроса (должна бросать requests.RequestException)
+            retries: Повторов при ошибках (кроме 429)
+            backoff: Начальная задержка в секундах
+            max_backoff: Максимальная задержка
+            deadline: Время, после которого не повторять
+            idempotent: Можно ли повторять запрос, уже дошедший до сервера
+        
+        Returns:
+            Результат fn
+        """
+        attempt = 0
+        while True:
+            try:
+                return fn()
+            except requests.RequestException as e:
+                response = getattr(e, 'response', None)
+                status = response.status_code if response is not None else None
+                if status is not None and status not in RETRY_STATUSES:
+                    raise
+                if not idempotent and status != 429 and not _not_sent(e):
+                    raise
+                
+                if status != 429:
+                    if attempt >= retries:
+                        raise
+                    attempt += 1
+                
+                delay = _retry_after(response)
+                if delay is None:
+                    delay = min(max_backoff, backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+                if deadline is not None and time.time() + delay > deadline:
+                    raise
+                time.sleep(delay)
+    
+    @staticmethod
+    def collect_videos(source: str) -> list:
+        """Видео-файлы папки (по расширению) или файлы по glob-шаблону"""
+        path = Path(source)
+        if path.is_dir():
+            files = [p for p in path.iterdir() if p.is_file() and p.suffix.lower() in VIDEO_EXTENSIONS]
+        else:
+            files = [Path(p) for p in glob.glob(source, recursive=True) if Path(p).is_file()]
+        return sorted(files)
+    
+    def batch_process(self, source: str, output_dir: Optional[str] = None,
+                      concurrency: int = 4, retries: int = 3,
+                      check_interval: float = 5, timeout: float = 24 * 3600,
+                      manifest_path: Optional[str] = None, **upload_params) -> list:
+        """
+        Пакетная обработка: параллельная загрузка, отслеживание задач,
+        скачивание результатов по мере завершения и манифест.
+        
+        Args:
+            source: Папка с видео или glob-шаблон
+            output_dir: Папка для результатов (None — не скачивать)
+            concurrency: Одновременных загрузок (и столько же скачиваний)
+            retries: Повторов при ошибках загрузки/скачивания
+            check_interval: Интервал опроса статусов задач в секундах
+            timeout: Максимальное время всей обработки в секундах
+            manifest_path: Манифест (.json или .csv), по умолчанию batch_manifest_<время>.json
+            **upload_params: Параметры upload_video (epsilon, audio_level, user_id, ...);
+                без user_id задачи пакета получают user_id batch_<время>
+        
+        Returns:
+            Записи манифеста (по одной на файл)
+        """
+        files = self.collect_videos(source)
+        if not files:
+            raise FileNotFoundError(f"Видео не найдены: {source}")
+        
+        if output_dir:
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        if not manifest_path:
+            manifest_path = str(Path(output_dir or '.') / f"batch_manifest_{stamp}.json")
+        
+        # Статусы задач пакета опрашиваются одной выборкой /tasks по user_id
+        user_id = upload_params.get('user_id') or f"batch_{stamp}"
+        upload_params['user_id'] = user_id
+        
+        # Загрузки, скачивания и опрос статусов идут через одну сессию
+        self.set_pool_size(2 * concurrency + 1)
+        
+        items = []
+        for path in files:
+            item = dict.fromkeys(MANIFEST_FIELDS)
+            item.update(file=str(path), status='queued', attempts=0)
+            items.append(item)
+        start_time = time.time()
+        deadline = start_time + timeout
+        print(f"📦 Пакет: {len(items)} видео, параллельно {concurrency}")
+        
+        def upload(item):
+            def attempt():
+                item['attempts'] += 1
+                return self.upload_video(item['file'], verbose=False, **upload_params)
+            try:
+                result = self.with_retry(attempt, retries=retries, deadline=deadline, idempotent=False)
+                item.update(task_id=result['task_id'], status='pending',
+                            uploaded_at=datetime.now().isoformat(timespec='seconds'))
+                print(f"📤 {Path(item['file']).name} → {item['task_id']}")
+            except Exception as e:
+                item.update(status='upload_failed', error=str(e))
+                print(f"❌ {Path(item['file']).name}: загрузка не удалась: {e}")
+        
+        def download(item):
+            try:
+                item['output'] = self.with_retry(
+                    lambda: self.download_result(item['task_id'], output_dir, verbose=False),
+                    retries=retries, deadline=deadline
+                )
+                print(f"📥 {Path(item['file']).name} → {item['output']}")
+            except Exception as e:
+                item.update(status='download_failed', error=str(e))
+                print(f"❌ {Path(item['file']).name}: скачивание не удалось: {e}")
+        
+        def finish(item, task):
+            item.update(
+                status=task['status'],
+                progress=task.get('progress'),
+                error=task.get('error_message'),
+                finished_at=datetime.now().isoformat(timespec='seconds'),
+                elapsed_sec=round(time.time() - start_time, 1)
+            )
+        
+        try:
+            with ThreadPoolExecutor(concurrency, thread_name_prefix='BatchUpload') as uploads, \
+                    ThreadPoolExecutor(concurrency, thread_name_prefix='BatchDownload') as downloads:
+                upload_futures = {uploads.submit(upload, item): item for item in items}
+                pending_uploads = set(upload_futures)
+                active = {}
+                last_poll = 0.0
+                
+                while pending_uploads or active:
+                    if pending_uploads:
+                        done, pending_uploads = wait(pending_uploads, timeout=check_interval,
+                                                     return_when=FIRST_COMPLETED)
+                        for future in done:
+                            item = upload_futures[future]
+                            if item['task_id']:
+                                active[item['task_id']] = item
+                    else:
+                        time.sleep(max(0.0, check_interval - (time.time() - last_poll)))
+                    
+                    if time.time() - last_poll < check_interval:
+                        continue
+                    last_poll = time.time()
+                    
+                    # Новые первыми: задачи пакета — на первых страницах
+                    polled = []
+                    try:
+                        tasks = self.iter_tasks(user_id=user_id, page_size=min(500, max(1, len(active))),
+                                                fields=BATCH_POLL_FIELDS) if active else ()
+                        for task in tasks:
+                            if task['task_id'] in active:
+                                polled.append(task)
+                                if len(polled) == len(active):
+                                    break
+                    except requests.RequestException:
+                        pass
+                    
+                    for task in polled:
+                        task_id = task['task_id']
+                        item = active[task_id]
+                        item['progress'] = task.get('progress')
+                        if task['status'] not in FINAL_STATUSES:
+                            item['status'] = task['status']
+                            continue
+                        
+                        del active[task_id]
+                        finish(item, task)
+                        print(f"{'✅' if task['status'] == 'completed' else '❌'} {Path(item['file']).name}: {task['status']}")
+                        if task['status'] == 'completed' and output_dir:
+                            downloads.submit(download, item)
+                    
+                    if time.time() > deadline:
+                        for item in active.values():
+                            item.update(status='timeout', error=f"Не завершено за {timeout:.0f} с")
+                        active.clear()
+                        for future in pending_uploads:
+                            future.cancel()
+                        break
+                    
+                    counts = {}
+                    for item in items:
+                        counts[item['status']] = counts.get(item['status'], 0) + 1
+                    print("⏳ " + ", ".join(f"{status}: {count}" for status, count in sorted(counts.items())))
+        finally:
+            self.write_manifest(items, manifest_path)
+            print(f"🗂️  Манифест: {manifest_path}")
+        
+        return items
+    
+    @staticmethod
+    def write_manifest(items: list, path: str) -> None:
+        """Сохранить манифест пакета: CSV для *.csv, иначе JSON"""
+        path = Path(path)
+        if path.suffix.lower() == '.csv':
+            with open(path, 'w', newline='', encoding='utf-8') as f:
+                writer = csv.DictWriter(f, fieldnames=MANIFEST_FIELDS, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(items)
+        else:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(items, f, indent=2, ensure_ascii=False)
+    
     def health_check(self) -> bool:
         """Проверить здоровье сервера"""
         try:
@@ -253,19 +653,41 @@ def main():
     upload_parser.add_argument('--frames', type=int, default=10, help='Каждый N-й кадр')
     upload_parser.add_argument('--user', help='ID пользователя')
     upload_parser.add_argument('--notes', help='Заметки')
+    upload_parser.add_argument('--priority', help='Класс приоритета (interactive/batch)')
     upload_parser.add_argument('--wait', action='store_true', help='Ждать завершения')
+    upload_parser.add_argument('--poll', action='store_true', help='Ждать опросом вместо потока событий')
     upload_parser.add_argument('--download', help='Скачать результат в папку')
     
     # Команда status
     status_parser = subparsers.add_parser('status', help='Получить статус задачи')
     status_parser.add_argument('task_id', help='ID задачи')
     status_parser.add_argument('--wait', action='store_true', help='Ждать завершения')
+    status_parser.add_argument('--poll', action='store_true', help='Ждать опросом вместо потока событий')
     status_parser.add_argument('--download', help='Скачать результат в папку')
     
     # Команда list
     list_parser = subparsers.add_parser('list', help='Список задач')
     list_parser.add_argument('--user', help='Фильтр по пользователю')
     list_parser.add_argument('--status', help='Фильтр по статусу')
+    list_parser.add_argument('--limit', type=int, help='Максимум задач (по умолчанию все)')
+    list_parser.add_argument('--fields', help='Поля через запятую (например, task_id,status,progress)')
+    
+    # Команда batch
+    batch_parser = subparsers.add_parser('batch', help='Пакетная обработка папки или glob-шаблона')
+    batch_parser.add_argument('source', help='Папка с видео или шаблон (например, "clips/*.mp4")')
+    batch_parser.add_argument('--output', help='Скачать результаты в папку')
+    batch_parser.add_argument('--concurrency', type=int, default=4, help='Одновременных загрузок/скачиваний')
+    batch_parser.add_argument('--retries', type=int, default=3, help='Повторов при ошибках')
+    batch_parser.add_argument('--interval', type=float, default=5, help='Интервал опроса статусов (сек)')
+    batch_parser.add_argument('--timeout', type=float, default=24 * 3600, help='Максимальное время пакета (сек)')
+    batch_parser.add_argument('--manifest', help='Файл манифеста (.json или .csv)')
+    batch_parser.add_argument('--epsilon', type=float, default=0.120, help='Сила шума')
+    batch_parser.add_argument('--strength', type=float, default=1.0, help='Множитель')
+    batch_parser.add_argument('--audio', default='слабый', help='Уровень аудио')
+    batch_parser.add_argument('--frames', type=int, default=10, help='Каждый N-й кадр')
+    batch_parser.add_argument('--user', help='ID пользователя')
+    batch_parser.add_argument('--notes', help='Заметки')
+    batch_parser.add_argument('--priority', default='batch', help='Класс приоритета (по умолчанию batch)')
     
     # Команда stats
     subparsers.add_parser('stats', help='Статистика сервера')
@@ -295,19 +717,20 @@ def main():
                 audio_level=args.audio,
                 every_n_frames=args.frames,
                 user_id=args.user,
-                notes=args.notes
+                notes=args.notes,
+                priority=args.priority
             )
             
             task_id = result['task_id']
             
             if args.wait:
-                task = client.wait_for_completion(task_id)
+                task = client.wait_for_completion(task_id, use_events=not args.poll)
                 if task['status'] == 'completed' and args.download:
                     client.download_result(task_id, args.download)
         
         elif args.command == 'status':
             if args.wait:
-                task = client.wait_for_completion(args.task_id)
+                task = client.wait_for_completion(args.task_id, use_events=not args.poll)
             else:
                 task = client.get_task_status(args.task_id)
             
@@ -318,16 +741,44 @@ def main():
                 client.download_result(args.task_id, args.download)
         
         elif args.command == 'list':
-            tasks = client.list_tasks(user_id=args.user, status=args.status)
+            fields = args.fields.split(',') if args.fields else None
+            tasks = client.list_tasks(user_id=args.user, status=args.status,
+                                      limit=args.limit, fields=fields)
             
             print(f"\n📋 Найдено задач: {len(tasks)}\n")
             for task in tasks:
+                if fields:
+                    print("  " + " | ".join(f"{name}={task.get(name)}" for name in fields))
+                    continue
                 print(f"  ID: {task['task_id']}")
                 print(f"  Статус: {task['status_text']}")
                 print(f"  Видео: {task['input_video']}")
                 print(f"  Прогресс: {task['progress']:.0f}%")
                 print()
         
+        elif args.command == 'batch':
+            items = client.batch_process(
+                args.source,
+                output_dir=args.output,
+                concurrency=args.concurrency,
+                retries=args.retries,
+                check_interval=args.interval,
+                timeout=args.timeout,
+                manifest_path=args.manifest,
+                epsilon=args.epsilon,
+                video_strength=args.strength,
+                audio_level=args.audio,
+                every_n_frames=args.frames,
+                user_id=args.user,
+                notes=args.notes,
+                priority=args.priority
+            )
+            
+            completed = sum(1 for item in items if item['status'] == 'completed')
+            print(f"\n📊 Готово: {completed} из {len(items)}")
+            if completed < len(items):
+                return 1
+        
         elif args.command == 'stats':
             stats = client.get_stats()
             print(f"\n📊 Статистика сервера:")
@@ -169,10 +169,10 @@ SyslogIdentifier=media-cleaner-api
 WantedBy=multi-user.target
 EOF
 
-# Сервис для Flask
+# Сервис для веб интерфейса
 cat > /etc/systemd/system/media-cleaner-web.service <<EOF
 [Unit]
-Description=Media Cleaner Web Interface (Flask)
+Description=Media Cleaner Web Interface
 After=network.target
 
 [Service]
@@ -181,12 +181,12 @@ WorkingDirectory=$APP_DIR
 Environment="PATH=$APP_DIR/venv/bin"
 ExecStart=$APP_DIR/venv/bin/python -m gunicorn \\
     --workers 4 \\
-    --worker-class sync \\
+    --worker-class uvicorn.workers.UvicornWorker \\
     --bind 127.0.0.1:5000 \\
     --access-logfile $APP_DIR/logs/gunicorn_access.log \\
     --error-logfile $APP_DIR/logs/gunicorn_error.log \\
     --log-level info \\
-    main:app
+    web_interface:app
 Restart=always
 RestartSec=10
 StandardOutput=journal
@@ -216,9 +216,9 @@ else
 fi
 
 if systemctl is-active --quiet media-cleaner-web; then
-    log_info "Flask сервис работает"
+    log_info "Сервис веб интерфейса работает"
 else
-    log_error "Flask сервис НЕ работает! Проверьте логи:"
+    log_error "Сервис веб интерфейса НЕ работает! Проверьте логи:"
     journalctl -u media-cleaner-web -n 20
 fi
 
@@ -391,9 +391,9 @@ else
 fi
 
 if curl -s http://127.0.0.1:5000 > /dev/null; then
-    echo -e "${GREEN}✓ Flask доступен на http://127.0.0.1:5000${NC}"
+    echo -e "${GREEN}✓ Веб интерфейс доступен на http://127.0.0.1:5000${NC}"
 else
-    echo -e "${RED}✗ Flask недоступен${NC}"
+    echo -e "${RED}✗ Веб интерфейс недоступен${NC}"
 fi
 
 echo ""
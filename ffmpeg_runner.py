@@ -0,0 +1,209 @@
+"""
+Общий запуск ffmpeg с разбором прогресса в реальном времени
+
+ffmpeg запускается с -progress pipe:1 -nostats: прогресс (out_time, fps, speed)
+читается построчно из stdout, stderr хранится в кольцевом буфере ограниченного размера.
+"""
+
+import logging
+import subprocess
+import threading
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, List, Optional, Tuple
+
+import server_metrics
+
+logger = logging.getLogger(__name__)
+
+# Сколько последних строк stderr хранить для сообщения об ошибке
+STDERR_TAIL_LINES = 200
+
+# Минимальный интервал между вызовами progress_fn (секунды)
+PROGRESS_INTERVAL = 1.0
+
+
+class ProcessingCancelled(Exception):
+    """Обработка остановлена по should_cancel_fn (задача отменена или упала)"""
+
+
+def _parse_speed(value: str) -> Optional[float]:
+    """'1.25x' -> 1.25, 'N/A' -> None"""
+    try:
+        return float(value.rstrip("x"))
+    except (ValueError, AttributeError):
+        return None
+
+
+def _parse_out_time(block: Dict[str, str]) -> Optional[float]:
+    """Позиция вывода в секундах (out_time_us, у старых версий — out_time_ms в мкс)"""
+    for key in ("out_time_us", "out_time_ms"):
+        value = block.get(key)
+        if value and value != "N/A":
+            try:
+                return max(0.0, int(value) / 1_000_000)
+            except ValueError:
+                pass
+    return None
+
+
+def drain_stderr(proc: subprocess.Popen,
+                 lines: int = STDERR_TAIL_LINES) -> Tuple[threading.Thread, Deque[str]]:
+    """
+    Читает stderr процесса в фоновом потоке, чтобы ffmpeg не блокировался
+    на заполненном pipe, пока вызывающий читает stdout.
+    
+    Returns:
+        (поток чтения — join после завершения процесса, кольцевой буфер последних строк)
+    """
+    tail: Deque[str] = deque(maxlen=lines)
+    
+    def drain():
+        for line in iter(proc.stderr.readline, b""):
+            tail.append(line.decode(errors="replace").rstrip())
+    
+    thread = threading.Thread(target=drain, daemon=True, name="FFmpegStderr")
+    thread.start()
+    return thread, tail
+
+
+def run_ffmpeg(cmd: List[str],
+               duration: Optional[float] = None,
+               progress_fn: Optional[Callable[[Dict], None]] = None,
+               min_interval: float = PROGRESS_INTERVAL,
+               stdin_feed: Optional[Callable] = None,
+               stderr_lines: int = STDERR_TAIL_LINES,
+               should_cancel_fn: Optional[Callable[[], bool]] = None) -> List[str]:
+    """
+    Запускает ffmpeg и сообщает прогресс по мере кодирования.
+    
+    Args:
+        cmd: Команда ffmpeg (первый элемент — путь к ffmpeg, stdout не должен использоваться)
+        duration: Ожидаемая длительность результата в секундах (для доли и ETA)
+        progress_fn: Колбэк с dict {out_time, fraction, fps, speed, frame, eta_seconds};
+                     вызывается не чаще min_interval и всегда в конце
+        min_interval: Минимальный интервал между вызовами progress_fn
+        stdin_feed: Функция, которая пишет входные данные в stdin ffmpeg (в отдельном потоке)
+        stderr_lines: Размер кольцевого буфера stderr
+        should_cancel_fn: Проверяется на каждом блоке прогресса; True — ffmpeg завершается
+    
+    Returns:
+        Последние строки stderr
+    
+    Raises:
+        RuntimeError: ffmpeg завершился с ошибкой (в сообщении — хвост stderr)
+        ProcessingCancelled: ffmpeg остановлен по should_cancel_fn
+    """
+    full_cmd = [cmd[0], "-progress", "pipe:1", "-nostats"] + list(cmd[1:])
+    server_metrics.FFMPEG_RUNS.inc()
+    
+    proc = subprocess.Popen(
+        full_cmd,
+        stdin=subprocess.PIPE if stdin_feed else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+    )
+    
+    feed_errors = []
+    
+    def feed_stdin():
+        try:
+            stdin_feed(proc.stdin)
+        except (BrokenPipeError, ValueError):
+            # ffmpeg закрыл вход раньше (например, -shortest) — остаток не нужен
+            pass
+        except Exception as e:
+            feed_errors.append(e)
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+    
+    stderr_thread, stderr_tail = drain_stderr(proc, stderr_lines)
+    threads = [stderr_thread]
+    if stdin_feed:
+        stdin_thread = threading.Thread(target=feed_stdin, daemon=True, name="FFmpegStdin")
+        stdin_thread.start()
+        threads.append(stdin_thread)
+    
+    started = time.monotonic()
+    last_report = 0.0
+    block: Dict[str, str] = {}
+    cancelled = False
+    
+    for raw in iter(proc.stdout.readline, b""):
+        line = raw.decode(errors="replace").strip()
+        if "=" not in line:
+            continue
+        key, value = line.split("=", 1)
+        block[key] = value
+        
+        # Блок прогресса заканчивается строкой progress=continue|end
+        if key != "progress":
+            continue
+        
+        now = time.monotonic()
+        finished = value == "end"
+        if progress_fn and (finished or now - last_report >= min_interval):
+            last_report = now
+            progress_fn(_progress_info(block, duration, now - started, finished))
+        block = {}
+        
+        if should_cancel_fn is not None and not finished and should_cancel_fn():
+            cancelled = True
+            proc.kill()
+            break
+    
+    returncode = proc.wait()
+    for thread in threads:
+        thread.join()
+    proc.stdout.close()
+    proc.stderr.close()
+    
+    if cancelled:
+        raise ProcessingCancelled("FFmpeg остановлен")
+    if feed_errors:
+        raise feed_errors[0]
+    if returncode != 0:
+        server_metrics.FFMPEG_FAILURES.inc()
+        tail = "\n".join(stderr_tail)
+        raise RuntimeError(f"FFmpeg ошибка (код {returncode}): {tail}")
+    
+    return list(stderr_tail)
+
+
+def _progress_info(block: Dict[str, str], duration: Optional[float],
+                   elapsed: float, finished: bool) -> Dict:
+    """Собирает dict прогресса из блока -progress"""
+    out_time = _parse_out_time(block)
+    
+    try:
+        fps = float(block.get("fps", "0"))
+    except ValueError:
+        fps = 0.0
+    try:
+        frame = int(block.get("frame", "0"))
+    except ValueError:
+        frame = 0
+    
+    fraction = None
+    eta_seconds = None
+    if finished:
+        fraction = 1.0
+        eta_seconds = 0.0
+    elif duration and out_time is not None:
+        fraction = min(1.0, out_time / duration)
+        # Скорость по фактическому темпу (надёжнее поля speed в начале)
+        rate = out_time / elapsed if elapsed > 0 else 0.0
+        if rate > 0:
+            eta_seconds = round(max(0.0, duration - out_time) / rate, 1)
+    
+    return {
+        "out_time": out_time,
+        "fraction": fraction,
+        "fps": fps,
+        "speed": _parse_speed(block.get("speed")),
+        "frame": frame,
+        "eta_seconds": eta_seconds,
+    }
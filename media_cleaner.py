@@ -9,10 +9,12 @@ Imperceptible Protected Video Generator v2.0
 """
 
 import logging
+import os
 import sys
 import json
+import time
 from pathlib import Path
-from typing import Optional, Tuple, Dict
+from typing import Optional, Tuple, Dict, Callable
 import traceback
 
 import cv2
@@ -25,10 +27,11 @@ from torchvision.models.resnet import ResNet18_Weights
 from PIL import Image
 import subprocess
 import shutil
-import librosa
 import soundfile as sf
 from tqdm import tqdm
 
+from ffmpeg_runner import run_ffmpeg, drain_stderr, ProcessingCancelled
+
 # ──── ЗАГРУЗКА КОНФИГУРАЦИИ ──────────────────────────────────────────────────
 _SCRIPT_ROOT = Path(__file__).parent
 _CONFIG_FILE = _SCRIPT_ROOT / "config.json"
@@ -59,9 +62,16 @@ CONFIG = {
         "средний": 0.0050,
         "сильный": 0.0080
     },
+    "audio_block_size": 65536,  # Сэмплов в блоке потоковой обработки аудио
+    "audio_rms_frame": 2048,  # Окно RMS огибающей
+    "audio_rms_hop": 512,  # Шаг RMS огибающей
     "supported_video": {'.mp4', '.mov', '.avi', '.mkv', '.webm'},
+    "tile_size": 224,  # Размер тайла для тайлового режима (вход ResNet)
+    "tile_batch_size": 32,  # Максимум тайлов в одном forward/backward
     "log_level": "INFO",
-    "temp_folder_prefix": "_temp_adv_"
+    "temp_folder_prefix": "_temp_adv_",
+    "checkpoint_file": "checkpoint.json",  # Чекпоинт обработки кадров во временной папке
+    "checkpoint_interval_sec": 10  # Как часто обновлять чекпоинт
 }
 
 # ──── ЛОГИРОВАНИЕ ────────────────────────────────────────────────────────────
@@ -287,7 +297,10 @@ class VideoProcessor:
     """Обработка видеофайлов с добавлением adversarial noise."""
     
     def __init__(self, epsilon: float = CONFIG["epsilon_video"], 
-                 num_eot: int = CONFIG["num_eot_transforms"]):
+                 num_eot: int = CONFIG["num_eot_transforms"],
+                 tiled: bool = False,
+                 tile_size: int = CONFIG["tile_size"],
+                 tile_batch_size: int = CONFIG["tile_batch_size"]):
         if _model is None:
             raise RuntimeError("Модель ResNet18 не загружена")
         
@@ -296,6 +309,77 @@ class VideoProcessor:
         self.epsilon = epsilon
         self.num_eot = num_eot
         self.device = DEVICE
+        # Тайловый режим: крупный кадр режется на тайлы ~tile_size,
+        # и градиент считается для каждого тайла отдельно
+        self.tiled = tiled
+        self.tile_size = max(32, int(tile_size))
+        self.tile_batch_size = max(1, int(tile_batch_size))
+    
+    def _eot_gradient(self, input_tensor: torch.Tensor) -> torch.Tensor:
+        """Средний по EOT градиент loss по батчу входов (N, 3, H, W)."""
+        total_grad = torch.zeros_like(input_tensor)
+        
+        # Ensemble of Transformations (EOT) для robustness
+        for _ in range(self.num_eot):
+            distorted = random_distortion(input_tensor.detach().clone())
+            distorted.requires_grad_(True)
+            
+            with torch.enable_grad():
+                out = self.model(distorted)
+                label = out.argmax(dim=1)
+                # УСИЛЕННАЯ loss функция для более сильного шума
+                # (sum — чтобы градиент тайла не зависел от размера батча)
+                loss = F.cross_entropy(out, label, reduction='sum') * 3.0
+                
+                self.model.zero_grad()
+                loss.backward()
+                
+                if distorted.grad is not None:
+                    total_grad += distorted.grad.detach()
+        
+        return total_grad / self.num_eot
+    
+    def tile_grid(self, h: int, w: int) -> list:
+        """
+        Разбивает кадр h x w на сетку тайлов размером примерно tile_size.
+        Возвращает список (y0, y1, x0, x1); тайлы не перекрываются и покрывают весь кадр.
+        """
+        rows = max(1, round(h / self.tile_size))
+        cols = max(1, round(w / self.tile_size))
+        ys = np.linspace(0, h, rows + 1).round().astype(int)
+        xs = np.linspace(0, w, cols + 1).round().astype(int)
+        return [
+            (int(ys[r]), int(ys[r + 1]), int(xs[c]), int(xs[c + 1]))
+            for r in range(rows) for c in range(cols)
+        ]
+    
+    def _tiled_gradient(self, frame_norm: torch.Tensor, tiles: list) -> torch.Tensor:
+        """
+        Градиент для кадра (1, 3, H, W) в тайловом режиме.
+        Все тайлы приводятся к tile_size x tile_size, проходят forward/backward
+        батчами по tile_batch_size, а градиенты сшиваются обратно в полный размер.
+        """
+        size = (self.tile_size, self.tile_size)
+        grad_full = torch.zeros_like(frame_norm)
+        
+        for start in range(0, len(tiles), self.tile_batch_size):
+            chunk = tiles[start:start + self.tile_batch_size]
+            batch = torch.cat([
+                F.interpolate(frame_norm[:, :, y0:y1, x0:x1], size=size,
+                              mode='bicubic', align_corners=False)
+                for y0, y1, x0, x1 in chunk
+            ])
+            
+            grad = self._eot_gradient(batch)
+            
+            # Возвращаем градиент каждого тайла на его место в кадре
+            for i, (y0, y1, x0, x1) in enumerate(chunk):
+                grad_full[:, :, y0:y1, x0:x1] = F.interpolate(
+                    grad[i:i + 1], size=(y1 - y0, x1 - x0),
+                    mode='bilinear', align_corners=False
+                )
+        
+        return grad_full
     
     def add_imperceptible_video_noise(self, frame_bgr: np.ndarray, strength_mult: float = 1.0) -> np.ndarray:
         """Добавляет невидимый adversarial шум к кадру без потери качества."""
@@ -311,57 +395,44 @@ class VideoProcessor:
             # Создаём tensor оригинального размера (C, H, W) - СРАЗУ НА GPU
             frame_tensor_orig = torch.from_numpy(frame_rgb.copy()).permute(2, 0, 1).float().to(self.device)
             
-            # Resize ДЛЯ МОДЕЛИ только (224x224)
-            frame_224 = torch.nn.functional.interpolate(
-                frame_tensor_orig.unsqueeze(0),
-                size=(224, 224),
-                mode='bicubic',
-                align_corners=False
-            ).squeeze(0)
-            
             # Нормализуем для ResNet
             mean = torch.tensor([0.485, 0.456, 0.406]).view(3, 1, 1).to(self.device)
             std = torch.tensor([0.229, 0.224, 0.225]).view(3, 1, 1).to(self.device)
             
-            input_tensor = ((frame_224 - mean) / std).unsqueeze(0).to(self.device)
+            # Подготавливаем оригинальный tensor для применения perturbation
+            frame_tensor_orig_norm = ((frame_tensor_orig - mean) / std).unsqueeze(0).to(self.device)
             
-            total_grad = torch.zeros_like(input_tensor)
+            tiles = self.tile_grid(original_h, original_w) if self.tiled else []
             
-            # Ensemble of Transformations (EOT) для robustness
-            for _ in range(self.num_eot):
-                distorted = random_distortion(input_tensor.detach().clone())
-                distorted.requires_grad_(True)
+            if len(tiles) > 1:
+                # Тайловый режим: градиент на полном разрешении по частям
+                grad_interp = self._tiled_gradient(frame_tensor_orig_norm, tiles)
+            else:
+                # Resize ДЛЯ МОДЕЛИ только (224x224)
+                frame_224 = torch.nn.functional.interpolate(
+                    frame_tensor_orig.unsqueeze(0),
+                    size=(224, 224),
+                    mode='bicubic',
+                    align_corners=False
+                ).squeeze(0)
                 
-                with torch.enable_grad():
-                    out = self.model(distorted)
-                    label = out.argmax(dim=1)
-                    # УСИЛЕННАЯ loss функция для более сильного шума
-                    loss = F.cross_entropy(out, label) * 3.0
-                    
-                    self.model.zero_grad()
-                    loss.backward()
-                    
-                    if distorted.grad is not None:
-                        total_grad += distorted.grad.detach().clone()
+                input_tensor = ((frame_224 - mean) / std).unsqueeze(0).to(self.device)
+                avg_grad = self._eot_gradient(input_tensor)
+                
+                # Интерполируем градиенты обратно на оригинальный размер
+                grad_interp = torch.nn.functional.interpolate(
+                    avg_grad,
+                    size=(original_h, original_w),
+                    mode='bilinear',
+                    align_corners=False
+                )
+                del input_tensor, avg_grad
             
             # Если градиент нулевой, возвращаем оригинальный кадр
-            if total_grad.abs().sum() == 0:
+            if grad_interp.abs().sum() == 0:
                 logger.debug("Нулевой градиент, кадр не изменён")
                 return frame_bgr
             
-            avg_grad = total_grad / self.num_eot
-            
-            # Интерполируем градиенты обратно на оригинальный размер
-            grad_interp = torch.nn.functional.interpolate(
-                avg_grad,
-                size=(original_h, original_w),
-                mode='bilinear',
-                align_corners=False
-            )
-            
-            # Подготавливаем оригинальный tensor для применения perturbation
-            frame_tensor_orig_norm = ((frame_tensor_orig - mean) / std).unsqueeze(0).to(self.device)
-            
             # FGSM атака с интерполированными градиентами и множителем силы
             epsilon_effective = self.epsilon * strength_mult
             perturbed = frame_tensor_orig_norm + epsilon_effective * grad_interp.sign()
@@ -383,7 +454,7 @@ class VideoProcessor:
             perturbed_bgr = cv2.cvtColor(perturbed_rgb, cv2.COLOR_RGB2BGR)
             
             # Очищаем GPU память
-            del input_tensor, distorted, total_grad, avg_grad, grad_interp, frame_tensor_orig_norm, perturbed, perturbed_denorm
+            del grad_interp, frame_tensor_orig_norm, perturbed, perturbed_denorm
             torch.cuda.empty_cache()
             
             return perturbed_bgr
@@ -392,16 +463,43 @@ class VideoProcessor:
             logger.error(f"Ошибка при добавлении видео-шума: {e}\n{traceback.format_exc()}")
             return frame_bgr
     
+    @staticmethod
+    def _load_checkpoint(path: Path, params: Dict) -> Optional[Dict]:
+        """Чекпоинт из временной папки, если он от того же видео с теми же параметрами"""
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if checkpoint.get("params") != params:
+            logger.warning(f"Чекпоинт {path} от другого видео или параметров, обработка с начала")
+            return None
+        return checkpoint
+    
+    @staticmethod
+    def _save_checkpoint(path: Path, params: Dict, frame_idx: int, noisy_frames: int) -> None:
+        """Атомарно записывает чекпоинт: кадры 1..frame_idx уже лежат в папке PNG"""
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"params": params, "frame_idx": frame_idx, "noisy_frames": noisy_frames}, f)
+        os.replace(tmp_path, path)
+    
     def process_video(self, input_path: str, start_frame: int, end_frame: int, 
                      every_n_frames: int, video_strength_mult: float = 1.0,
-                     should_cancel_fn=None) -> Tuple[str, int]:
+                     should_cancel_fn=None, timings: Optional[Dict[str, float]] = None,
+                     progress_fn: Optional[Callable[[int, int, int], None]] = None,
+                     resume: bool = False) -> Tuple[str, int]:
         """
         Обрабатывает видео, добавляя шум к нужным кадрам.
         Возвращает (путь к временной папке, количество обработанных кадров)
+        timings — если передан, в него накапливается время (сек) декодирования,
+        модели и записи PNG: decode_sec, model_sec, write_sec.
+        progress_fn — вызывается после каждого кадра: (номер кадра, всего кадров, кадров с шумом).
+        resume — продолжить с чекпоинта во временной папке (кадры до него не
+        обрабатываются повторно, только пропускаются при декодировании).
         """
-        base = Path(input_path).stem
-        input_dir = Path(input_path).parent
-        temp_folder = input_dir / f"{base}{CONFIG['temp_folder_prefix']}{every_n_frames}f"
+        temp_folder = frames_folder(input_path, every_n_frames)
+        checkpoint_path = temp_folder / CONFIG["checkpoint_file"]
         
         # Проверяем видеофайл
         cap = cv2.VideoCapture(input_path)
@@ -423,18 +521,48 @@ class VideoProcessor:
             
             logger.info(f"Параметры видео: {total_frames} кадров @ {fps}fps, {w}x{h}")
             
-            # Создаём временную папку
-            if temp_folder.exists():
-                shutil.rmtree(temp_folder)
-            temp_folder.mkdir(exist_ok=True)
+            # Всё, от чего зависят кадры в папке: при несовпадении чекпоинт не используется
+            params = {
+                "input_size": os.path.getsize(input_path),
+                "total_frames": total_frames,
+                "size": [w, h],
+                "start_frame": start_frame,
+                "end_frame": end_frame,
+                "every_n_frames": every_n_frames,
+                "video_strength_mult": video_strength_mult,
+                "epsilon": self.epsilon,
+                "num_eot": self.num_eot,
+                "tiled": self.tiled,
+            }
+            checkpoint = self._load_checkpoint(checkpoint_path, params) if resume else None
             
             frame_idx = 0
             noisy_frames = 0
+            decode_sec = model_sec = write_sec = 0.0
+            
+            # Создаём временную папку (при возобновлении — оставляем готовые кадры)
+            if checkpoint is None:
+                if temp_folder.exists():
+                    shutil.rmtree(temp_folder)
+                temp_folder.mkdir(exist_ok=True)
             
             # Обработка кадров с progress bar
             pbar = tqdm(total=total_frames, desc="Обработка видео", unit="кадр")
             
+            if checkpoint is not None:
+                # Кадры до чекпоинта уже записаны: только пропускаем их в потоке
+                noisy_frames = checkpoint["noisy_frames"]
+                while frame_idx < checkpoint["frame_idx"] and cap.grab():
+                    frame_idx += 1
+                logger.info(f"Возобновление с кадра {frame_idx + 1} (уже с шумом: {noisy_frames})")
+                pbar.update(frame_idx)
+                if progress_fn:
+                    progress_fn(frame_idx, total_frames, noisy_frames)
+            
+            last_checkpoint = time.monotonic()
+            
             while True:
+                t0 = time.perf_counter()
                 ret, frame = cap.read()
                 if not ret:
                     break
@@ -447,11 +575,16 @@ class VideoProcessor:
                 
                 frame_idx += 1
                 frame = cv2.resize(frame, (w, h))
+                t1 = time.perf_counter()
+                decode_sec += t1 - t0
                 
                 # Применяем шум только к нужным кадрам
                 if start_frame <= frame_idx <= end_frame and frame_idx % every_n_frames == 0:
                     try:
                         perturbed = self.add_imperceptible_video_noise(frame, video_strength_mult)
+                        t2 = time.perf_counter()
+                        model_sec += t2 - t1
+                        t1 = t2
                         cv2.imwrite(str(temp_folder / f"frame_{frame_idx:06d}.png"), perturbed)
                         noisy_frames += 1
                     except Exception as e:
@@ -459,10 +592,22 @@ class VideoProcessor:
                         cv2.imwrite(str(temp_folder / f"frame_{frame_idx:06d}.png"), frame)
                 else:
                     cv2.imwrite(str(temp_folder / f"frame_{frame_idx:06d}.png"), frame)
+                write_sec += time.perf_counter() - t1
                 
                 pbar.update(1)
+                if progress_fn:
+                    progress_fn(frame_idx, total_frames, noisy_frames)
+                
+                if timings is not None:
+                    timings.update(decode_sec=decode_sec, model_sec=model_sec, write_sec=write_sec)
+                
+                if time.monotonic() - last_checkpoint >= CONFIG["checkpoint_interval_sec"]:
+                    self._save_checkpoint(checkpoint_path, params, frame_idx, noisy_frames)
+                    last_checkpoint = time.monotonic()
             
             pbar.close()
+            # Все кадры готовы: при сбое на сборке повторная обработка кадров не нужна
+            self._save_checkpoint(checkpoint_path, params, frame_idx, noisy_frames)
             
             logger.info(f"Обработано кадров: {frame_idx}, с шумом: {noisy_frames}")
             return str(temp_folder), noisy_frames
@@ -475,55 +620,278 @@ class VideoProcessor:
 class AudioProcessor:
     """Обработка звука с добавлением маскирования."""
     
+    @staticmethod
+    def _cancellable(blocks, should_cancel_fn: Optional[Callable[[], bool]]):
+        """Блоки аудио с проверкой остановки перед каждым блоком"""
+        for block in blocks:
+            if should_cancel_fn is not None and should_cancel_fn():
+                raise ProcessingCancelled("Обработка аудио остановлена")
+            yield block
+    
+    @staticmethod
+    def _segment_energies(blocks, hop: int) -> Tuple[np.ndarray, int]:
+        """
+        Первый проход по аудио блоками (n, каналы): энергия (сумма квадратов)
+        моно-сигнала по сегментам длины hop. Память — O(длина / hop), а не O(длина).
+        Возвращает (энергии сегментов, количество сэмплов).
+        """
+        parts = []
+        n_samples = 0
+        
+        # Размер блока кратен hop, поэтому сегменты не разрываются между блоками
+        for block in blocks:
+            # Огибающая общая для всех каналов — считаем её по моно-миксу
+            mono = block.mean(axis=1)
+            n_samples += len(mono)
+            tail = (-len(mono)) % hop
+            if tail:
+                mono = np.pad(mono, (0, tail))
+            parts.append(np.square(mono, dtype=np.float64).reshape(-1, hop).sum(axis=1))
+        
+        energies = np.concatenate(parts) if parts else np.zeros(0)
+        return energies, n_samples
+    
+    @staticmethod
+    def _rms_from_energies(energies: np.ndarray, n_samples: int,
+                           frame_length: int, hop: int) -> np.ndarray:
+        """
+        RMS по перекрывающимся окнам frame_length с шагом hop (как librosa.feature.rms,
+        center=True): окно k покрывает сегменты [k - frame/2hop, k + frame/2hop).
+        Окна перекрывают границы блоков, поэтому считаются по энергиям сегментов.
+        """
+        half = frame_length // (2 * hop)
+        n_frames = 1 + n_samples // hop
+        csum = np.concatenate([[0.0], np.cumsum(energies)])
+        k = np.arange(n_frames)
+        lo = np.clip(k - half, 0, len(energies))
+        hi = np.clip(k + half, 0, len(energies))
+        return np.sqrt((csum[hi] - csum[lo]) / frame_length).astype(np.float32)
+    
+    @staticmethod
+    def _mask_block(y: np.ndarray, start: int, n_samples: int, sr: int, std: float,
+                    rms: np.ndarray, rng: np.random.Generator) -> np.ndarray:
+        """
+        Маскирует блок y (float32, форма (n, каналы)), начинающийся с сэмпла start.
+        Огибающая берётся из глобального RMS, фаза синуса непрерывна между блоками.
+        Все операции векторные, шум независим для каждого канала.
+        """
+        n = len(y)
+        idx = np.arange(start, start + n)
+        
+        # Вычисляем окружающий шум (psychoacoustic masking)
+        scale = (len(rms) - 1) / max(n_samples - 1, 1)
+        envelope = np.interp(idx * scale, np.arange(len(rms)), rms).astype(np.float32)
+        envelope = np.clip(envelope / (rms.max() + 1e-8), 0.04, 1.0) ** 1.5
+        
+        # Белый гауссовский шум
+        total_noise = rng.standard_normal(y.shape, dtype=np.float32) * np.float32(std)
+        
+        # Высокочастотный синус (17 kHz) — неслышимая частота.
+        # Существует только ниже частоты Найквиста; фаза в float64:
+        # в float32 время на длинном треке теряет точность
+        if CONFIG["high_freq_base"] < sr / 2:
+            omega = 2 * np.pi * CONFIG["high_freq_base"] / sr
+            total_noise += (0.0028 * np.sin(omega * idx)).astype(np.float32)[:, None]
+        
+        # Комбинируем с психоакустическим маскированием и применяем
+        adv = y + total_noise * envelope[:, None]
+        return np.clip(adv, -0.999, 0.999)
+    
     @staticmethod
     def add_imperceptible_audio_noise(audio_path_in: str, audio_path_out: str, 
-                                      level: str = "слабый") -> None:
-        """Добавляет невидимый шум к аудио."""
+                                      level: str = "слабый",
+                                      should_cancel_fn: Optional[Callable[[], bool]] = None) -> None:
+        """
+        Добавляет невидимый шум к аудио.
+        Файл обрабатывается потоково блоками (soundfile.blocks) в float32:
+        память ограничена размером блока, результат пишется по мере обработки.
+        Частота дискретизации и каналы сохраняются (без ресемплинга), результат —
+        float32 WAV, который сразу идёт в AAC-кодер при сборке.
+        should_cancel_fn проверяется перед каждым блоком (ProcessingCancelled).
+        """
         try:
             if level not in CONFIG["audio_levels"]:
                 logger.warning(f"Неизвестный уровень '{level}', используется 'слабый'")
                 level = "слабый"
             
             std = CONFIG["audio_levels"][level]
+            hop = CONFIG["audio_rms_hop"]
+            block_size = max(hop, CONFIG["audio_block_size"] // hop * hop)
             
-            # Загружаем аудио
-            y, sr = librosa.load(audio_path_in, sr=16000, mono=True)
+            info = sf.info(audio_path_in)
+            sr, channels = info.samplerate, info.channels
             
-            if len(y) == 0:
-                raise ValueError("Аудио-трек пуст")
-            
-            # Вычисляем окружающий шум (psychoacoustic masking)
-            rms = librosa.feature.rms(y=y)[0]
-            envelope = np.interp(
-                np.linspace(0, len(rms)-1, len(y)), 
-                np.arange(len(rms)), 
-                rms
+            # Проход 1: огибающая громкости по всему треку
+            energies, n_samples = AudioProcessor._segment_energies(
+                AudioProcessor._cancellable(
+                    sf.blocks(audio_path_in, blocksize=block_size, dtype='float32', always_2d=True),
+                    should_cancel_fn
+                ), hop
             )
-            envelope = np.clip(envelope / (np.max(envelope) + 1e-8), 0.04, 1.0) ** 1.5
-            
-            # Генерируем шум
-            t = np.arange(len(y), dtype=np.float32) / sr
             
-            # Высокочастотный синус (17 kHz) — неслышимая частота
-            high_freq_mask = 0.0028 * np.sin(2 * np.pi * CONFIG["high_freq_base"] * t)
+            if n_samples == 0:
+                raise ValueError("Аудио-трек пуст")
             
-            # Белый гауссовский шум
-            noise_base = np.random.normal(0, std, len(y))
+            rms = AudioProcessor._rms_from_energies(energies, n_samples, CONFIG["audio_rms_frame"], hop)
             
-            # Комбинируем с психоакустическим маскированием
-            total_noise = (noise_base + high_freq_mask) * envelope
+            if CONFIG["high_freq_base"] >= sr / 2:
+                logger.warning(f"[AUDIO] {CONFIG['high_freq_base']} Hz выше Найквиста для {sr} Hz, синус пропущен")
             
-            # Применяем шум к аудио
-            adv_audio = y + total_noise
-            adv_audio = np.clip(adv_audio, -0.999, 0.999)
+            # Проход 2: маскирование и запись блоками
+            rng = np.random.default_rng()
+            start = 0
+            with sf.SoundFile(audio_path_out, 'w', samplerate=sr, channels=channels, subtype='FLOAT') as out:
+                for block in AudioProcessor._cancellable(
+                        sf.blocks(audio_path_in, blocksize=block_size, dtype='float32', always_2d=True),
+                        should_cancel_fn):
+                    out.write(AudioProcessor._mask_block(block, start, n_samples, sr, std, rms, rng))
+                    start += len(block)
             
-            # Сохраняем
-            sf.write(audio_path_out, adv_audio, sr, subtype='PCM_16')
             logger.info(f"[AUDIO] Masking level '{level}' added -> {audio_path_out}")
         
+        except ProcessingCancelled:
+            raise
         except Exception as e:
             logger.error(f"Ошибка при обработке аудио: {e}\n{traceback.format_exc()}")
             raise
+    
+    @staticmethod
+    def scan_audio_stream(input_path: str,
+                          should_cancel_fn: Optional[Callable[[], bool]] = None) -> Optional[Dict]:
+        """
+        Первый проход in-memory пути: ffmpeg декодирует аудио в f32le через pipe,
+        по блокам считается RMS огибающая. Временные файлы не создаются.
+        Возвращает {"sample_rate", "channels", "n_samples", "rms"} или None, если аудио нет.
+        При should_cancel_fn() — ProcessingCancelled, декодер ffmpeg завершается.
+        """
+        hop = CONFIG["audio_rms_hop"]
+        with AudioStreamDecoder(input_path) as decoder:
+            if decoder.sample_rate is None:
+                return None
+            block_size = max(hop, CONFIG["audio_block_size"] // hop * hop)
+            energies, n_samples = AudioProcessor._segment_energies(
+                AudioProcessor._cancellable(decoder.blocks(block_size), should_cancel_fn), hop
+            )
+        
+        if n_samples == 0:
+            return None
+        
+        return {
+            "sample_rate": decoder.sample_rate,
+            "channels": decoder.channels,
+            "n_samples": n_samples,
+            "rms": AudioProcessor._rms_from_energies(energies, n_samples, CONFIG["audio_rms_frame"], hop),
+        }
+    
+    @staticmethod
+    def write_masked_stream(input_path: str, scan: Dict, level: str, sink,
+                            should_cancel_fn: Optional[Callable[[], bool]] = None) -> None:
+        """
+        Второй проход in-memory пути: повторно декодирует аудио через pipe, маскирует
+        блоки в numpy и пишет float32 PCM (interleaved) в sink — stdin кодирующего ffmpeg.
+        При should_cancel_fn() — ProcessingCancelled, декодер ffmpeg завершается.
+        """
+        if level not in CONFIG["audio_levels"]:
+            logger.warning(f"Неизвестный уровень '{level}', используется 'слабый'")
+            level = "слабый"
+        
+        std = CONFIG["audio_levels"][level]
+        sr, n_samples, rms = scan["sample_rate"], scan["n_samples"], scan["rms"]
+        hop = CONFIG["audio_rms_hop"]
+        block_size = max(hop, CONFIG["audio_block_size"] // hop * hop)
+        rng = np.random.default_rng()
+        start = 0
+        
+        with AudioStreamDecoder(input_path) as decoder:
+            for block in AudioProcessor._cancellable(decoder.blocks(block_size), should_cancel_fn):
+                # Трек не длиннее просканированного: огибающая рассчитана на n_samples
+                block = block[:max(0, n_samples - start)]
+                if not len(block):
+                    break
+                adv = AudioProcessor._mask_block(block, start, n_samples, sr, std, rms, rng)
+                sink.write(adv.astype('<f4', copy=False).tobytes())
+                start += len(block)
+        
+        logger.info(f"[AUDIO] Masking level '{level}' streamed in memory ({start} samples @ {sr} Hz)")
+
+
+class AudioStreamDecoder:
+    """
+    Декодирование аудиодорожки ffmpeg в float32 WAV на stdout (без временных файлов).
+    Частота и каналы читаются из WAV-заголовка потока, данные — блоками numpy.
+    """
+    
+    def __init__(self, input_path: str):
+        self.input_path = input_path
+        self.sample_rate = None
+        self.channels = None
+        self.proc = None
+        self._eof = False
+        self._stderr_thread = None
+        self._stderr_tail = None
+    
+    def __enter__(self):
+        self.proc = subprocess.Popen([
+            CONFIG["ffmpeg_path"], "-v", "error", "-nostdin",
+            "-i", self.input_path,
+            "-map", "0:a:0", "-vn",
+            "-acodec", "pcm_f32le",
+            "-map_metadata", "-1", "-flags", "+bitexact", "-fflags", "+bitexact",
+            "-f", "wav", "pipe:1"
+        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        # stderr читается параллельно: иначе ffmpeg встанет на полном pipe
+        self._stderr_thread, self._stderr_tail = drain_stderr(self.proc)
+        self._read_header()
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        # Поток дочитан не до конца (остановка, ошибка) — декодер больше не нужен
+        if not self._eof:
+            self.proc.kill()
+        self.proc.stdout.close()
+        returncode = self.proc.wait()
+        self._stderr_thread.join()
+        self.proc.stderr.close()
+        if exc_type is None and self._eof and returncode != 0:
+            tail = "\n".join(self._stderr_tail)
+            raise RuntimeError(f"FFmpeg ошибка декодирования аудио (код {returncode}): {tail}")
+        return False
+    
+    def _read_exact(self, n: int) -> bytes:
+        data = self.proc.stdout.read(n)
+        return data if data and len(data) == n else b""
+    
+    def _read_header(self) -> None:
+        """Разбирает RIFF/WAVE заголовок до чанка data (нет аудио — поток пуст)."""
+        riff = self._read_exact(12)
+        if riff[:4] != b"RIFF" or riff[8:12] != b"WAVE":
+            return
+        
+        while True:
+            chunk = self._read_exact(8)
+            if not chunk:
+                return
+            chunk_id = chunk[:4]
+            chunk_size = int.from_bytes(chunk[4:8], "little")
+            if chunk_id == b"data":
+                return
+            payload = self._read_exact(chunk_size + (chunk_size & 1))
+            if chunk_id == b"fmt ":
+                self.channels = int.from_bytes(payload[2:4], "little")
+                self.sample_rate = int.from_bytes(payload[4:8], "little")
+    
+    def blocks(self, block_size: int):
+        """Генератор блоков float32 формы (n, каналы)."""
+        if self.sample_rate is None:
+            return
+        frame_bytes = 4 * self.channels
+        while True:
+            data = self.proc.stdout.read(block_size * frame_bytes)
+            n = len(data) // frame_bytes
+            if n == 0:
+                self._eof = True
+                return
+            yield np.frombuffer(data[:n * frame_bytes], dtype='<f4').reshape(n, self.channels)
 
 
 # ──── ФУНКЦИИ ИНТЕРФЕЙСА ─────────────────────────────────────────────────────
@@ -754,21 +1122,35 @@ def choose_settings(total_frames: int) -> Tuple[int, int, Optional[str], int, fl
     return start_frame, end_frame, audio_level, every_n, video_strength_mult, epsilon
 
 
-def extract_audio(input_path: str, output_path: str) -> None:
-    """Извлекает аудио из видео с помощью ffmpeg (без метаданных)."""
+def extract_audio(input_path: str, output_path: str, sample_rate: Optional[int] = None,
+                  duration: Optional[float] = None,
+                  progress_fn: Optional[Callable[[Dict], None]] = None,
+                  should_cancel_fn: Optional[Callable[[], bool]] = None) -> None:
+    """
+    Извлекает аудио из видео с помощью ffmpeg (без метаданных).
+    По умолчанию декодирует один раз в float32 PCM с исходной частотой
+    дискретизации и каналами; sample_rate включает ресемплинг (старый режим 16 kHz).
+    progress_fn получает прогресс ffmpeg (см. ffmpeg_runner.run_ffmpeg).
+    should_cancel_fn останавливает ffmpeg (ProcessingCancelled).
+    """
     try:
-        result = subprocess.run([
+        if sample_rate:
+            codec_params = ["-acodec", "pcm_s16le", "-ar", str(sample_rate)]
+        else:
+            codec_params = ["-acodec", "pcm_f32le"]
+        
+        run_ffmpeg([
             CONFIG["ffmpeg_path"], "-y", "-i", input_path,
-            "-vn", "-acodec", "pcm_s16le", "-ar", "16000",
+            "-vn"
+        ] + codec_params + [
             "-map_metadata", "-1",  # Удаление метаданных аудио
             output_path
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
-        if result.returncode != 0:
-            raise RuntimeError(f"FFmpeg ошибка: {result.stderr}")
+        ], duration=duration, progress_fn=progress_fn, should_cancel_fn=should_cancel_fn)
         
         logger.info(f"[AUDIO] Extracted -> {output_path}")
     
+    except ProcessingCancelled:
+        raise
     except Exception as e:
         logger.error(f"Ошибка извextraction аудио: {e}")
         raise
@@ -780,33 +1162,71 @@ def check_gpu_encoder() -> str:
     return "libx264"
 
 
-def assemble_video(temp_folder: str, audio_path: str, fps: float, output_path: str, use_gpu: bool = True) -> None:
-    """Собирает видео из кадров с добавлением аудио и удалением метаданных."""
+# Полное удаление метаданных за один проход записи: глобальные, потоковые,
+# главы, подписи энкодера (bitexact) + moov в начале файла (faststart)
+METADATA_STRIP_PARAMS = [
+    "-map_metadata", "-1",
+    "-map_metadata:s:v", "-1",
+    "-map_metadata:s:a", "-1",
+    "-map_chapters", "-1",
+    "-fflags", "+bitexact",
+    "-flags:v", "+bitexact",
+    "-flags:a", "+bitexact",
+    "-movflags", "+faststart",
+]
+
+
+def _video_codec_params(use_gpu: bool) -> Tuple[str, list]:
+    """Возвращает (кодек, параметры кодирования видео для ffmpeg)."""
+    # Выбираем кодек в зависимости от наличия GPU
+    if use_gpu:
+        encoder = check_gpu_encoder()
+    else:
+        encoder = "libx264"
+        logger.info("📺 Используется CPU кодек: libx264")
+    
+    # Параметры кодирования в зависимости от типа кодека
+    if encoder in ["hevc_nvenc", "h264_nvenc"]:
+        # GPU кодирование (NVIDIA NVENC)
+        video_codec_params = [
+            "-c:v", encoder,
+            "-pix_fmt", "yuv420p",  # ВАЖНО: явно указываем формат пиксела для совместимости
+            "-rc", "vbr",  # Variable bitrate для лучшего качества
+            "-cq", "23",   # Quality level (0-51, ниже = лучше)
+            "-preset", "fast"  # fast/medium/slow
+        ]
+    else:
+        # CPU кодирование
+        video_codec_params = [
+            "-c:v", encoder,
+            "-pix_fmt", "yuv420p",
+            "-preset", "fast"  # Быстрая кодирование на CPU
+        ]
+    
+    return encoder, video_codec_params
+
+
+def _frames_duration(temp_folder: str, fps: float) -> Optional[float]:
+    """Длительность собираемого видео по числу кадров во временной папке."""
+    if not fps:
+        return None
+    n_frames = sum(1 for _ in Path(temp_folder).glob("frame_*.png"))
+    return n_frames / fps if n_frames else None
+
+
+def assemble_video(temp_folder: str, audio_path: str, fps: float, output_path: str, use_gpu: bool = True,
+                   strip_all_metadata: bool = True,
+                   progress_fn: Optional[Callable[[Dict], None]] = None,
+                   should_cancel_fn: Optional[Callable[[], bool]] = None) -> None:
+    """
+    Собирает видео из кадров с добавлением аудио и удалением метаданных.
+    strip_all_metadata=True — полная очистка (потоки, главы, bitexact, faststart)
+    в том же проходе, без повторной перезаписи файла.
+    progress_fn получает прогресс кодирования (доля, fps, ETA).
+    should_cancel_fn останавливает кодирование (ProcessingCancelled).
+    """
     try:
-        # Выбираем кодек в зависимости от наличия GPU
-        if use_gpu:
-            encoder = check_gpu_encoder()
-        else:
-            encoder = "libx264"
-            logger.info("📺 Используется CPU кодек: libx264")
-        
-        # Параметры кодирования в зависимости от типа кодека
-        if encoder in ["hevc_nvenc", "h264_nvenc"]:
-            # GPU кодирование (NVIDIA NVENC)
-            video_codec_params = [
-                "-c:v", encoder,
-                "-pix_fmt", "yuv420p",  # ВАЖНО: явно указываем формат пиксела для совместимости
-                "-rc", "vbr",  # Variable bitrate для лучшего качества
-                "-cq", "23",   # Quality level (0-51, ниже = лучше)
-                "-preset", "fast"  # fast/medium/slow
-            ]
-        else:
-            # CPU кодирование
-            video_codec_params = [
-                "-c:v", encoder,
-                "-pix_fmt", "yuv420p",
-                "-preset", "fast"  # Быстрая кодирование на CPU
-            ]
+        encoder, video_codec_params = _video_codec_params(use_gpu)
         
         ffmpeg_cmd = [
             CONFIG["ffmpeg_path"], "-y",
@@ -816,22 +1236,95 @@ def assemble_video(temp_folder: str, audio_path: str, fps: float, output_path: s
         ] + video_codec_params + [
             "-c:a", "aac", "-b:a", "128k",
             "-shortest",
-            "-map_metadata", "-1",  # Удаление метаданных
+        ] + (METADATA_STRIP_PARAMS if strip_all_metadata else ["-map_metadata", "-1"]) + [
             output_path
         ]
         
-        result = subprocess.run(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
-        if result.returncode != 0:
-            raise RuntimeError(f"FFmpeg ошибка: {result.stderr}")
+        duration = _frames_duration(temp_folder, fps) if progress_fn else None
+        run_ffmpeg(ffmpeg_cmd, duration=duration, progress_fn=progress_fn,
+                   should_cancel_fn=should_cancel_fn)
         
         logger.info(f"[OK] Video assembled via {encoder} -> {output_path}")
     
+    except ProcessingCancelled:
+        raise
+    except Exception as e:
+        logger.error(f"Ошибка сборки видео: {e}")
+        raise
+
+
+def assemble_video_streamed(temp_folder: str, input_path: str, fps: float, output_path: str,
+                            audio_level: Optional[str] = None, use_gpu: bool = True,
+                            audio_scan: Optional[Dict] = None, strip_all_metadata: bool = True,
+                            progress_fn: Optional[Callable[[Dict], None]] = None,
+                            should_cancel_fn: Optional[Callable[[], bool]] = None) -> None:
+    """
+    Собирает видео из кадров без временных WAV файлов.
+    Без маскировки аудио берётся напрямую из исходного видео. С маскировкой —
+    декодируется ffmpeg в f32le через pipe, маскируется в numpy и подаётся в stdin
+    кодирующего ffmpeg. audio_scan — результат AudioProcessor.scan_audio_stream,
+    если огибающая уже посчитана (например, параллельно с обработкой кадров).
+    progress_fn получает прогресс кодирования (доля, fps, ETA).
+    should_cancel_fn останавливает кодирование и маскирование аудио (ProcessingCancelled).
+    """
+    try:
+        encoder, video_codec_params = _video_codec_params(use_gpu)
+        
+        ffmpeg_cmd = [
+            CONFIG["ffmpeg_path"], "-y",
+            "-framerate", str(fps),
+            "-i", str(Path(temp_folder) / "frame_%06d.png"),
+        ]
+        
+        if audio_level is not None and audio_scan is None:
+            audio_scan = AudioProcessor.scan_audio_stream(input_path, should_cancel_fn)
+        
+        if audio_level is None:
+            # Аудио без изменений: напрямую из исходника ("?" — дорожки может не быть)
+            ffmpeg_cmd += ["-i", input_path, "-map", "0:v:0", "-map", "1:a:0?"]
+        elif audio_scan is not None:
+            ffmpeg_cmd += [
+                "-f", "f32le",
+                "-ar", str(audio_scan["sample_rate"]),
+                "-ac", str(audio_scan["channels"]),
+                "-i", "pipe:0",
+                "-map", "0:v:0", "-map", "1:a:0",
+            ]
+        else:
+            logger.warning("[AUDIO] Аудиодорожка не найдена, видео собирается без звука")
+        
+        ffmpeg_cmd += video_codec_params + [
+            "-c:a", "aac", "-b:a", "128k",
+            "-shortest",
+        ] + (METADATA_STRIP_PARAMS if strip_all_metadata else ["-map_metadata", "-1"]) + [
+            output_path
+        ]
+        
+        feed = None
+        if audio_level is not None and audio_scan is not None:
+            # Маскированное аудио пишется в stdin кодера из отдельного потока
+            def feed(stdin):
+                AudioProcessor.write_masked_stream(input_path, audio_scan, audio_level, stdin,
+                                                   should_cancel_fn)
+        
+        duration = _frames_duration(temp_folder, fps) if progress_fn else None
+        run_ffmpeg(ffmpeg_cmd, duration=duration, progress_fn=progress_fn, stdin_feed=feed,
+                   should_cancel_fn=should_cancel_fn)
+        
+        logger.info(f"[OK] Video assembled via {encoder} (in-memory audio) -> {output_path}")
+    
+    except ProcessingCancelled:
+        raise
     except Exception as e:
         logger.error(f"Ошибка сборки видео: {e}")
         raise
 
 
+def frames_folder(input_path: str, every_n_frames: int) -> Path:
+    """Временная папка кадров и чекпоинта VideoProcessor.process_video (рядом с видео)."""
+    return Path(input_path).parent / f"{Path(input_path).stem}{CONFIG['temp_folder_prefix']}{every_n_frames}f"
+
+
 def cleanup_temps(temp_folder: str, *temp_files: str) -> None:
     """Очищает временные файлы."""
     try:
@@ -849,33 +1342,6 @@ def cleanup_temps(temp_folder: str, *temp_files: str) -> None:
         logger.warning(f"Не удалось полностью очистить временные файлы: {e}")
 
 
-def strip_metadata(file_path: str) -> None:
-    """Удаляет все метаданные из видеофайла."""
-    try:
-        temp_path = f"{file_path}.tmp.mp4"
-        
-        result = subprocess.run([
-            CONFIG["ffmpeg_path"], "-y", "-i", file_path,
-            "-c:v", "copy",
-            "-c:a", "copy",
-            "-map_metadata", "-1",
-            temp_path
-        ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
-        if result.returncode != 0:
-            logger.warning(f"Не удалось удалить метаданные: {result.stderr}")
-            if Path(temp_path).exists():
-                Path(temp_path).unlink()
-            return
-        
-        # Заменяем оригинальный файл на очищенный
-        Path(temp_path).replace(file_path)
-        logger.info(f"[OK] Metadata removed from {file_path}")
-    
-    except Exception as e:
-        logger.warning(f"Ошибка при удалении метаданных: {e}")
-
-
 # ──── ГЛАВНАЯ ФУНКЦИЯ ────────────────────────────────────────────────────────
 def process_imperceptible_protected_video(input_path: str) -> bool:
     """
@@ -932,18 +1398,14 @@ def process_imperceptible_protected_video(input_path: str) -> bool:
             logger.info("     Маскировка аудио отключена (используется оригинальное)")
             final_audio = temp_audio_orig
         
-        # Сборка финального видео через GPU
+        # Сборка финального видео через GPU (метаданные удаляются в том же проходе)
         logger.info("\n[3/3] Сборка видео через видеокарту...")
-        assemble_video(temp_folder, final_audio, fps, output_final, use_gpu=True)
+        assemble_video(temp_folder, final_audio, fps, output_final, use_gpu=True, strip_all_metadata=True)
         
         # Очистка
         logger.info("\nОчистка временных файлов...")
         cleanup_temps(temp_folder, temp_audio_orig, temp_audio_adv)
         
-        # Удаление метаданных из финального файла
-        logger.info("Удаление метаданных из видео...")
-        strip_metadata(output_final)
-        
         logger.info(f"\n{'='*70}")
         logger.info(f"[DONE] Complete! Processed {total_frames} frames, {noisy_frames} with noise")
         logger.info(f"[OK] Final file: {output_final}")
@@ -2,21 +2,29 @@
 Система управления очередью обработки видео
 """
 
+import bisect
+import heapq
 import json
 import logging
+import math
+import os
 import uuid
 from pathlib import Path
 from datetime import datetime, timedelta
-from typing import Dict, Optional, List
+from typing import Callable, Dict, Iterable, Iterator, Optional, List, Tuple
 from enum import Enum
 import threading
 import time
 from dataclasses import dataclass, asdict
 
 from server_config import (
-    SERVER_CONFIG, QUEUE_DB_FOLDER, TaskStatus, 
-    TASK_STATUSES, INPUT_FOLDER, OUTPUT_FOLDER
+    SERVER_CONFIG, QUEUE_DB_FOLDER, TaskStatus, TaskType,
+    TASK_STATUSES, INPUT_FOLDER, OUTPUT_FOLDER, PROFILES_FOLDER
 )
+from task_metrics import MetricsAggregate
+from task_cost import CostModel
+from task_scheduler import make_scheduler, task_priority
+import server_metrics
 
 logger = logging.getLogger("queue_processor")
 
@@ -28,6 +36,7 @@ class ProcessingTask:
     input_video: str                       # Имя входящего видео
     status: str                            # Статус обработки
     created_at: str                        # Время создания
+    task_type: str = TaskType.PROTECT      # Тип задачи (protect/metadata/compress)
     started_at: Optional[str] = None       # Время начала обработки
     completed_at: Optional[str] = None     # Время завершения
     
@@ -42,29 +51,50 @@ class ProcessingTask:
     output_size_mb: Optional[float] = None # Размер выходного видео (для сжатия)
     error_message: Optional[str] = None    # Сообщение об ошибке
     progress: float = 0.0                  # Прогресс обработки (0-100)
+    eta_seconds: Optional[float] = None    # Оценка оставшегося времени этапа ffmpeg (сек)
     
     # Информация о кадрах
     processed_frames: int = 0              # Обработано кадров
     total_frames: int = 0                  # Всего кадров
     
+    # Метрики выполнения по этапам (task_metrics.TaskMetrics.to_dict)
+    metrics: Optional[Dict] = None
+    
+    # Профилирование (task_profiler): запрошено ли и файлы в PROFILES_FOLDER по видам
+    profile: bool = False
+    profile_files: Optional[Dict] = None
+    
+    # Планирование (task_cost): параметры видео и предсказанное время обработки (сек);
+    # место в очереди и ожидаемые начало/конец — VideoProcessingQueue.get_schedule
+    video_info: Optional[Dict] = None
+    predicted_sec: Optional[float] = None
+    
     # Метаинформация
+    priority: Optional[str] = None         # Класс приоритета (SERVER_CONFIG["priority_classes"])
     user_id: Optional[str] = None          # ID пользователя (опционально)
     notes: Optional[str] = None            # Заметки пользователя
+    version: int = 0                       # Номер изменения (растёт при каждом update_task)
+    resumes: int = 0                       # Сколько раз задача возобновлялась после прерывания
     
     def to_dict(self) -> Dict:
         """Преобразует задачу в словарь для JSON сериализации"""
         return asdict(self)
     
-    def to_public_dict(self) -> Dict:
-        """Возвращает публичную информацию о задаче (для API)"""
-        return {
+    def to_public_dict(self, fields: Optional[Iterable[str]] = None) -> Dict:
+        """
+        Возвращает публичную информацию о задаче (для API).
+        fields — компактная выборка полей (подмножество PUBLIC_TASK_FIELDS).
+        """
+        data = {
             "task_id": self.task_id,
             "status": self.status,
             "status_text": TASK_STATUSES.get(self.status, "Неизвестно"),
+            "task_type": self.task_type,
             "created_at": self.created_at,
             "started_at": self.started_at,
             "completed_at": self.completed_at,
             "progress": self.progress,
+            "eta_seconds": self.eta_seconds,
             "processed_frames": self.processed_frames,
             "total_frames": self.total_frames,
             "input_video": self.input_video,
@@ -74,20 +104,176 @@ class ProcessingTask:
             "video_strength": self.video_strength,
             "audio_level": self.audio_level,
             "every_n_frames": self.every_n_frames,
+            "priority": task_priority(self),
             "user_id": self.user_id,
+            "metrics": self.metrics,
+            "video_info": self.video_info,
+            "predicted_sec": self.predicted_sec,
+            "profile_files": {
+                kind: f"/task/{self.task_id}/profile/{kind}" for kind in self.profile_files
+            } if self.profile_files else None,
+            "version": self.version,
         }
+        if fields is None:
+            return data
+        return {key: data[key] for key in fields if key in data}
+
+
+# Поля, доступные для выборки fields в /tasks
+PUBLIC_TASK_FIELDS = tuple(
+    ProcessingTask(task_id="", input_video="", status="", created_at="").to_public_dict()
+)
+
+
+# ──── СОРТИРОВАННЫЙ ИНДЕКС ЗАДАЧ ────────────────────────────────────────────
+class TaskIndex:
+    """
+    Ключи задач (created_at, task_id) в порядке создания.
+    Новые задачи добавляются в конец (O(1)); выборка страницы от курсора —
+    бинарный поиск + O(limit).
+    """
+    
+    def __init__(self):
+        self.keys: List[Tuple[str, str]] = []
+    
+    def __len__(self) -> int:
+        return len(self.keys)
+    
+    @staticmethod
+    def key(task: ProcessingTask) -> Tuple[str, str]:
+        return (task.created_at, task.task_id)
+    
+    def add(self, task: ProcessingTask) -> None:
+        key = self.key(task)
+        if not self.keys or key > self.keys[-1]:
+            self.keys.append(key)
+        else:
+            bisect.insort(self.keys, key)
+    
+    def remove(self, task: ProcessingTask) -> None:
+        key = self.key(task)
+        i = bisect.bisect_left(self.keys, key)
+        if i < len(self.keys) and self.keys[i] == key:
+            del self.keys[i]
+    
+    def ids(self) -> Iterator[str]:
+        """task_id от старых к новым"""
+        for _, task_id in self.keys:
+            yield task_id
+    
+    def ids_desc(self, before: Optional[Tuple[str, str]] = None) -> Iterator[str]:
+        """task_id от новых к старым, строго раньше ключа before"""
+        i = bisect.bisect_left(self.keys, before) if before else len(self.keys)
+        for j in range(i - 1, -1, -1):
+            yield self.keys[j][1]
 
 
 # ──── ОЧЕРЕДЬ ОБРАБОТКИ ─────────────────────────────────────────────────────
 class VideoProcessingQueue:
-    """Управление очередью видео для обработки"""
+    """
+    Управление очередью видео для обработки.
+    Помимо self.tasks ведутся сортированные индексы (все задачи, по статусу,
+    по пользователю) и сводка метрик завершённых задач — статистика и выборки
+    не обходят все задачи.
+    
+    Задачи защиты запускают воркеры (claim_task): ожидающие задачи лежат в
+    планировщике task_scheduler — классы приоритета и честная доля
+    пользователей (deficit round robin по предсказанному времени).
+    """
+    
+    # Поля, от которых зависят индексы, планировщик и сводка метрик
+    INDEXED_FIELDS = ("status", "user_id", "priority", "metrics")
+    # Статусы задач защиты, входящие в предсказанную загрузку очереди
+    SCHEDULED_STATUSES = (TaskStatus.PENDING, TaskStatus.PROCESSING)
     
     def __init__(self):
         self.tasks_db = QUEUE_DB_FOLDER / "tasks.json"
         self.lock = threading.Lock()
         self.tasks: Dict[str, ProcessingTask] = {}
+        self.by_created = TaskIndex()
+        self.by_status: Dict[str, TaskIndex] = {}
+        self.by_user: Dict[Optional[str], TaskIndex] = {}
+        self.metrics_summary = MetricsAggregate()
+        self.scheduler = make_scheduler()  # Ожидающие задачи защиты
+        self.listeners: List[Callable[[ProcessingTask], None]] = []
+        self.last_saved = 0.0           # time.monotonic() последнего save_tasks
+        self.unsaved_changes = False    # Есть изменения задач, не записанные на диск
+        self.save_lock = threading.Lock()  # Одна запись файла за раз (вне self.lock)
+        self.cost_model = CostModel()
+        self.task_available = threading.Condition(self.lock)  # Сигнал воркерам о новой задаче
+        self.worker_count = SERVER_CONFIG["max_concurrent_tasks"]  # Слотов обработки (для расписания)
+        self._backlog_sec = 0.0  # Предсказанная работа ожидающих и обрабатываемых задач защиты (сек)
+        self._schedule: Optional[Dict[str, Dict]] = None  # Кэш get_schedule до следующего изменения очереди
         self.load_tasks()
     
+    def add_listener(self, listener: Callable[[ProcessingTask], None]) -> None:
+        """Подписывает функцию на создание/изменение задач (вызывается в потоке изменения)"""
+        self.listeners.append(listener)
+    
+    def remove_listener(self, listener: Callable[[ProcessingTask], None]) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+    
+    def _notify(self, task: ProcessingTask) -> None:
+        for listener in list(self.listeners):
+            try:
+                listener(task)
+            except Exception as e:
+                logger.warning(f"[WARN] Task listener error: {e}")
+    
+    def _index_add(self, task: ProcessingTask) -> None:
+        """Добавляет задачу в индексы по статусу/пользователю и планировщик (вызывается под self.lock)"""
+        self.by_status.setdefault(task.status, TaskIndex()).add(task)
+        self.by_user.setdefault(task.user_id, TaskIndex()).add(task)
+        if task.task_type == TaskType.PROTECT and task.status in self.SCHEDULED_STATUSES:
+            self._backlog_sec += task.predicted_sec or 0.0
+            self._schedule = None
+            if task.status == TaskStatus.PENDING:
+                self.scheduler.push(task)
+        if task.status == TaskStatus.COMPLETED:
+            self.metrics_summary.add(task.metrics)
+    
+    def _index_remove(self, task: ProcessingTask) -> None:
+        """Удаляет задачу из индексов по статусу/пользователю и планировщика (вызывается под self.lock)"""
+        if task.task_type == TaskType.PROTECT and task.status in self.SCHEDULED_STATUSES:
+            self._backlog_sec = max(0.0, self._backlog_sec - (task.predicted_sec or 0.0))
+            self._schedule = None
+            if task.status == TaskStatus.PENDING:
+                self.scheduler.remove(task)
+        status_index = self.by_status.get(task.status)
+        if status_index is not None:
+            status_index.remove(task)
+        user_index = self.by_user.get(task.user_id)
+        if user_index is not None:
+            user_index.remove(task)
+            if not user_index:
+                del self.by_user[task.user_id]
+        if task.status == TaskStatus.COMPLETED:
+            self.metrics_summary.remove(task.metrics)
+    
+    def reset(self, tasks: Iterable[ProcessingTask] = (), tasks_db: Optional[Path] = None) -> None:
+        """
+        Заменяет все задачи очереди на tasks (по умолчанию — пустая очередь)
+        и заново строит индексы и планировщик; tasks_db — другой файл базы.
+        На диск не пишет: сохранит следующий save_tasks. Для тестов и бенчмарков.
+        """
+        with self.lock:
+            if tasks_db is not None:
+                self.tasks_db = Path(tasks_db)
+            self.tasks = {}
+            self.by_created = TaskIndex()
+            self.by_status = {}
+            self.by_user = {}
+            self.metrics_summary = MetricsAggregate()
+            self.scheduler = make_scheduler()
+            self._backlog_sec = 0.0
+            self._schedule = None
+            for task in tasks:
+                self.tasks[task.task_id] = task
+                self.by_created.add(task)
+                self._index_add(task)
+            self.unsaved_changes = True
+    
     def load_tasks(self) -> None:
         """Загружает задачи из базы данных и очищает зависшие"""
         if self.tasks_db.exists():
@@ -95,14 +281,31 @@ class VideoProcessingQueue:
                 with open(self.tasks_db, 'r', encoding='utf-8') as f:
                     data = json.load(f)
                     for task_id, task_data in data.items():
-                        task = ProcessingTask(**task_data)
+                        # Поля, которых больше нет в ProcessingTask, пропускаются
+                        task = ProcessingTask(**{
+                            key: value for key, value in task_data.items()
+                            if key in ProcessingTask.__dataclass_fields__
+                        })
+                        if "task_type" not in task_data:
+                            # Задачи до появления task_type: тип хранился в notes
+                            notes = task.notes or ""
+                            if notes == "strip_metadata":
+                                task.task_type = TaskType.METADATA
+                            elif notes.startswith("compress_to_"):
+                                task.task_type = TaskType.COMPRESS
                         
                         # Очистка зависших задач со статусом "processing"
                         if task.status == TaskStatus.PROCESSING:
                             logger.warning(f"[CLEANUP] Found stuck task: {task_id}")
                             
-                            # Проверить есть ли выходной файл
-                            if task.output_video:
+                            # Входной файл на месте — снова в очередь, обработка кадров
+                            # продолжится с чекпоинта (VideoProcessor.process_video);
+                            # иначе проверить есть ли выходной файл
+                            if self._can_resume(task):
+                                task.status = TaskStatus.PENDING
+                                task.resumes += 1
+                                logger.warning(f"[CLEANUP] Re-queued {task_id} (resume {task.resumes}/{SERVER_CONFIG['max_task_resumes']})")
+                            elif task.output_video:
                                 output_path = OUTPUT_FOLDER / task.output_video
                                 if output_path.exists():
                                     # Файл есть - задача на самом деле завершена
@@ -119,21 +322,71 @@ class VideoProcessingQueue:
                                 task.status = TaskStatus.FAILED
                                 task.error_message = "Обработка прервана (зависла при перезагрузке)"
                                 logger.warning(f"[CLEANUP] Marked {task_id} as FAILED (no output_video)")
+                            
+                            if task.status != TaskStatus.PENDING:
+                                # Возобновления не будет — кадры и чекпоинт не нужны
+                                self.discard_checkpoint(task)
                         
                         self.tasks[task_id] = task
+                        self.by_created.add(task)
+                        self._index_add(task)
+                        server_metrics.TASKS.inc(status=task.status, type=task.task_type)
                 
                 logger.info(f"Загружено {len(self.tasks)} задач из базы")
+                
+                # Калибровка модели стоимости по истории (в порядке создания)
+                for task_id in self.by_status.get(TaskStatus.COMPLETED, TaskIndex()).ids():
+                    self._calibrate(self.tasks[task_id])
+                
                 self.save_tasks()  # Сохранить очищенные задачи обратно
             except Exception as e:
                 logger.error(f"Ошибка загрузки задач: {e}")
     
+    @staticmethod
+    def _can_resume(task: ProcessingTask) -> bool:
+        """Прерванную задачу защиты можно продолжить, пока цел входной файл и не исчерпан лимит"""
+        return (
+            task.task_type == TaskType.PROTECT
+            and task.resumes < SERVER_CONFIG["max_task_resumes"]
+            and not (task.output_video and (OUTPUT_FOLDER / task.output_video).exists())
+            and (INPUT_FOLDER / task.input_video).exists()
+        )
+    
+    @staticmethod
+    def discard_checkpoint(task: ProcessingTask) -> None:
+        """
+        Удаляет папку кадров и чекпоинта задачи защиты, которая больше не
+        будет возобновлена (упала окончательно или отменена).
+        """
+        if task.task_type != TaskType.PROTECT:
+            return
+        # media_cleaner тянет torch — импортируем только при очистке
+        from media_cleaner import frames_folder, cleanup_temps
+        every_n_frames = max(1, int(task.every_n_frames) if task.every_n_frames else 1)
+        folder = frames_folder(str(INPUT_FOLDER / task.input_video), every_n_frames)
+        if folder.exists():
+            logger.info(f"[CLEANUP] Removing checkpoint of {task.task_id}: {folder.name}")
+            cleanup_temps(str(folder))
+    
     def save_tasks(self) -> None:
-        """Сохраняет задачи в базу данных"""
+        """
+        Сохраняет задачи в базу данных. Под self.lock снимается только снимок
+        задач; сериализация и запись идут вне блокировки, файл заменяется атомарно.
+        """
         try:
-            with self.lock:
-                data = {task_id: task.to_dict() for task_id, task in self.tasks.items()}
-                with open(self.tasks_db, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=2)
+            with self.save_lock:
+                with self.lock:
+                    data = {task_id: task.to_dict() for task_id, task in self.tasks.items()}
+                    self.last_saved = time.monotonic()
+                    self.unsaved_changes = False
+                try:
+                    tmp_path = self.tasks_db.with_suffix(".tmp")
+                    with open(tmp_path, 'w', encoding='utf-8') as f:
+                        json.dump(data, f, ensure_ascii=False)
+                    os.replace(tmp_path, self.tasks_db)
+                except Exception:
+                    self.unsaved_changes = True  # Повторить при следующем сохранении
+                    raise
                 logger.info(f"[OK] Saved {len(data)} tasks to {self.tasks_db}")
         except Exception as e:
             logger.error(f"[ERROR] Failed to save tasks: {type(e).__name__}: {e}", exc_info=True)
@@ -146,34 +399,91 @@ class VideoProcessingQueue:
                    audio_level: str = None,
                    every_n_frames: int = None,
                    user_id: str = None,
-                   notes: str = None) -> str:
+                   notes: str = None,
+                   task_type: str = TaskType.PROTECT,
+                   profile: bool = False,
+                   video_info: Optional[Dict] = None,
+                   priority: Optional[str] = None) -> str:
         """
         Создает новую задачу обработки видео.
+        video_info — параметры видео (task_cost.probe_video + num_eot/tiled)
+        для предсказания времени обработки; priority — класс приоритета.
         Возвращает task_id
         """
+        task = self._new_task(input_video, epsilon, video_strength, audio_level, every_n_frames,
+                              user_id, notes, task_type, profile, video_info, priority)
+        with self.lock:
+            save_due = self._insert_task(task)
+        self._task_created(task, save_due)
+        return task.task_id
+    
+    def admit_and_create(self, input_video: str, **kwargs) -> Tuple[Optional[str], int]:
+        """
+        Допуск по загрузке очереди (admit) и создание задачи одним шагом под
+        self.lock: одновременные загрузки не проходят проверку все сразу,
+        не успев добавить свою стоимость в очередь. Параметры — как у create_task.
+        Returns: (task_id или None при отказе, Retry-After в секундах при отказе)
+        """
+        task = self._new_task(input_video, **kwargs)
+        with self.lock:
+            admitted, retry_after = self._admit(task.predicted_sec)
+            if not admitted:
+                return None, retry_after
+            save_due = self._insert_task(task)
+        self._task_created(task, save_due)
+        return task.task_id, 0
+    
+    def _new_task(self, input_video: str,
+                  epsilon: float = None,
+                  video_strength: float = None,
+                  audio_level: str = None,
+                  every_n_frames: int = None,
+                  user_id: str = None,
+                  notes: str = None,
+                  task_type: str = TaskType.PROTECT,
+                  profile: bool = False,
+                  video_info: Optional[Dict] = None,
+                  priority: Optional[str] = None) -> ProcessingTask:
+        """Новая задача (PENDING) с параметрами по умолчанию и предсказанным временем"""
         task_id = str(uuid.uuid4())[:8]  # Первые 8 символов UUID
+        every_n_frames = every_n_frames or SERVER_CONFIG["default_every_n_frames"]
         
         task = ProcessingTask(
             task_id=task_id,
             input_video=input_video,
             status=TaskStatus.PENDING,
             created_at=datetime.now().isoformat(),
+            task_type=task_type,
             epsilon=epsilon or SERVER_CONFIG["default_video_epsilon"],
             video_strength=video_strength or SERVER_CONFIG["default_video_strength"],
             audio_level=audio_level or SERVER_CONFIG["default_audio_level"],
-            every_n_frames=every_n_frames or SERVER_CONFIG["default_every_n_frames"],
+            every_n_frames=every_n_frames,
             user_id=user_id,
             notes=notes,
+            priority=priority or SERVER_CONFIG["default_priority"],
+            profile=profile,
+            video_info=video_info,
+            predicted_sec=self.cost_model.predict(video_info, every_n_frames),
         )
+        return task
+    
+    def _insert_task(self, task: ProcessingTask) -> bool:
+        """Добавляет задачу в очередь и индексы (вызывается под self.lock); True — пора сохранить"""
+        self.tasks[task.task_id] = task
+        self.by_created.add(task)
+        self._index_add(task)
+        self.task_available.notify()
+        return self._mark_unsaved()
+    
+    def _task_created(self, task: ProcessingTask, save_due: bool) -> None:
+        """Метрики, слушатели и сохранение после добавления задачи (вне self.lock)"""
+        server_metrics.TASKS.inc(status=task.status, type=task.task_type)
+        self._notify(task)
         
-        with self.lock:
-            self.tasks[task_id] = task
-        
-        logger.info(f"[CREATE] Task {task_id} added to memory (total: {len(self.tasks)})")
-        self.save_tasks()
-        logger.info(f"[CREATE] Task {task_id} created and saved")
-        logger.info(f"[OK] Task created: {task_id} (video: {input_video})")
-        return task_id
+        logger.info(f"[CREATE] Task {task.task_id} added to memory (total: {len(self.tasks)})")
+        if save_due:
+            self.save_tasks()
+        logger.info(f"[OK] Task created: {task.task_id} (video: {task.input_video})")
     
     def get_task(self, task_id: str) -> Optional[ProcessingTask]:
         """Получает задачу по ID"""
@@ -186,37 +496,259 @@ class VideoProcessingQueue:
         
         with self.lock:
             task = self.tasks[task_id]
+            old_status = task.status
+            reindex = any(key in kwargs for key in self.INDEXED_FIELDS)
+            if reindex:
+                self._index_remove(task)
             for key, value in kwargs.items():
                 if hasattr(task, key):
                     setattr(task, key, value)
                     if key == "output_video":
                         logger.info(f"[QUEUE] Set output_video={value} for task {task_id}")
-            self.tasks[task_id] = task
+            if reindex:
+                self._index_add(task)
+            task.version += 1
+            save_due = self._mark_unsaved()
         
-        self.save_tasks()
-        logger.info(f"[QUEUE] Task {task_id} saved to JSON with status={task.status}")
+        self._observe_update(task, old_status, kwargs)
+        self._notify(task)
+        if save_due:
+            self.save_tasks()
+        logger.info(f"[QUEUE] Task {task_id} updated: status={task.status}")
         return True
     
+    def report_progress(self, task_id: str, **kwargs) -> bool:
+        """
+        Обновляет прогресс задачи (progress, processed_frames, eta_seconds, ...).
+        Изменение сразу видно в памяти и слушателям, а на диск записывается
+        не чаще progress_save_interval_sec. Смена статуса и других полей
+        индексов идёт через update_task (переиндексация).
+        """
+        if any(key in kwargs for key in self.INDEXED_FIELDS):
+            return self.update_task(task_id, **kwargs)
+        
+        with self.lock:
+            task = self.tasks.get(task_id)
+            if task is None:
+                return False
+            for key, value in kwargs.items():
+                if hasattr(task, key):
+                    setattr(task, key, value)
+            task.version += 1
+            save_due = self._mark_unsaved()
+        
+        self._notify(task)
+        if save_due:
+            self.save_tasks()
+        return True
+    
+    def _mark_unsaved(self) -> bool:
+        """
+        Отмечает несохранённое изменение (вызывается под self.lock).
+        True — пора записать базу: прошло progress_save_interval_sec с прошлой записи.
+        """
+        self.unsaved_changes = True
+        return time.monotonic() - self.last_saved >= SERVER_CONFIG["progress_save_interval_sec"]
+    
+    def flush_progress(self) -> None:
+        """Записывает на диск изменения, отложенные троттлингом"""
+        if self.unsaved_changes:
+            self.save_tasks()
+    
+    def _observe_update(self, task: ProcessingTask, old_status: str, changes: Dict) -> None:
+        """Инкрементально обновляет метрики сервера по изменению задачи"""
+        if task.status != old_status:
+            server_metrics.TASKS.dec(status=old_status, type=task.task_type)
+            server_metrics.TASKS.inc(status=task.status, type=task.task_type)
+            
+            if old_status == TaskStatus.PENDING and task.status == TaskStatus.PROCESSING:
+                try:
+                    waited = (datetime.now() - datetime.fromisoformat(task.created_at)).total_seconds()
+                    server_metrics.DISPATCH_LATENCY.observe(max(0.0, waited), type=task.task_type)
+                except ValueError:
+                    pass
+        
+        if changes.get("metrics"):
+            server_metrics.observe_task_metrics(task.task_type, changes["metrics"])
+            if task.status == TaskStatus.COMPLETED:
+                self._calibrate(task)
+    
+    def _calibrate(self, task: ProcessingTask) -> None:
+        """Учитывает метрики завершённой задачи в модели стоимости"""
+        # Возобновлённые задачи обработали только часть кадров — метрики не показательны
+        if task.task_type == TaskType.PROTECT and not task.resumes:
+            self.cost_model.observe(task.video_info, task.every_n_frames, task.metrics)
+    
+    # ──── ПЛАНИРОВАНИЕ ───────────────────────────────────────────────────────
+    
+    @staticmethod
+    def _remaining_sec(task: ProcessingTask, now: float) -> float:
+        """Оставшееся предсказанное время обрабатываемой задачи"""
+        try:
+            elapsed = now - float(task.started_at)
+        except (TypeError, ValueError):
+            elapsed = 0.0
+        return max(0.0, (task.predicted_sec or 0.0) - elapsed)
+    
+    def _simulate_schedule(self, now: float) -> Dict[str, Dict]:
+        """
+        Расписание задач защиты (вызывается под self.lock): обрабатываемые
+        занимают слоты на оставшееся время, ожидающие в порядке выбора
+        планировщика встают на первый освободившийся слот.
+        """
+        schedule = {}
+        slots = []
+        for task_id in self.by_status.get(TaskStatus.PROCESSING, TaskIndex()).ids():
+            task = self.tasks[task_id]
+            if task.task_type != TaskType.PROTECT:
+                continue
+            remaining = self._remaining_sec(task, now)
+            schedule[task_id] = {"queue_position": 0, "predicted_finish": now + remaining}
+            slots.append(remaining)
+        
+        workers = max(1, self.worker_count)
+        slots = sorted(slots)[:workers] + [0.0] * max(0, workers - len(slots))
+        heapq.heapify(slots)
+        
+        for position, task in enumerate(self.scheduler.order(), 1):
+            start = heapq.heappop(slots)
+            finish = start + (task.predicted_sec or 0.0)
+            schedule[task.task_id] = {
+                "queue_position": position,
+                "predicted_start": now + start,
+                "predicted_finish": now + finish,
+            }
+            heapq.heappush(slots, finish)
+        return schedule
+    
+    def get_schedule(self, task_id: str) -> Dict:
+        """
+        Место в очереди (0 — обрабатывается) и ожидаемые predicted_start /
+        predicted_finish (unix time) задачи защиты; пустой словарь для прочих.
+        Считается только по запросу и кэшируется до следующего изменения очереди.
+        """
+        with self.lock:
+            if self._schedule is None:
+                self._schedule = self._simulate_schedule(time.time())
+            return dict(self._schedule.get(task_id, {}))
+    
+    def backlog_sec(self) -> float:
+        """
+        Предсказанная работа в очереди на один слот, O(1): сумма predicted_sec
+        ожидающих и обрабатываемых задач ведётся в _index_add/_index_remove
+        (обрабатываемые учитываются целиком до завершения — оценка сверху).
+        """
+        with self.lock:
+            return self._backlog_sec / max(1, self.worker_count)
+    
+    def admit(self, predicted_sec: Optional[float]) -> Tuple[bool, int]:
+        """
+        Допуск новой задачи по суммарной предсказанной работе (O(1)).
+        Пустая очередь принимает любую задачу. Только проверка — для допуска
+        с созданием задачи без гонки есть admit_and_create.
+        Returns: (принять ли, Retry-After в секундах при отказе)
+        """
+        with self.lock:
+            return self._admit(predicted_sec)
+    
+    def _admit(self, predicted_sec: Optional[float]) -> Tuple[bool, int]:
+        """admit под self.lock"""
+        load = (self._backlog_sec + (predicted_sec or 0.0)) / max(1, self.worker_count)
+        if self._backlog_sec <= 0 or load <= SERVER_CONFIG["max_backlog_sec"]:
+            return True, 0
+        retry_after = max(SERVER_CONFIG["busy_retry_after_sec"], math.ceil(load - SERVER_CONFIG["max_backlog_sec"]))
+        return False, retry_after
+    
+    def claim_task(self, timeout: Optional[float] = None) -> Optional[ProcessingTask]:
+        """
+        Атомарно берёт следующую задачу защиты (по планировщику) и переводит
+        её в PROCESSING. Ждёт появления задачи до timeout секунд; None, если задач нет.
+        """
+        with self.task_available:
+            if not self.scheduler and timeout:
+                self.task_available.wait(timeout)
+            task = self.scheduler.pop()
+            if task is None:
+                return None
+            
+            self._index_remove(task)
+            task.status = TaskStatus.PROCESSING
+            task.started_at = f"{time.time()}"
+            self._index_add(task)
+            task.version += 1
+            save_due = self._mark_unsaved()
+        
+        self._observe_update(task, TaskStatus.PENDING, {"status": TaskStatus.PROCESSING})
+        self._notify(task)
+        if save_due:
+            self.save_tasks()
+        logger.info(f"[QUEUE] Task {task.task_id} claimed for processing")
+        return task
+    
+    def get_scheduler_summary(self) -> Dict:
+        """Ожидающие задачи защиты по классам приоритета (число задач, пользователей, дефицит DRR)"""
+        with self.lock:
+            return self.scheduler.summary()
+    
     def get_pending_tasks(self, limit: int = 1) -> List[ProcessingTask]:
-        """Получает ожидающие обработки задачи"""
-        pending = [
-            task for task in self.tasks.values()
-            if task.status == TaskStatus.PENDING
-        ]
-        return pending[:limit]
+        """Получает ожидающие задачи защиты в порядке запуска (классы приоритета, доля пользователей)"""
+        with self.lock:
+            return self.scheduler.order(limit)
     
     def get_user_tasks(self, user_id: str) -> List[ProcessingTask]:
         """Получает все задачи пользователя"""
-        return [
-            task for task in self.tasks.values()
-            if task.user_id == user_id
-        ]
+        with self.lock:
+            return [self.tasks[task_id] for task_id in self.by_user.get(user_id, TaskIndex()).ids()]
     
     def get_all_tasks(self, status: str = None) -> List[ProcessingTask]:
         """Получает все задачи, опционально фильтруя по статусу"""
-        if status:
-            return [task for task in self.tasks.values() if task.status == status]
-        return list(self.tasks.values())
+        with self.lock:
+            if status:
+                return [self.tasks[task_id] for task_id in self.by_status.get(status, TaskIndex()).ids()]
+            return list(self.tasks.values())
+    
+    def list_tasks_page(self, user_id: Optional[str] = None, status: Optional[str] = None,
+                        limit: int = 50, after: Optional[Tuple[str, str]] = None
+                        ) -> Tuple[List[ProcessingTask], Optional[Tuple[str, str]]]:
+        """
+        Страница задач от новых к старым (keyset-пагинация).
+        
+        Args:
+            user_id, status: Фильтры (можно вместе)
+            limit: Размер страницы
+            after: Ключ (created_at, task_id) последней задачи предыдущей страницы
+        
+        Returns:
+            (задачи, ключ для следующей страницы или None)
+        """
+        with self.lock:
+            # Идём по меньшему из подходящих индексов, второй фильтр проверяем на задаче
+            indexes = [self.by_created]
+            if user_id is not None:
+                indexes.append(self.by_user.get(user_id, TaskIndex()))
+            if status:
+                indexes.append(self.by_status.get(status, TaskIndex()))
+            index = min(indexes, key=len)
+            
+            page = []
+            for task_id in index.ids_desc(before=after):
+                task = self.tasks[task_id]
+                if user_id is not None and task.user_id != user_id:
+                    continue
+                if status and task.status != status:
+                    continue
+                page.append(task)
+                if len(page) > limit:
+                    break
+        
+        if len(page) > limit:
+            page = page[:limit]
+            return page, TaskIndex.key(page[-1])
+        return page, None
+    
+    def count_tasks(self, status: str) -> int:
+        """Количество задач в статусе, O(1)"""
+        return len(self.by_status.get(status, TaskIndex()))
     
     def cancel_task(self, task_id: str) -> bool:
         """Отменяет задачу (даже если уже обрабатывается)"""
@@ -234,7 +766,12 @@ class VideoProcessingQueue:
         
         # Отменяем задачу независимо от статуса (PENDING или PROCESSING)
         logger.info(f"[CANCEL] Marking task {task_id} as cancelled")
+        was_pending = task.status == TaskStatus.PENDING
         self.update_task(task_id, status=TaskStatus.CANCELLED)
+        if was_pending:
+            # Обрабатываемую задачу чистит обработчик; ожидающая могла
+            # остаться с чекпоинтом после прерывания (resumes > 0)
+            self.discard_checkpoint(task)
         logger.info(f"[OK] Task cancelled: {task_id}")
         return True
     
@@ -247,35 +784,44 @@ class VideoProcessingQueue:
         cutoff_date = datetime.now() - timedelta(days=days)
         
         to_delete = []
-        for task_id, task in self.tasks.items():
-            if task.status in [TaskStatus.COMPLETED, TaskStatus.FAILED]:
-                task_date = datetime.fromisoformat(task.completed_at)
-                if task_date < cutoff_date:
-                    to_delete.append(task_id)
+        with self.lock:
+            finished = [
+                self.tasks[task_id]
+                for status in (TaskStatus.COMPLETED, TaskStatus.FAILED)
+                for task_id in self.by_status.get(status, TaskIndex()).ids()
+            ]
+        for task in finished:
+            task_date = datetime.fromisoformat(task.completed_at)
+            if task_date < cutoff_date:
+                to_delete.append(task.task_id)
         
         with self.lock:
             for task_id in to_delete:
-                del self.tasks[task_id]
+                task = self.tasks.pop(task_id)
+                self.by_created.remove(task)
+                self._index_remove(task)
+                server_metrics.TASKS.dec(status=task.status, type=task.task_type)
+                for name in (task.profile_files or {}).values():
+                    (PROFILES_FOLDER / name).unlink(missing_ok=True)
         
         self.save_tasks()
         logger.info(f"[OK] Deleted {len(to_delete)} old tasks")
         return len(to_delete)
     
     def get_statistics(self) -> Dict:
-        """Возвращает статистику очереди"""
-        total = len(self.tasks)
-        pending = sum(1 for t in self.tasks.values() if t.status == TaskStatus.PENDING)
-        processing = sum(1 for t in self.tasks.values() if t.status == TaskStatus.PROCESSING)
-        completed = sum(1 for t in self.tasks.values() if t.status == TaskStatus.COMPLETED)
-        failed = sum(1 for t in self.tasks.values() if t.status == TaskStatus.FAILED)
-        
+        """Возвращает статистику очереди (по размерам индексов, без обхода задач)"""
         return {
-            "total": total,
-            "pending": pending,
-            "processing": processing,
-            "completed": completed,
-            "failed": failed,
+            "total": len(self.tasks),
+            "pending": self.count_tasks(TaskStatus.PENDING),
+            "processing": self.count_tasks(TaskStatus.PROCESSING),
+            "completed": self.count_tasks(TaskStatus.COMPLETED),
+            "failed": self.count_tasks(TaskStatus.FAILED),
+            "cancelled": self.count_tasks(TaskStatus.CANCELLED),
         }
+    
+    def get_metrics_summary(self) -> Dict:
+        """Сводка метрик этапов по успешно завершённым задачам"""
+        return self.metrics_summary.to_dict()
 
 
 # ──── ГЛОБАЛЬНАЯ ОЧЕРЕДЬ ────────────────────────────────────────────────────
@@ -3,27 +3,38 @@ REST API сервер для Imperceptible Protected Video Generator
 Использует FastAPI + Uvicorn
 """
 
+import asyncio
+import base64
+import binascii
+import json
 import logging
 import logging.config
 import os
+import random
+import shutil
 import threading
 from pathlib import Path
 from typing import Optional, Dict
 from contextlib import asynccontextmanager
 from uuid import uuid4
-from fastapi import FastAPI, UploadFile, File, HTTPException, Query
-from fastapi.responses import FileResponse, JSONResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 import uvicorn
 
 from server_config import (
     SERVER_CONFIG, LOGGING_CONFIG, 
-    INPUT_FOLDER, OUTPUT_FOLDER, TEMP_FOLDER,
-    TaskStatus, TASK_STATUSES
+    INPUT_FOLDER, OUTPUT_FOLDER, TEMP_FOLDER, PROFILES_FOLDER,
+    TaskStatus, TaskType, TASK_STATUSES
 )
-from queue_processor import processing_queue, ProcessingTask
-from server_video_worker import process_video_task
+from queue_processor import processing_queue, ProcessingTask, PUBLIC_TASK_FIELDS
+from server_video_worker import start_queue_processor
+from media_cleaner import CONFIG as CLEANER_CONFIG
+from task_cost import probe_video
+from task_events import task_events
+import server_metrics
 
 # ──── НАСТРОЙКА ЛОГИРОВАНИЯ ──────────────────────────────────────────────────
 logging.config.dictConfig(LOGGING_CONFIG)
@@ -42,11 +53,16 @@ async def lifespan(app: FastAPI):
     stats = processing_queue.get_statistics()
     logger.info(f"[API] Loaded tasks from DB: {stats['total']}")
     logger.info(f"[API] Pending processing: {stats['pending']}")
+    # Задачи защиты запускают воркеры очереди (при run_server.py уже запущены)
+    start_queue_processor(num_workers=SERVER_CONFIG["max_concurrent_tasks"])
+    server_metrics.set_worker_capacity(processing_queue.worker_count)
+    processing_queue.add_listener(task_events.publish)
     
     yield
     
     # ─────── SHUTDOWN (при остановке) ──────────
     logger.info("[API] Shutting down REST API server...")
+    processing_queue.remove_listener(task_events.publish)
     processing_queue.save_tasks()
 
 
@@ -66,6 +82,24 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.middleware("http")
+async def reject_upload_when_busy(request: Request, call_next):
+    """
+    Очередь уже переполнена — 429 на /upload до разбора формы: FastAPI
+    принимает файл целиком ещё до вызова обработчика.
+    """
+    if request.method == "POST" and request.url.path == "/upload":
+        admitted, retry_after = processing_queue.admit(None)
+        if not admitted:
+            backlog = processing_queue.backlog_sec()
+            return JSONResponse(
+                status_code=429,
+                content={"detail": f"Сервер занят: очередь на {backlog / 60:.0f} мин обработки. Попробуйте позже."},
+                headers={"Retry-After": str(retry_after)}
+            )
+    return await call_next(request)
+
 # ──── МАРШРУТЫ API ───────────────────────────────────────────────────────────
 
 @app.get("/")
@@ -80,9 +114,14 @@ async def root():
         "endpoints": {
             "upload": "/upload",
             "task_status": "/task/{task_id}",
+            "task_events": "/task/{task_id}/events",
+            "task_profile": "/task/{task_id}/profile/{kind}",
+            "task_websocket": "/ws/tasks",
             "task_list": "/tasks",
             "download": "/download/{task_id}",
             "cancel": "/cancel/{task_id}",
+            "stats": "/stats",
+            "metrics": "/metrics",
             "health": "/health"
         }
     }
@@ -97,6 +136,8 @@ async def upload_video(
     every_n_frames: int = Query(SERVER_CONFIG["default_every_n_frames"]),
     user_id: Optional[str] = Query(None),
     notes: Optional[str] = Query(None),
+    profile: bool = Query(False),
+    priority: str = Query(SERVER_CONFIG["default_priority"]),
 ):
     """
     Загрузить видео для обработки
@@ -109,8 +150,16 @@ async def upload_video(
     - **every_n_frames**: Применять к каждому N-му кадру (1-30)
     - **user_id**: ID пользователя (опционально)
     - **notes**: Заметки (опционально)
+    - **profile**: Профилировать обработку (ссылки на профиль — в task.profile_files)
+    - **priority**: Класс приоритета ("interactive" / "batch", см. priority_classes)
+    
+    Порядок обработки — классы приоритета по весам и честная доля между
+    пользователями (user_id), а не порядок загрузки.
+    Допуск — по суммарной предсказанной работе очереди (модель стоимости
+    task_cost), а не по числу задач: при перегрузке 429 с Retry-After.
     
-    **Returns:** task_id и информация о задаче
+    **Returns:** task_id и информация о задаче (predicted_sec, queue_position,
+    predicted_start/predicted_finish — ожидаемые начало и конец, unix time)
     """
     
     try:
@@ -122,6 +171,12 @@ async def upload_video(
                 detail=f"Неподдерживаемый формат: {file_ext}. Поддерживаемые: {SERVER_CONFIG['supported_video_formats']}"
             )
         
+        if priority not in SERVER_CONFIG["priority_classes"]:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Неизвестный приоритет: {priority}. Допустимые: {list(SERVER_CONFIG['priority_classes'])}"
+            )
+        
         # Проверка размера файла
         file.file.seek(0, os.SEEK_END)
         file_size = file.file.tell() / (1024**3)  # В GB
@@ -133,14 +188,6 @@ async def upload_video(
                 detail=f"Файл слишком большой: {file_size:.2f}GB, максимум {SERVER_CONFIG['max_video_size_gb']}GB"
             )
         
-        # Проверка количества одновременных обработок
-        processing_tasks = processing_queue.get_all_tasks(TaskStatus.PROCESSING)
-        if len(processing_tasks) >= SERVER_CONFIG["max_concurrent_tasks"]:
-            raise HTTPException(
-                status_code=429,
-                detail=f"Сервер занят. Идёт обработка {len(processing_tasks)} видео. Попробуйте позже."
-            )
-        
         # Сохранение файла с уникальным именем
         import uuid
         unique_id = str(uuid.uuid4())[:8]
@@ -148,15 +195,25 @@ async def upload_video(
         unique_filename = f"{unique_id}_{file_path.stem}{file_path.suffix}"
         input_path = INPUT_FOLDER / unique_filename
         
-        # Сохраняем файл
-        content = await file.read()
+        # Сохраняем файл по частям, не читая его целиком в память
         with open(input_path, 'wb') as f:
-            f.write(content)
+            await run_in_threadpool(shutil.copyfileobj, file.file, f, 1024 * 1024)
+        server_metrics.UPLOAD_BYTES.inc(input_path.stat().st_size, endpoint="upload")
         
         logger.info(f"[UPLOAD] Video uploaded: {unique_filename} ({file_size:.2f}GB)")
         
-        # Создание задачи в очереди
-        task_id = processing_queue.create_task(
+        # Параметры видео -> предсказанное время -> допуск по загрузке очереди
+        video_info = await run_in_threadpool(probe_video, input_path)
+        if video_info is None:
+            input_path.unlink(missing_ok=True)
+            raise HTTPException(status_code=400, detail="Не удалось прочитать видео (повреждён или не видеофайл)")
+        video_info.update(num_eot=CLEANER_CONFIG["num_eot_transforms"], tiled=SERVER_CONFIG["video_tiled"])
+        
+        # Профилируются запрошенные задачи и случайная выборка остальных
+        profile = profile or random.random() < SERVER_CONFIG["profile_sample_rate"]
+        
+        # Допуск и создание задачи одним шагом: параллельные загрузки не превысят лимит
+        task_id, retry_after = processing_queue.admit_and_create(
             input_video=unique_filename,
             epsilon=epsilon,
             video_strength=video_strength,
@@ -164,17 +221,26 @@ async def upload_video(
             every_n_frames=every_n_frames,
             user_id=user_id,
             notes=notes,
+            profile=profile,
+            video_info=video_info,
+            priority=priority,
         )
+        if task_id is None:
+            input_path.unlink(missing_ok=True)
+            predicted_sec = processing_queue.cost_model.predict(video_info, every_n_frames)
+            raise HTTPException(
+                status_code=429,
+                detail=f"Сервер занят: видео (~{predicted_sec / 60:.0f} мин обработки) не помещается в очередь. Попробуйте позже.",
+                headers={"Retry-After": str(retry_after)}
+            )
         
-        # Запуск обработки в фоновом потоке
-        threading.Thread(target=process_video_task, args=(task_id,), daemon=True).start()
-        
+        # Обработку запустит воркер очереди (claim_task) в порядке расписания
         task = processing_queue.get_task(task_id)
         return {
             "status": "success",
             "task_id": task_id,
             "message": "Видео загружено и добавлено в очередь",
-            "task": task.to_public_dict()
+            "task": {**task.to_public_dict(), **processing_queue.get_schedule(task_id)}
         }
     
     except HTTPException:
@@ -184,24 +250,155 @@ async def upload_video(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+FINAL_STATUSES = (TaskStatus.COMPLETED, TaskStatus.FAILED, TaskStatus.CANCELLED)
+
+
 @app.get("/task/{task_id}")
-async def get_task_status(task_id: str):
+async def get_task_status(
+    task_id: str,
+    wait_seconds: float = Query(0, ge=0, le=SERVER_CONFIG["long_poll_max_sec"]),
+    since_version: Optional[int] = Query(None, ge=0),
+):
     """
     Получить статус задачи по ID
     
-    **Returns:** Информация о задаче и её статус
-    """
-    task = processing_queue.get_task(task_id)
+    **Parameters:**
+    - **wait_seconds**: Long-poll — держать запрос, пока задача не изменится (максимум long_poll_max_sec)
+    - **since_version**: Версия задачи, уже известная клиенту; если задача новее — ответ сразу.
+      Без since_version ожидается следующее изменение.
     
-    if not task:
-        raise HTTPException(status_code=404, detail=f"Задача не найдена: {task_id}")
+    Завершённая задача (completed/failed/cancelled) возвращается сразу.
     
+    **Returns:** Информация о задаче и её статус; для задачи в очереди —
+    queue_position и predicted_start/predicted_finish (unix time)
+    """
+    # Подписка до чтения состояния, чтобы не пропустить изменение между ними
+    subscription = task_events.subscribe([task_id]) if wait_seconds > 0 else None
+    try:
+        task = processing_queue.get_task(task_id)
+        
+        if not task:
+            raise HTTPException(status_code=404, detail=f"Задача не найдена: {task_id}")
+        
+        snapshot = task.to_public_dict()
+        up_to_date = since_version is None or snapshot["version"] <= since_version
+        if subscription and up_to_date and snapshot["status"] not in FINAL_STATUSES:
+            updates = await subscription.get(timeout=wait_seconds)
+            if updates:
+                snapshot = updates[-1]
+    finally:
+        if subscription:
+            subscription.close()
+    
+    if snapshot["status"] not in FINAL_STATUSES:
+        snapshot = {**snapshot, **processing_queue.get_schedule(task_id)}
     return {
         "status": "success",
-        "task": task.to_public_dict()
+        "task": snapshot
     }
 
 
+def _sse_message(snapshot: Dict) -> str:
+    """Событие SSE с состоянием задачи (id — версия задачи)"""
+    data = json.dumps(snapshot, ensure_ascii=False)
+    return f"id: {snapshot['version']}\ndata: {data}\n\n"
+
+
+@app.get("/task/{task_id}/events")
+async def task_events_stream(task_id: str, request: Request):
+    """
+    Поток обновлений задачи (Server-Sent Events)
+    
+    Сразу отправляет текущее состояние, затем каждое изменение задачи;
+    поток закрывается после перехода в completed/failed/cancelled.
+    
+    **Returns:** text/event-stream, data — JSON задачи как в /task/{task_id}
+    """
+    # Подписка до чтения состояния, чтобы не пропустить изменение между ними
+    subscription = task_events.subscribe([task_id])
+    task = processing_queue.get_task(task_id)
+    if not task:
+        subscription.close()
+        raise HTTPException(status_code=404, detail=f"Задача не найдена: {task_id}")
+    
+    keepalive = SERVER_CONFIG["events_keepalive_sec"]
+    
+    async def stream():
+        try:
+            snapshot = task.to_public_dict()
+            yield _sse_message(snapshot)
+            if snapshot["status"] in FINAL_STATUSES:
+                return
+            
+            while not await request.is_disconnected():
+                updates = await subscription.get(timeout=keepalive)
+                if not updates:
+                    yield ": keepalive\n\n"
+                    continue
+                for snapshot in updates:
+                    yield _sse_message(snapshot)
+                    if snapshot["status"] in FINAL_STATUSES:
+                        return
+        finally:
+            subscription.close()
+    
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.websocket("/ws/tasks")
+async def tasks_websocket(websocket: WebSocket):
+    """
+    WebSocket с обновлениями нескольких задач
+    
+    Клиент отправляет {"subscribe": [task_id, ...]} / {"unsubscribe": [...]};
+    сервер отвечает текущим состоянием и затем присылает
+    {"type": "task", "task": {...}} при каждом изменении, {"type": "ping"} — keepalive.
+    """
+    await websocket.accept()
+    subscription = task_events.subscribe()
+    keepalive = SERVER_CONFIG["events_keepalive_sec"]
+    
+    async def receive_commands():
+        while True:
+            message = await websocket.receive_json()
+            if message.get("unsubscribe"):
+                subscription.unwatch(message["unsubscribe"])
+            if message.get("subscribe"):
+                task_ids = [str(task_id) for task_id in message["subscribe"]]
+                subscription.watch(task_ids)
+                for task_id in task_ids:
+                    task = processing_queue.get_task(task_id)
+                    if task:
+                        await websocket.send_json({"type": "task", "task": task.to_public_dict()})
+                    else:
+                        await websocket.send_json({"type": "error", "task_id": task_id, "detail": "not found"})
+    
+    async def send_updates():
+        while True:
+            updates = await subscription.get(timeout=keepalive)
+            if not updates:
+                await websocket.send_json({"type": "ping"})
+            for snapshot in updates:
+                await websocket.send_json({"type": "task", "task": snapshot})
+    
+    workers = [asyncio.ensure_future(receive_commands()), asyncio.ensure_future(send_updates())]
+    try:
+        done, _ = await asyncio.wait(workers, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for worker in workers:
+            worker.cancel()
+        subscription.close()
+    
+    for worker in done:
+        error = worker.exception()
+        if error and not isinstance(error, WebSocketDisconnect):
+            logger.warning(f"[WS] Connection closed with error: {error}")
+
+
 @app.get("/stats")
 async def get_stats():
     """
@@ -209,58 +406,108 @@ async def get_stats():
     
     **Returns:** Информация о текущей нагрузке и статусе
     """
-    processing_tasks = processing_queue.get_all_tasks(TaskStatus.PROCESSING)
-    pending_tasks = processing_queue.get_all_tasks(TaskStatus.PENDING)
-    completed_tasks = processing_queue.get_all_tasks(TaskStatus.COMPLETED)
-    failed_tasks = processing_queue.get_all_tasks(TaskStatus.FAILED)
-    
+    stats = processing_queue.get_statistics()
     max_concurrent = SERVER_CONFIG["max_concurrent_tasks"]
     
     return {
         "status": "success",
         "processing": {
-            "count": len(processing_tasks),
+            "count": stats["processing"],
             "max": max_concurrent,
-            "percentage": (len(processing_tasks) / max_concurrent * 100) if max_concurrent > 0 else 0
+            "percentage": (stats["processing"] / max_concurrent * 100) if max_concurrent > 0 else 0
+        },
+        "pending": stats["pending"],
+        "completed": stats["completed"],
+        "failed": stats["failed"],
+        "total": stats["total"],
+        "queue": stats,
+        "config": {
+            "max_concurrent_tasks": max_concurrent,
+            "max_video_size_gb": SERVER_CONFIG["max_video_size_gb"],
+        },
+        "scheduler": {
+            "workers": processing_queue.worker_count,
+            "backlog_sec": round(processing_queue.backlog_sec(), 1),
+            "max_backlog_sec": SERVER_CONFIG["max_backlog_sec"],
+            "cost_model": processing_queue.cost_model.to_dict(),
+            "classes": processing_queue.get_scheduler_summary(),
         },
-        "pending": len(pending_tasks),
-        "completed": len(completed_tasks),
-        "failed": len(failed_tasks),
-        "total": len(processing_queue.tasks)
+        "pipeline": processing_queue.get_metrics_summary()
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Метрики сервера в формате Prometheus
+    
+    **Returns:** Очередь по статусам/типам, задержка запуска, длительность этапов,
+    кадры/сек, объём загрузок/скачиваний, ошибки ffmpeg, занятость воркеров
+    """
+    return PlainTextResponse(
+        server_metrics.render(),
+        media_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+
+def _encode_cursor(key) -> str:
+    """Курсор страницы: (created_at, task_id) последней задачи"""
+    raw = f"{key[0]}|{key[1]}".encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode("utf-8")
+        created_at, task_id = raw.rsplit("|", 1)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail="Некорректный cursor")
+    return (created_at, task_id)
+
+
 @app.get("/tasks")
 async def list_tasks(
     user_id: Optional[str] = Query(None),
     status: Optional[str] = Query(None),
-    limit: int = Query(50),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
+    fields: Optional[str] = Query(None),
 ):
     """
-    Получить список задач
+    Получить список задач (новые первыми, постранично)
     
     **Parameters:**
     - **user_id**: Фильтр по ID пользователя
-    - **status**: Фильтр по статусу (pending/processing/completed/failed)
-    - **limit**: Максимум задач в ответе
+    - **status**: Фильтр по статусу (pending/processing/completed/failed); можно вместе с user_id
+    - **limit**: Размер страницы (1-500)
+    - **cursor**: next_cursor из предыдущего ответа
+    - **fields**: Поля задачи через запятую (например, task_id,status,progress)
     
-    **Returns:** Список задач
+    **Returns:** Список задач и next_cursor (null — страниц больше нет)
     """
     
-    if user_id:
-        tasks = processing_queue.get_user_tasks(user_id)
-    elif status:
-        tasks = processing_queue.get_all_tasks(status=status)
-    else:
-        tasks = processing_queue.get_all_tasks()
+    selected = None
+    if fields:
+        selected = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = set(selected) - set(PUBLIC_TASK_FIELDS)
+        if unknown:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Неизвестные поля: {', '.join(sorted(unknown))}. Доступные: {', '.join(PUBLIC_TASK_FIELDS)}"
+            )
     
-    # Сортируем по времени создания (новые первыми)
-    tasks = sorted(tasks, key=lambda t: t.created_at, reverse=True)[:limit]
+    tasks, next_key = processing_queue.list_tasks_page(
+        user_id=user_id,
+        status=status,
+        limit=limit,
+        after=_decode_cursor(cursor) if cursor else None
+    )
     
     return {
         "status": "success",
         "count": len(tasks),
-        "tasks": [task.to_public_dict() for task in tasks]
+        "tasks": [task.to_public_dict(selected) for task in tasks],
+        "next_cursor": _encode_cursor(next_key) if next_key else None
     }
 
 
@@ -301,6 +548,7 @@ async def download_result(task_id: str):
         raise HTTPException(status_code=404, detail=f"Файл был удалён: {output_path}")
     
     logger.info(f"📥 Скачан файл: {task.output_video} (задача {task_id})")
+    server_metrics.DOWNLOAD_BYTES.inc(output_path.stat().st_size)
     
     return FileResponse(
         output_path,
@@ -309,6 +557,30 @@ async def download_result(task_id: str):
     )
 
 
+@app.get("/task/{task_id}/profile/{kind}")
+async def download_task_profile(task_id: str, kind: str):
+    """
+    Файл профиля задачи (см. task_profiler)
+    
+    **kind**: collapsed — свёрнутые стеки для flamegraph, summary — топ функций,
+    pstats — дамп cProfile (при profile_mode="cprofile")
+    """
+    task = processing_queue.get_task(task_id)
+    if not task:
+        raise HTTPException(status_code=404, detail=f"Задача не найдена: {task_id}")
+    
+    name = (task.profile_files or {}).get(kind)
+    if not name:
+        raise HTTPException(status_code=404, detail=f"Профиль '{kind}' для задачи {task_id} не найден")
+    
+    path = PROFILES_FOLDER / name
+    if not path.exists():
+        raise HTTPException(status_code=404, detail=f"Файл профиля был удалён: {name}")
+    
+    media_type = "application/octet-stream" if kind == "pstats" else "text/plain; charset=utf-8"
+    return FileResponse(path, filename=name, media_type=media_type)
+
+
 @app.post("/cancel/{task_id}")
 async def cancel_task(task_id: str):
     """
@@ -327,25 +599,6 @@ async def cancel_task(task_id: str):
     }
 
 
-@app.get("/stats")
-async def get_statistics():
-    """
-    Получить статистику сервера
-    
-    **Returns:** Информация о очереди и статистика
-    """
-    stats = processing_queue.get_statistics()
-    
-    return {
-        "status": "success",
-        "queue": stats,
-        "config": {
-            "max_concurrent_tasks": SERVER_CONFIG["max_concurrent_tasks"],
-            "max_video_size_gb": SERVER_CONFIG["max_video_size_gb"],
-        }
-    }
-
-
 @app.get("/health")
 async def health_check():
     """Проверка здоровья сервера"""
@@ -398,6 +651,7 @@ async def strip_metadata_endpoint(file: UploadFile = File(...)):
         content = await file.read()
         with open(input_path, 'wb') as f:
             f.write(content)
+        server_metrics.UPLOAD_BYTES.inc(len(content), endpoint="strip-metadata")
         
         file_size = len(content) / (1024 ** 3)
         logger.info(f"[UPLOAD] Video uploaded: {unique_filename} ({file_size:.2f}GB)")
@@ -410,7 +664,8 @@ async def strip_metadata_endpoint(file: UploadFile = File(...)):
             audio_level="None",
             every_n_frames=1,
             user_id="web_metadata",
-            notes="strip_metadata"
+            notes="strip_metadata",
+            task_type=TaskType.METADATA
         )
         
         logger.info(f"[OK] Metadata strip task created: {task_id}")
@@ -454,6 +709,7 @@ async def compress_video_endpoint(file: UploadFile = File(...), target_size_mb:
         content = await file.read()
         with open(input_path, 'wb') as f:
             f.write(content)
+        server_metrics.UPLOAD_BYTES.inc(len(content), endpoint="compress-video")
         
         file_size = len(content) / (1024 ** 3)
         logger.info(f"[UPLOAD] Video uploaded for compression: {unique_filename} ({file_size:.2f}GB)")
@@ -466,7 +722,8 @@ async def compress_video_endpoint(file: UploadFile = File(...), target_size_mb:
             audio_level="None",
             every_n_frames=1,
             user_id="web_compress",
-            notes=f"compress_to_{target_size_mb}mb"
+            notes=f"compress_to_{target_size_mb}mb",
+            task_type=TaskType.COMPRESS
         )
         
         logger.info(f"[OK] Compress task created: {task_id} (target: {target_size_mb}MB)")
@@ -6,7 +6,7 @@ import os
 import sys
 import json
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List
 
 # ──── ОСНОВНЫЕ ПУТИ ────────────────────────────────────────────────────────
 SERVER_ROOT = Path(__file__).parent
@@ -14,10 +14,11 @@ INPUT_FOLDER = SERVER_ROOT / "videos_input"
 OUTPUT_FOLDER = SERVER_ROOT / "videos_output"
 TEMP_FOLDER = SERVER_ROOT / "videos_temp"
 LOGS_FOLDER = SERVER_ROOT / "server_logs"
-QUEUE_DB_FOLDER = SERVER_ROOT / "queue_db"
+QUEUE_DB_FOLDER = Path(os.getenv("QUEUE_DB_FOLDER", SERVER_ROOT / "queue_db"))  # Отдельная база для тестов и бенчмарков
+PROFILES_FOLDER = LOGS_FOLDER / "profiles"
 
 # ──── СОЗДАНИЕ ПАПОК ──────────────────────────────────────────────────────
-for folder in [INPUT_FOLDER, OUTPUT_FOLDER, TEMP_FOLDER, LOGS_FOLDER, QUEUE_DB_FOLDER]:
+for folder in [INPUT_FOLDER, OUTPUT_FOLDER, TEMP_FOLDER, LOGS_FOLDER, QUEUE_DB_FOLDER, PROFILES_FOLDER]:
     folder.mkdir(parents=True, exist_ok=True)
 
 # ──── ЗАГРУЗКА КОНФИГУРАЦИИ ──────────────────────────────────────────────────
@@ -43,6 +44,7 @@ SERVER_CONFIG = {
     "temp_folder": str(TEMP_FOLDER),
     "logs_folder": str(LOGS_FOLDER),
     "queue_db_folder": str(QUEUE_DB_FOLDER),
+    "profiles_folder": str(PROFILES_FOLDER),
     
     # REST API
     "host": "127.0.0.1",  # Локальный хост для браузера
@@ -54,11 +56,40 @@ SERVER_CONFIG = {
     "default_video_strength": 1.0,
     "default_audio_level": "слабый",  # None, "слабый", "средний", "сильный"
     "default_every_n_frames": 10,
+    "video_tiled": False,  # Тайловый режим градиентов для кадров высокого разрешения
+    "audio_in_memory": True,  # Аудио через pipe в кодер, без временных WAV файлов
+    "audio_workers": 4,  # Потоков для аудио-веток, идущих параллельно с кадрами
+    "events_keepalive_sec": 15,  # Интервал keepalive в потоках событий задач (SSE/WebSocket)
+    "long_poll_max_sec": 60,  # Максимальное wait_seconds для long-poll /task/{id}
+    "progress_save_interval_sec": 5,  # Изменения задач (прогресс, статусы) пишутся в tasks.json не чаще
+    
+    # Профилирование задач (profile=true в /upload или случайная выборка)
+    "profile_sample_rate": 0.0,  # Доля задач, профилируемых без запроса (0.0-1.0)
+    "profile_mode": "sampling",  # "sampling" — только сэмплер стеков, "cprofile" — ещё и cProfile потока задачи
+    "profile_interval_ms": 10,  # Интервал сэмплирования стеков
     
     # Лимиты
     "max_video_size_gb": 2,  # Максимальный размер видео в GB
     "max_concurrent_tasks": 10,  # Максимум одновременных обработок
+    "busy_retry_after_sec": 30,  # Минимальный Retry-After в ответе 429
+    "max_backlog_sec": 1800,  # Допуск в очередь: предсказанная работа (сек) на один слот обработки, включая новую задачу
+    "queue_aging_factor": 1.0,  # Порядок задач пользователя: предсказанное время минус ожидание * factor (короткие первыми, без голодания)
+    "priority_classes": {  # Классы приоритета -> вес в планировщике (task_scheduler, deficit round robin)
+        "interactive": 4,  # Загрузки из интерфейса/по одной
+        "batch": 1,  # Пакетная обработка
+    },
+    "default_priority": "interactive",  # Класс задачи, если priority не указан
+    "user_weights": {},  # user_id -> вес внутри класса (по умолчанию 1)
+    "drr_quantum_sec": 5,  # Квант DRR: секунд предсказанной обработки за ход на единицу веса (меньше — чаще чередование)
+    "cost_model_priors": {  # Начальные коэффициенты модели стоимости (task_cost), калибруются по метрикам задач
+        "model": 0.12,  # сек на кадр с шумом * num_eot * тайлов
+        "frame_io": 0.02,  # сек на кадр * мегапиксель (декодирование + PNG)
+        "assembly": 0.05,  # сек на кадр * мегапиксель (сборка ffmpeg)
+        "overhead": 1.0,  # сек на задачу
+    },
+    "cost_model_alpha": 0.2,  # Вес новой задачи при калибровке (экспоненциальное сглаживание)
     "task_timeout_hours": 24,  # Таймаут задачи в часах
+    "max_task_resumes": 2,  # Сколько раз прерванная (перезапуском/сбоем) задача ставится в очередь снова
     
     # Параметры видео
     "supported_video_formats": {'.mp4', '.mov', '.avi', '.mkv', '.webm'},
@@ -125,6 +156,12 @@ class TaskStatus:
     FAILED = "failed"            # Ошибка при обработке
     CANCELLED = "cancelled"      # Отменена пользователем
 
+class TaskType:
+    """Типы задач обработки"""
+    PROTECT = "protect"          # Защитный шум (видео + аудио)
+    METADATA = "metadata"        # Удаление метаданных
+    COMPRESS = "compress"        # Сжатие видео
+
 TASK_STATUSES = {
     TaskStatus.PENDING: "[WAIT] Waiting for processing",
     TaskStatus.PROCESSING: "[PROCESS] Processing",
@@ -134,6 +171,29 @@ TASK_STATUSES = {
 }
 
 # ──── ПРОВЕРКА КОНФИГУРАЦИИ ────────────────────────────────────────────────
+def _positive(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0
+
+
+def scheduler_config_errors() -> List[str]:
+    """
+    Ошибки настроек планировщика (task_scheduler): с нулевым квантом или
+    весами DRR не выберет ни одной задачи.
+    """
+    errors = []
+    if not _positive(SERVER_CONFIG["drr_quantum_sec"]):
+        errors.append(f"drr_quantum_sec должен быть > 0: {SERVER_CONFIG['drr_quantum_sec']!r}")
+    for priority, weight in SERVER_CONFIG["priority_classes"].items():
+        if not _positive(weight):
+            errors.append(f"Вес класса {priority!r} должен быть > 0: {weight!r}")
+    for user_id, weight in SERVER_CONFIG["user_weights"].items():
+        if not _positive(weight):
+            errors.append(f"Вес пользователя {user_id!r} должен быть > 0: {weight!r}")
+    if SERVER_CONFIG["default_priority"] not in SERVER_CONFIG["priority_classes"]:
+        errors.append(f"default_priority {SERVER_CONFIG['default_priority']!r} нет в priority_classes")
+    return errors
+
+
 def validate_config() -> bool:
     """Проверяет корректность конфигурации."""
     errors = []
@@ -159,6 +219,8 @@ def validate_config() -> bool:
     except Exception as e:
         errors.append(f"Нет прав доступа на запись в logs_folder: {e}")
     
+    errors.extend(scheduler_config_errors())
+    
     if errors:
         for error in errors:
             print(f"[ERROR] {error}")
@@ -168,6 +230,12 @@ def validate_config() -> bool:
     return True
 
 
+# Планировщик с неположительным квантом/весом завис бы под блокировкой очереди — не загружаемся
+_scheduler_errors = scheduler_config_errors()
+if _scheduler_errors:
+    raise ValueError("Некорректные настройки планировщика: " + "; ".join(_scheduler_errors))
+
+
 if __name__ == "__main__":
     print("Проверка конфигурации сервера...")
     validate_config()
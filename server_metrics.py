@@ -0,0 +1,264 @@
+"""
+Метрики сервера в формате Prometheus (text exposition 0.0.4)
+
+Счётчики, gauge и гистограммы обновляются инкрементально в местах событий
+(очередь, воркеры, ffmpeg, загрузки/скачивания), /metrics только отдаёт
+текущие значения без обхода задач.
+"""
+
+import functools
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class MetricsRegistry:
+    """Набор метрик, отдаваемых на /metrics"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: List["_Metric"] = []
+    
+    def register(self, metric: "_Metric") -> None:
+        with self.lock:
+            self.metrics.append(metric)
+    
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+class _Metric:
+    kind = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 registry: MetricsRegistry = REGISTRY):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values: Dict[Tuple[str, ...], object] = {}
+        registry.register(self)
+    
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+    
+    def _header(self) -> List[str]:
+        return [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+    
+    def render(self) -> List[str]:
+        with self.lock:
+            items = sorted(self.values.items())
+        lines = self._header()
+        for key, value in items:
+            lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Counter(_Metric):
+    """Монотонно растущий счётчик"""
+    
+    kind = "counter"
+    
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """Текущее значение (может расти и убывать)"""
+    
+    kind = "gauge"
+    
+    def set(self, value: float, **labels) -> None:
+        with self.lock:
+            self.values[self._key(labels)] = float(value)
+    
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+    
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+    
+    def get(self, **labels) -> float:
+        with self.lock:
+            return self.values.get(self._key(labels), 0.0)
+
+
+class Histogram(_Metric):
+    """Гистограмма с фиксированными границами корзин"""
+    
+    kind = "histogram"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = (0.1, 0.5, 1, 5, 10, 30, 60, 300),
+                 registry: MetricsRegistry = REGISTRY):
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        super().__init__(name, documentation, labelnames, registry)
+    
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.lock:
+            state = self.values.get(key)
+            if state is None:
+                state = self.values[key] = {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["buckets"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+    
+    def render(self) -> List[str]:
+        with self.lock:
+            items = [
+                (key, list(state["buckets"]), state["sum"], state["count"])
+                for key, state in sorted(self.values.items())
+            ]
+        lines = self._header()
+        names = self.labelnames + ("le",)
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                labels = _format_labels(names, key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+# ──── МЕТРИКИ СЕРВЕРА ───────────────────────────────────────────────────────
+TASKS = Gauge(
+    "mediacleaner_tasks",
+    "Задачи в очереди по статусу и типу",
+    ["status", "type"]
+)
+DISPATCH_LATENCY = Histogram(
+    "mediacleaner_dispatch_latency_seconds",
+    "Время от создания задачи до начала обработки",
+    ["type"],
+    buckets=(0.1, 0.5, 1, 5, 15, 60, 300, 900, 3600)
+)
+STAGE_DURATION = Histogram(
+    "mediacleaner_stage_duration_seconds",
+    "Длительность этапов обработки",
+    ["type", "stage"],
+    buckets=(0.5, 1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+)
+STAGE_FPS = Histogram(
+    "mediacleaner_stage_fps",
+    "Пропускная способность этапов (кадров/сек)",
+    ["type", "stage"],
+    buckets=(1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+)
+UPLOAD_BYTES = Counter(
+    "mediacleaner_upload_bytes_total",
+    "Принято байт в загрузках",
+    ["endpoint"]
+)
+DOWNLOAD_BYTES = Counter(
+    "mediacleaner_download_bytes_total",
+    "Отдано байт результатов"
+)
+FFMPEG_RUNS = Counter(
+    "mediacleaner_ffmpeg_runs_total",
+    "Запуски ffmpeg"
+)
+FFMPEG_FAILURES = Counter(
+    "mediacleaner_ffmpeg_failures_total",
+    "Запуски ffmpeg с ненулевым кодом возврата"
+)
+WORKERS_BUSY = Gauge(
+    "mediacleaner_workers_busy",
+    "Задачи, обрабатываемые в данный момент"
+)
+WORKER_CAPACITY = Gauge(
+    "mediacleaner_worker_capacity",
+    "Максимум одновременных обработок"
+)
+WORKER_BUSY_RATIO = Gauge(
+    "mediacleaner_worker_busy_ratio",
+    "Доля занятых слотов обработки (busy / capacity)"
+)
+WORKER_BUSY_SECONDS = Counter(
+    "mediacleaner_worker_busy_seconds_total",
+    "Суммарное время обработки задач",
+    ["type"]
+)
+
+
+def _update_busy_ratio() -> None:
+    capacity = WORKER_CAPACITY.get()
+    WORKER_BUSY_RATIO.set(WORKERS_BUSY.get() / capacity if capacity > 0 else 0.0)
+
+
+def set_worker_capacity(capacity: int) -> None:
+    """Задаёт число слотов обработки (для busy ratio)"""
+    WORKER_CAPACITY.set(capacity)
+    _update_busy_ratio()
+
+
+def track_worker(task_type: str):
+    """Декоратор обработчика задачи: учитывает занятость слота и время обработки"""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            WORKERS_BUSY.inc()
+            _update_busy_ratio()
+            started = time.monotonic()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                WORKER_BUSY_SECONDS.inc(time.monotonic() - started, type=task_type)
+                WORKERS_BUSY.dec()
+                _update_busy_ratio()
+        return wrapper
+    return decorator
+
+
+def observe_task_metrics(task_type: str, metrics: Optional[Dict]) -> None:
+    """Переносит метрики этапов задачи (TaskMetrics.to_dict) в гистограммы"""
+    if not metrics:
+        return
+    for stage, values in metrics.get("stages", {}).items():
+        STAGE_DURATION.observe(values.get("wall_sec", 0.0), type=task_type, stage=stage)
+        if values.get("fps"):
+            STAGE_FPS.observe(values["fps"], type=task_type, stage=stage)
+
+
+def render() -> str:
+    """Текст для ответа /metrics"""
+    return REGISTRY.render()
@@ -5,23 +5,190 @@
 
 import logging
 import os
-import shutil
 import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Dict, Optional
 import cv2
 
 from server_config import (
-    SERVER_CONFIG, TaskStatus,
+    SERVER_CONFIG, TaskStatus, TaskType,
     INPUT_FOLDER, OUTPUT_FOLDER, TEMP_FOLDER
 )
 from queue_processor import processing_queue
-from media_cleaner import VideoProcessor, AudioProcessor, extract_audio, assemble_video, cleanup_temps
+from ffmpeg_runner import run_ffmpeg
+from task_metrics import TaskMetrics, path_size
+from server_metrics import track_worker
+from task_profiler import profile_task, profile_thread
+from media_cleaner import (
+    VideoProcessor, AudioProcessor, ProcessingCancelled, extract_audio,
+    assemble_video, assemble_video_streamed, cleanup_temps,
+    METADATA_STRIP_PARAMS
+)
 
 logger = logging.getLogger("queue_processor")
 
+# Пул для аудио-веток задач: аудио обрабатывается параллельно с кадрами
+_audio_executor = ThreadPoolExecutor(
+    max_workers=SERVER_CONFIG["audio_workers"],
+    thread_name_prefix="AudioWorker"
+)
+
+
+class TaskProgress:
+    """
+    Сводный прогресс задачи по параллельным веткам.
+    Каждая ветка сообщает долю выполнения (0..1), общий прогресс —
+    взвешенная сумма поверх базовых 10% (подготовка).
+    Обновления идут через report_progress: в памяти сразу, на диск — с троттлингом.
+    После stop() (задача упала или отменена) ветки больше не пишут прогресс.
+    """
+    
+    BASE = 10.0
+    WEIGHTS = {"video": 60.0, "audio": 15.0, "assembly": 10.0}
+    
+    def __init__(self, task_id: str):
+        self.task_id = task_id
+        self.lock = threading.Lock()
+        self.fractions = {branch: 0.0 for branch in self.WEIGHTS}
+        self.stopped = threading.Event()
+    
+    def set(self, branch: str, fraction: float, **fields) -> float:
+        """Обновляет долю ветки и прогресс задачи; возвращает общий прогресс"""
+        with self.lock:
+            if not self.stopped.is_set():
+                self.fractions[branch] = min(1.0, max(0.0, fraction))
+            value = self.BASE + sum(
+                self.WEIGHTS[b] * f for b, f in self.fractions.items()
+            )
+            # Под блокировкой: после возврата из stop() отчётов уже не будет
+            if not self.stopped.is_set():
+                processing_queue.report_progress(self.task_id, progress=round(value, 1), **fields)
+        return value
+    
+    def stop(self) -> None:
+        """Останавливает ветки: дальнейшие set() не меняют задачу"""
+        with self.lock:
+            self.stopped.set()
+    
+    def ffmpeg_callback(self, branch: str, start: float = 0.0, end: float = 1.0,
+                        with_eta: bool = True) -> Callable[[Dict], None]:
+        """progress_fn для run_ffmpeg: доля ffmpeg → доля ветки в [start, end]"""
+        def on_progress(info: Dict) -> None:
+            if info["fraction"] is None:
+                return
+            fields = {"eta_seconds": info["eta_seconds"]} if with_eta else {}
+            self.set(branch, start + (end - start) * info["fraction"], **fields)
+        return on_progress
+    
+    def frames_callback(self, branch: str = "video") -> Callable[[int, int, int], None]:
+        """progress_fn для VideoProcessor.process_video: прогресс по каждому кадру"""
+        def on_frame(frame_idx: int, total_frames: int, noisy_frames: int) -> None:
+            self.set(branch, frame_idx / total_frames if total_frames else 0.0,
+                     processed_frames=noisy_frames)
+        return on_frame
+
+
+def _ffmpeg_task_progress(task_id: str, start: float, end: float) -> Callable[[Dict], None]:
+    """progress_fn для однопроходных задач: доля ffmpeg → progress в [start, end]"""
+    def on_progress(info: Dict) -> None:
+        if info["fraction"] is None:
+            return
+        processing_queue.report_progress(
+            task_id,
+            progress=round(start + (end - start) * info["fraction"], 1),
+            eta_seconds=info["eta_seconds"]
+        )
+    return on_progress
+
+
+def _task_cancelled(task_id: str) -> bool:
+    task = processing_queue.get_task(task_id)
+    return bool(task and task.status == TaskStatus.CANCELLED)
 
+
+@profile_thread("audio")
+def _run_audio_branch(task_id: str, input_path: str, audio_level: Optional[str],
+                      temp_audio_orig: str, temp_audio_adv: str,
+                      progress: TaskProgress, metrics: TaskMetrics,
+                      duration: Optional[float] = None) -> dict:
+    """
+    Аудио-ветка задачи (extract → mask), выполняется параллельно с кадрами.
+    Ошибки не прерывают задачу: собираем видео без маскировки.
+    Если задача упала (progress.stopped) или отменена, ветка останавливается
+    на ближайшем блоке аудио / блоке прогресса ffmpeg.
+    
+    Returns:
+        {"audio_level", "audio_scan", "final_audio"} для этапа сборки
+    """
+    result = {"audio_level": audio_level, "audio_scan": None, "final_audio": temp_audio_orig}
+    
+    def stopped() -> bool:
+        return progress.stopped.is_set() or _task_cancelled(task_id)
+    
+    try:
+        with metrics.stage("audio") as stage:
+            stage["bytes_read"] = path_size(input_path)
+            
+            if SERVER_CONFIG["audio_in_memory"]:
+                # Аудио через pipe без временных WAV: здесь только огибающая,
+                # маскирование идёт потоком прямо в кодер при сборке
+                if audio_level:
+                    logger.info(f"[AUDIO] {task_id}: masking level {audio_level} (in-memory)")
+                    result["audio_scan"] = AudioProcessor.scan_audio_stream(input_path, stopped)
+                else:
+                    logger.info(f"[AUDIO] {task_id}: masking disabled (original audio)")
+            else:
+                # ETA задачи ведёт сборка: параллельная аудио-ветка сообщает только долю
+                extract_audio(input_path, temp_audio_orig, duration=duration,
+                              progress_fn=progress.ffmpeg_callback("audio", 0.0, 0.5, with_eta=False),
+                              should_cancel_fn=stopped)
+                progress.set("audio", 0.5)
+                
+                if audio_level:
+                    logger.info(f"[AUDIO] {task_id}: masking level {audio_level}")
+                    AudioProcessor.add_imperceptible_audio_noise(temp_audio_orig, temp_audio_adv, audio_level,
+                                                                 should_cancel_fn=stopped)
+                    result["final_audio"] = temp_audio_adv
+                else:
+                    logger.info(f"[AUDIO] {task_id}: masking disabled (original audio)")
+                
+                stage["bytes_written"] = path_size(temp_audio_orig) + path_size(temp_audio_adv)
+    
+    except ProcessingCancelled:
+        logger.info(f"[CANCEL] {task_id}: audio branch stopped")
+        return result
+    except Exception as e:
+        logger.warning(f"[WARN] Audio processing error: {e}")
+        # Продолжаем без маскировки
+        result.update(audio_level=None, audio_scan=None, final_audio=temp_audio_orig)
+    
+    progress.set("audio", 1.0)
+    return result
+
+
+def _stop_audio_branch(audio_future, progress: TaskProgress, *temp_files: str) -> None:
+    """
+    Останавливает аудио-ветку упавшей или отменённой задачи: прогресс
+    ветки больше не пишется, ещё не начатая ветка снимается с пула,
+    начатая останавливается на ближайшем блоке (ffmpeg завершается).
+    Затем удаляет временные WAV.
+    """
+    progress.stop()
+    if not audio_future.cancel():
+        audio_future.exception()  # Ждём остановки; ошибки ветка уже залогировала
+    
+    for tmp_file in temp_files:
+        try:
+            if Path(tmp_file).exists():
+                Path(tmp_file).unlink()
+        except OSError as e:
+            logger.warning(f"[WARN] Cleanup error: {e}")
+
+
+@track_worker(TaskType.PROTECT)
+@profile_task
 def process_video_task(task_id: str) -> bool:
     """
     Обрабатывает видео в фоновом потоке
@@ -34,7 +201,12 @@ def process_video_task(task_id: str) -> bool:
     """
     
     logger.info(f"[START] Processing task: {task_id}")
-    processing_queue.update_task(task_id, status=TaskStatus.PROCESSING, started_at=f"{time.time()}")
+    task = processing_queue.get_task(task_id)
+    if task and task.status != TaskStatus.PROCESSING:
+        # Вызов в обход claim_task (бенчмарки, ручной запуск)
+        processing_queue.update_task(task_id, status=TaskStatus.PROCESSING, started_at=f"{time.time()}")
+    metrics = TaskMetrics()
+    audio_future = None
     
     try:
         task = processing_queue.get_task(task_id)
@@ -44,7 +216,6 @@ def process_video_task(task_id: str) -> bool:
         # Пути файлов
         input_path = INPUT_FOLDER / task.input_video
         base = Path(task.input_video).stem
-        temp_folder = str(TEMP_FOLDER / f"{task_id}_{base}_frames")
         temp_audio_orig = str(TEMP_FOLDER / f"{task_id}_{base}_audio_orig.wav")
         temp_audio_adv = str(TEMP_FOLDER / f"{task_id}_{base}_audio_adv.wav")
         output_filename = f"{task_id}_{base}_protected.mp4"
@@ -71,10 +242,20 @@ def process_video_task(task_id: str) -> bool:
         
         logger.info(f"[VIDEO] Parameters: {total_frames} frames @ {fps}fps")
         
-        # ──── ШАГ 3: Обработка видеокадров ────────────────────────────────
+        # ──── ШАГ 3: Параллельная обработка аудио ─────────────────────────
+        # Аудио не зависит от кадров: ветка (extract → mask) стартует сразу
+        # в отдельном потоке, сборка дожидается обеих веток
+        progress = TaskProgress(task_id)
+        audio_level = task.audio_level if task.audio_level and task.audio_level != "None" else None
+        audio_future = _audio_executor.submit(
+            _run_audio_branch, task_id, str(input_path), audio_level,
+            temp_audio_orig, temp_audio_adv, progress, metrics, total_frames / fps
+        )
+        
+        # ──── ШАГ 4: Обработка видеокадров ────────────────────────────────
         logger.info("[1/3] Video processing...")
         
-        video_processor = VideoProcessor(epsilon=task.epsilon)
+        video_processor = VideoProcessor(epsilon=task.epsilon, tiled=SERVER_CONFIG["video_tiled"])
         # Использовать параметр every_n_frames из задачи (пользовательский выбор)
         every_n_frames = int(task.every_n_frames) if task.every_n_frames else 1
         every_n_frames = max(1, every_n_frames)
@@ -82,82 +263,85 @@ def process_video_task(task_id: str) -> bool:
         
         logger.info(f"[VIDEO] every_n_frames={every_n_frames}, total_frames={total_frames}, frames_to_process={frames_to_process}")
         
-        processing_queue.update_task(task_id, progress=10.0, total_frames=frames_to_process)
+        processing_queue.report_progress(task_id, total_frames=frames_to_process)
+        progress.set("video", 0.0)
         
         # Функция для проверки отмены задачи
         def should_cancel():
-            task = processing_queue.get_task(task_id)
-            return task and task.status == TaskStatus.CANCELLED
-        
-        # Обработка видеокадров
-        processed_temp_folder, noisy_frames = video_processor.process_video(
-            str(input_path),
-            start_frame=1,
-            end_frame=total_frames,
-            every_n_frames=every_n_frames,
-            video_strength_mult=task.video_strength,
-            should_cancel_fn=should_cancel
-        )
-        
-        logger.info(f"[OK] Processed {noisy_frames} frames")
-        processing_queue.update_task(task_id, progress=50.0, processed_frames=noisy_frames)
-        
-        # Проверить отмену задачи
-        task = processing_queue.get_task(task_id)
-        if task and task.status == TaskStatus.CANCELLED:
-            logger.info(f"[CANCEL] Task cancelled during processing: {task_id}")
-            # Очистить временные файлы
-            if Path(processed_temp_folder).exists():
-                shutil.rmtree(processed_temp_folder)
-            processing_queue.update_task(task_id, status=TaskStatus.CANCELLED)
+            return _task_cancelled(task_id)
+        
+        def finish_cancelled(stage: str) -> bool:
+            logger.info(f"[CANCEL] Task cancelled {stage}: {task_id}")
+            # Остановить аудио-ветку и очистить временные файлы (и недописанный результат)
+            _stop_audio_branch(audio_future, progress, temp_audio_orig, temp_audio_adv)
+            cleanup_temps(processed_temp_folder, str(output_path))
+            processing_queue.update_task(task_id, status=TaskStatus.CANCELLED, metrics=metrics.to_dict())
             return False
         
-        # ──── ШАГ 4: Обработка аудио ──────────────────────────────────────
-        logger.info("[2/3] Audio processing...")
-        processing_queue.update_task(task_id, progress=60.0)
-        
-        try:
-            extract_audio(str(input_path), temp_audio_orig)
+        # Обработка видеокадров (decode → модель → PNG, время каждого шага в timings)
+        timings = {}
+        with metrics.stage("video") as stage:
+            processed_temp_folder, noisy_frames = video_processor.process_video(
+                str(input_path),
+                start_frame=1,
+                end_frame=total_frames,
+                every_n_frames=every_n_frames,
+                video_strength_mult=task.video_strength,
+                should_cancel_fn=should_cancel,
+                timings=timings,
+                progress_fn=progress.frames_callback("video"),
+                resume=task.resumes > 0
+            )
+            stage.update(
+                frames=total_frames,
+                noisy_frames=noisy_frames,
+                bytes_read=path_size(input_path),
+                bytes_written=path_size(processed_temp_folder),
+                **{key: round(value, 3) for key, value in timings.items()}
+            )
+        
+        # ──── ШАГ 5: Ожидание аудио-ветки ─────────────────────────────────
+        # Задача, отменённая во время кадров, аудио-ветку не ждёт
+        cancelled = should_cancel()
+        if not cancelled:
+            logger.info(f"[OK] Processed {noisy_frames} frames")
+            progress.set("video", 1.0, processed_frames=noisy_frames)
             
-            audio_processor = AudioProcessor()
-            if task.audio_level and task.audio_level != "None":
-                logger.info(f"[AUDIO] Masking level: {task.audio_level}")
-                audio_processor.add_imperceptible_audio_noise(
-                    temp_audio_orig, 
-                    temp_audio_adv, 
-                    task.audio_level
-                )
-                final_audio = temp_audio_adv
-            else:
-                logger.info("[AUDIO] Masking disabled (original audio)")
-                final_audio = temp_audio_orig
-        
-        except Exception as e:
-            logger.warning(f"[WARN] Audio processing error: {e}")
-            # Продолжаем без аудио
-            final_audio = temp_audio_orig
-        
-        processing_queue.update_task(task_id, progress=75.0)
+            logger.info("[2/3] Waiting for audio branch...")
+            audio = audio_future.result()
+            cancelled = should_cancel()
         
         # Проверить отмену задачи перед финальной сборкой
-        task = processing_queue.get_task(task_id)
-        if task and task.status == TaskStatus.CANCELLED:
-            logger.info(f"[CANCEL] Task cancelled before assembly: {task_id}")
-            # Очистить временные файлы
-            cleanup_temps([processed_temp_folder], [temp_audio_orig, temp_audio_processed])
-            processing_queue.update_task(task_id, status=TaskStatus.CANCELLED)
-            return False
+        if cancelled:
+            return finish_cancelled("before assembly")
         
-        # ──── ШАГ 5: Сборка финального видео ──────────────────────────────
+        # ──── ШАГ 6: Сборка финального видео ──────────────────────────────
         logger.info("[3/3] Video assembly...")
-        processing_queue.update_task(task_id, progress=85.0)
         
-        assemble_video(processed_temp_folder, final_audio, fps, str(output_path), use_gpu=True)
+        assembly_progress = progress.ffmpeg_callback("assembly")
+        try:
+            with metrics.stage("assembly") as stage:
+                if SERVER_CONFIG["audio_in_memory"]:
+                    assemble_video_streamed(
+                        processed_temp_folder, str(input_path), fps, str(output_path),
+                        audio_level=audio["audio_level"], use_gpu=True, audio_scan=audio["audio_scan"],
+                        progress_fn=assembly_progress, should_cancel_fn=should_cancel
+                    )
+                else:
+                    assemble_video(processed_temp_folder, audio["final_audio"], fps, str(output_path), use_gpu=True,
+                                   progress_fn=assembly_progress, should_cancel_fn=should_cancel)
+                stage.update(
+                    frames=total_frames,
+                    bytes_read=path_size(processed_temp_folder),
+                    bytes_written=path_size(output_path)
+                )
+        except ProcessingCancelled:
+            return finish_cancelled("during assembly")
         
         logger.info(f"[OK] Video assembled: {output_path}")
-        processing_queue.update_task(task_id, progress=95.0)
+        progress.set("assembly", 1.0)
         
-        # ──── ШАГ 6: Очистка временных файлов ─────────────────────────────
+        # ──── ШАГ 7: Очистка временных файлов ─────────────────────────────
         logger.info("[CLEANUP] Clearing temp files...")
         try:
             cleanup_temps(processed_temp_folder, temp_audio_orig, temp_audio_adv)
@@ -177,6 +361,7 @@ def process_video_task(task_id: str) -> bool:
             status=TaskStatus.COMPLETED,
             output_video=output_filename,
             progress=100.0,
+            metrics=metrics.to_dict(),
             completed_at=time.strftime("%Y-%m-%d %H:%M:%S")
         )
         
@@ -187,38 +372,52 @@ def process_video_task(task_id: str) -> bool:
         error_msg = f"{type(e).__name__}: {str(e)}"
         logger.error(f"[ERROR] Processing error {task_id}: {error_msg}")
         
+        # Аудио-ветка не должна писать прогресс в упавшую задачу и оставлять WAV
+        if audio_future is not None:
+            _stop_audio_branch(audio_future, progress, temp_audio_orig, temp_audio_adv)
+        
         # Сохраняем ошибку в задаче
         processing_queue.update_task(
             task_id,
             status=TaskStatus.FAILED,
             error_message=error_msg,
             progress=0,
+            metrics=metrics.to_dict(),
             completed_at=time.strftime("%Y-%m-%d %H:%M:%S")
         )
         
-        # Пытаемся очистить временные файлы
+        # Упавшая в обработчике задача не возобновляется: удаляем кадры и чекпоинт
+        # (папку, которую пишет VideoProcessor.process_video)
         try:
             task = processing_queue.get_task(task_id)
             if task:
-                base = Path(task.input_video).stem
-                temp_folder = TEMP_FOLDER / f"{task_id}_{base}_frames"
-                if temp_folder.exists():
-                    shutil.rmtree(temp_folder)
-        except:
-            pass
+                processing_queue.discard_checkpoint(task)
+        except Exception as e:
+            logger.warning(f"[WARN] Cleanup error: {e}")
         
         return False
 
 
+_workers_started = False
+_workers_lock = threading.Lock()
+
+
 def start_queue_processor(num_workers: int = 1):
     """
-    Запускает фоновые потоки для обработки очереди видео
+    Запускает фоновые потоки для обработки очереди видео.
+    Повторный вызов ничего не делает (run_server.py и lifespan API сервера).
     
     Args:
         num_workers: Количество одновременных обработчиков
     """
+    global _workers_started
+    with _workers_lock:
+        if _workers_started:
+            return
+        _workers_started = True
     
     logger.info(f"[START] Starting {num_workers} queue workers...")
+    processing_queue.worker_count = num_workers
     
     for worker_id in range(num_workers):
         thread = threading.Thread(
@@ -241,28 +440,29 @@ def queue_worker_loop(worker_id: int):
     
     while True:
         try:
-            # Получаем следующую задачу из очереди
-            pending_tasks = processing_queue.get_pending_tasks(limit=1)
+            # Атомарно берём следующую задачу (ждём появления до 5 сек)
+            task = processing_queue.claim_task(timeout=5)
             
-            if pending_tasks:
-                task = pending_tasks[0]
+            if task:
                 logger.info(f"Worker-{worker_id}: обработка задачи {task.task_id}")
                 process_video_task(task.task_id)
             else:
-                # Очередь пуста, ждём
-                time.sleep(5)
+                # Очередь пуста — дописываем на диск отложенные изменения задач
+                processing_queue.flush_progress()
         
         except Exception as e:
             logger.error(f"Worker-{worker_id}: ошибка в основном цикле: {e}")
             time.sleep(10)
 
 
+@track_worker(TaskType.METADATA)
 def process_metadata_task(task_id: str) -> bool:
     """
     Удаляет метаданные из видео
     """
     logger.info(f"[START] Metadata strip task: {task_id}")
     processing_queue.update_task(task_id, status=TaskStatus.PROCESSING)
+    metrics = TaskMetrics()
     
     try:
         task = processing_queue.get_task(task_id)
@@ -278,26 +478,30 @@ def process_metadata_task(task_id: str) -> bool:
             raise FileNotFoundError(f"Input file not found: {input_path}")
         
         logger.info(f"[TASK] Stripping metadata: {input_path}")
-        processing_queue.update_task(task_id, progress=20.0)
+        processing_queue.report_progress(task_id, progress=20.0)
+        
+        # Duration for progress/ETA (copy remux runs far faster than realtime)
+        cap = cv2.VideoCapture(str(input_path))
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        duration = cap.get(cv2.CAP_PROP_FRAME_COUNT) / fps if fps > 0 else None
+        cap.release()
         
         # FFmpeg command to strip metadata
-        import subprocess
         cmd = [
             SERVER_CONFIG["ffmpeg_path"], "-y",
             "-i", str(input_path),
             "-c:v", "copy",  # Copy video without re-encoding
             "-c:a", "copy",  # Copy audio without re-encoding
-            "-map_metadata", "-1",  # Remove all metadata
+        ] + METADATA_STRIP_PARAMS + [  # Remove all metadata (streams, chapters, encoder tags)
             str(output_path)
         ]
         
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
-        if result.returncode != 0:
-            raise RuntimeError(f"FFmpeg error: {result.stderr}")
+        with metrics.stage("remux") as stage:
+            run_ffmpeg(cmd, duration=duration, progress_fn=_ffmpeg_task_progress(task_id, 20.0, 90.0))
+            stage.update(bytes_read=path_size(input_path), bytes_written=path_size(output_path))
         
         logger.info(f"[OK] Metadata stripped: {output_path}")
-        processing_queue.update_task(task_id, progress=90.0)
+        processing_queue.report_progress(task_id, progress=90.0)
         
         # Clean up input
         if input_path.exists():
@@ -311,6 +515,7 @@ def process_metadata_task(task_id: str) -> bool:
             status=TaskStatus.COMPLETED,
             output_video=output_filename,
             progress=100.0,
+            metrics=metrics.to_dict(),
             completed_at=time.strftime("%Y-%m-%d %H:%M:%S")
         )
         
@@ -321,22 +526,22 @@ def process_metadata_task(task_id: str) -> bool:
         processing_queue.update_task(
             task_id,
             status=TaskStatus.FAILED,
-            message=str(e)
+            message=str(e),
+            metrics=metrics.to_dict()
         )
         return False
 
 
+@track_worker(TaskType.COMPRESS)
 def process_compress_task(task_id: str, target_size_mb: int) -> bool:
     """
     Сжимает видео до указанного размера
     """
     logger.info(f"[START] Compress task: {task_id} (target: {target_size_mb}MB)")
     processing_queue.update_task(task_id, status=TaskStatus.PROCESSING)
+    metrics = TaskMetrics()
     
     try:
-        import subprocess
-        import cv2
-        
         task = processing_queue.get_task(task_id)
         if not task:
             raise Exception(f"Task not found: {task_id}")
@@ -357,7 +562,7 @@ def process_compress_task(task_id: str, target_size_mb: int) -> bool:
         cap.release()
         
         logger.info(f"[VIDEO] Source: {total_frames} frames @ {fps}fps, duration: {duration:.1f}s")
-        processing_queue.update_task(task_id, progress=10.0)
+        processing_queue.report_progress(task_id, progress=10.0)
         
         # Get video resolution to preserve it
         cap = cv2.VideoCapture(str(input_path))
@@ -386,7 +591,7 @@ def process_compress_task(task_id: str, target_size_mb: int) -> bool:
             crf = 26  # Acceptable quality for aggressive compression
         
         logger.info(f"[COMPRESS] Original: {original_size_mb:.1f}MB, Target: {target_size_mb}MB (ratio: {size_ratio:.1%}), CRF: {crf}")
-        processing_queue.update_task(task_id, progress=20.0)
+        processing_queue.report_progress(task_id, progress=20.0)
         
         # Use FFmpeg with CRF for high quality encoding
         cmd = [
@@ -401,15 +606,18 @@ def process_compress_task(task_id: str, target_size_mb: int) -> bool:
             str(output_path)
         ]
         
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
-        if result.returncode != 0:
-            raise RuntimeError(f"FFmpeg error: {result.stderr}")
+        with metrics.stage("encode") as stage:
+            run_ffmpeg(cmd, duration=duration, progress_fn=_ffmpeg_task_progress(task_id, 20.0, 90.0))
+            stage.update(
+                frames=total_frames,
+                bytes_read=path_size(input_path),
+                bytes_written=path_size(output_path)
+            )
         
         # Get output file size
         output_size_mb = output_path.stat().st_size / (1024 * 1024)
         logger.info(f"[OK] Compressed: {output_size_mb:.2f}MB (target was {target_size_mb}MB)")
-        processing_queue.update_task(task_id, progress=90.0, output_size_mb=output_size_mb)
+        processing_queue.report_progress(task_id, progress=90.0, output_size_mb=output_size_mb)
         
         # Clean up input
         if input_path.exists():
@@ -424,6 +632,7 @@ def process_compress_task(task_id: str, target_size_mb: int) -> bool:
             output_video=output_filename,
             progress=100.0,
             output_size_mb=output_size_mb,
+            metrics=metrics.to_dict(),
             completed_at=time.strftime("%Y-%m-%d %H:%M:%S")
         )
         
@@ -434,7 +643,8 @@ def process_compress_task(task_id: str, target_size_mb: int) -> bool:
         processing_queue.update_task(
             task_id,
             status=TaskStatus.FAILED,
-            message=str(e)
+            message=str(e),
+            metrics=metrics.to_dict()
         )
         return False
 
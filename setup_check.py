@@ -19,7 +19,6 @@ def check_dependencies():
         'torchvision': 'torchvision',
         'PIL': 'Pillow',
         'numpy': 'numpy',
-        'librosa': 'librosa',
         'soundfile': 'soundfile',
         'tqdm': 'tqdm'
     }
@@ -19,6 +19,8 @@ let state = {
     currentTaskId: null,
     isProcessing: false,
     statusCheckInterval: null,
+    eventSource: null,
+    eventsUnavailable: false,
     pollCount: 0,
     startTime: null,
 };
@@ -82,13 +84,10 @@ const DOM = {
 document.addEventListener('visibilitychange', () => {
     if (document.hidden) {
         // Вкладка скрыта - остановить polling
-        if (state.statusCheckInterval) {
-            clearInterval(state.statusCheckInterval);
-            state.statusCheckInterval = null;
-        }
+        stopStatusPolling();
     } else {
         // Вкладка видима снова - перезапустить polling если есть активная задача
-        if (state.isProcessing && state.currentTaskId && !state.statusCheckInterval) {
+        if (state.isProcessing && state.currentTaskId && !isStatusPollingActive()) {
             startStatusPolling();
         }
     }
@@ -199,10 +198,7 @@ function clearFile() {
     DOM.dropZone.style.display = 'flex';
     
     // Очистить polling если активен
-    if (state.statusCheckInterval) {
-        clearInterval(state.statusCheckInterval);
-        state.statusCheckInterval = null;
-    }
+    stopStatusPolling();
     
     // Очистить состояние задачи
     state.isProcessing = false;
@@ -318,23 +314,25 @@ async function startProcessing() {
     if (!state.selectedFile || state.isProcessing) return;
 
     // Очистить старый интервал polling если существует
-    if (state.statusCheckInterval) {
-        clearInterval(state.statusCheckInterval);
-        state.statusCheckInterval = null;
-    }
+    stopStatusPolling();
 
     state.isProcessing = true;
     updateProcessButtonState();
     clearConsole();
     addConsoleLog('🚀 Начало загрузки видео...', 'info');
 
+    // Параметры — в query string, тело содержит только файл:
+    // веб-сервер передаёт его на API потоком, не разбирая
     const formData = new FormData();
     formData.append('file', state.selectedFile);
-    formData.append('epsilon', DOM.epsilon.value);
-    formData.append('video_strength', DOM.videoStrength.value);
-    formData.append('audio_level', DOM.audioLevel.value);
-    formData.append('every_n_frames', DOM.everyNFrames.value);
-    formData.append('user_id', DOM.userId.value || 'web_user');
+    const params = new URLSearchParams({
+        epsilon: DOM.epsilon.value,
+        video_strength: DOM.videoStrength.value,
+        audio_level: DOM.audioLevel.value,
+        every_n_frames: DOM.everyNFrames.value,
+        user_id: DOM.userId.value || 'web_user',
+        filename: state.selectedFile.name
+    });
 
     try {
         // Показать прогресс загрузки
@@ -392,7 +390,7 @@ async function startProcessing() {
             throw new Error('Ошибка сети при загрузке');
         });
 
-        xhr.open('POST', '/upload');
+        xhr.open('POST', `/upload?${params}`);
         xhr.send(formData);
 
     } catch (error) {
@@ -424,12 +422,64 @@ function showTaskStatus() {
 // СТАТУС ЗАДАЧИ И ОПРОСЫ
 // ═════════════════════════════════════════════════════════════════════════
 
+function isStatusPollingActive() {
+    return Boolean(state.statusCheckInterval || state.eventSource);
+}
+
+function stopStatusPolling() {
+    if (state.statusCheckInterval) {
+        clearInterval(state.statusCheckInterval);
+        state.statusCheckInterval = null;
+    }
+    if (state.eventSource) {
+        state.eventSource.close();
+        state.eventSource = null;
+    }
+}
+
 function startStatusPolling() {
     // Если polling уже активен, не запускаем еще один
-    if (state.statusCheckInterval) {
+    if (isStatusPollingActive()) {
+        return;
+    }
+
+    // Сначала поток событий (SSE) от API сервера через /api, опрос - запасной вариант
+    if (window.EventSource && !state.eventsUnavailable) {
+        startStatusEvents();
         return;
     }
 
+    startIntervalPolling();
+}
+
+function startStatusEvents() {
+    const taskId = state.currentTaskId;
+    const source = new EventSource(`/api/task/${taskId}/events`);
+    state.eventSource = source;
+
+    source.onmessage = (event) => {
+        if (taskId !== state.currentTaskId) {
+            source.close();
+            return;
+        }
+        handleTaskUpdate(JSON.parse(event.data));
+    };
+
+    source.onerror = () => {
+        // Поток закрыт сервером после завершения задачи или недоступен
+        source.close();
+        if (state.eventSource === source) {
+            state.eventSource = null;
+        }
+        if (state.isProcessing && taskId === state.currentTaskId) {
+            console.warn('Поток событий недоступен, переход на опрос');
+            state.eventsUnavailable = true;
+            startIntervalPolling();
+        }
+    };
+}
+
+function startIntervalPolling() {
     // Первая проверка сразу
     checkTaskStatus();
 
@@ -455,28 +505,24 @@ async function checkTaskStatus() {
         }
 
         const data = await response.json();
-        const task = data.task;
-
-        // Обновить статус
-        updateTaskDisplay(task);
-
-        // Если завершено или ошибка, остановить опрос
-        if (['completed', 'failed', 'cancelled'].includes(task.status)) {
-            state.isProcessing = false;
-            if (state.statusCheckInterval) {
-                clearInterval(state.statusCheckInterval);
-                state.statusCheckInterval = null;
-            }
-            updateProcessButtonState();
-        }
+        handleTaskUpdate(data.task);
 
     } catch (error) {
         console.error('Ошибка проверки статуса:', error);
         // При ошибке сети - остановить polling на некоторое время
-        if (state.statusCheckInterval) {
-            clearInterval(state.statusCheckInterval);
-            state.statusCheckInterval = null;
-        }
+        stopStatusPolling();
+    }
+}
+
+function handleTaskUpdate(task) {
+    // Обновить статус
+    updateTaskDisplay(task);
+
+    // Если завершено или ошибка, остановить опрос
+    if (['completed', 'failed', 'cancelled'].includes(task.status)) {
+        state.isProcessing = false;
+        stopStatusPolling();
+        updateProcessButtonState();
     }
 }
 
@@ -633,10 +679,7 @@ async function cancelProcessing() {
 
     try {
         // Сразу остановить polling
-        if (state.statusCheckInterval) {
-            clearInterval(state.statusCheckInterval);
-            state.statusCheckInterval = null;
-        }
+        stopStatusPolling();
         state.isProcessing = false;
         
         const response = await fetch(`/api/cancel/${state.currentTaskId}`, {
@@ -838,10 +881,7 @@ function setupTabHandlers() {
             
             // Остановить polling если переходим не на вкладку processor
             if (tabName !== 'processor') {
-                if (state.statusCheckInterval) {
-                    clearInterval(state.statusCheckInterval);
-                    state.statusCheckInterval = null;
-                }
+                stopStatusPolling();
             } else if (tabName === 'processor' && state.isProcessing && state.currentTaskId) {
                 // Перезапустить polling если возвращаемся на вкладку processor с активной задачей
                 startStatusPolling();
@@ -0,0 +1,129 @@
+"""
+Модель стоимости задачи защиты видео: предсказанное время обработки (сек)
+по параметрам видео (кадры, разрешение), every_n_frames и num_eot.
+    
+    video    = noisy_frames * num_eot * tiles * model + frames * Мпикс * frame_io
+    assembly = frames * Мпикс * assembly
+    итого    = video + assembly + overhead
+
+Коэффициенты стартуют с SERVER_CONFIG["cost_model_priors"] и калибруются
+по метрикам этапов завершённых задач (ProcessingTask.metrics) —
+экспоненциальным сглаживанием, чтобы модель следовала за железом.
+"""
+
+import logging
+import threading
+from typing import Dict, Optional
+
+from server_config import SERVER_CONFIG
+
+logger = logging.getLogger("queue_processor")
+
+TILE_SIZE = 224  # Вход ResNet (тайловый режим режет кадр на тайлы такого размера)
+
+
+def probe_video(path) -> Optional[Dict]:
+    """
+    Параметры видео для модели стоимости (по заголовку, без декодирования).
+    None, если файл не читается как видео.
+    """
+    import cv2
+    
+    cap = cv2.VideoCapture(str(path))
+    try:
+        if not cap.isOpened():
+            return None
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        frames = int(cap.get(cv2.CAP_PROP_FRAME_COUNT))
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+    finally:
+        cap.release()
+    
+    if frames <= 0 or fps <= 0 or width <= 0 or height <= 0:
+        return None
+    return {
+        "frames": frames,
+        "fps": round(fps, 3),
+        "width": width,
+        "height": height,
+        "duration_sec": round(frames / fps, 3),
+    }
+
+
+def job_units(video_info: Dict, every_n_frames: int) -> Dict[str, float]:
+    """Объём работы задачи в единицах коэффициентов модели"""
+    frames = video_info["frames"]
+    megapixels = video_info["width"] * video_info["height"] / 1e6
+    noisy_frames = frames // max(1, int(every_n_frames or 1))
+    tiles = 1
+    if video_info.get("tiled"):
+        tiles = max(1, round(video_info["height"] / TILE_SIZE)) * max(1, round(video_info["width"] / TILE_SIZE))
+    return {
+        "model": noisy_frames * video_info.get("num_eot", 1) * tiles,
+        "frame_io": frames * megapixels,
+        "assembly": frames * megapixels,
+    }
+
+
+class CostModel:
+    """Линейная модель времени задачи с калибровкой по завершённым задачам"""
+    
+    def __init__(self, priors: Optional[Dict[str, float]] = None, alpha: Optional[float] = None):
+        self.lock = threading.Lock()
+        self.coefficients = dict(priors or SERVER_CONFIG["cost_model_priors"])
+        self.alpha = alpha if alpha is not None else SERVER_CONFIG["cost_model_alpha"]
+        self.samples = 0
+    
+    def predict(self, video_info: Optional[Dict], every_n_frames: int) -> Optional[float]:
+        """Предсказанное время обработки (сек) или None без параметров видео"""
+        if not video_info:
+            return None
+        units = job_units(video_info, every_n_frames)
+        with self.lock:
+            seconds = self.coefficients["overhead"] + sum(
+                units[name] * self.coefficients[name] for name in units
+            )
+        return round(seconds, 2)
+    
+    def observe(self, video_info: Optional[Dict], every_n_frames: int, metrics: Optional[Dict]) -> bool:
+        """Калибрует коэффициенты по метрикам этапов завершённой задачи"""
+        if not video_info or not metrics:
+            return False
+        stages = metrics.get("stages", {})
+        video = stages.get("video")
+        assembly = stages.get("assembly")
+        if not video or not assembly:
+            return False
+        
+        units = job_units(video_info, every_n_frames)
+        observed = {
+            "model": video.get("model_sec"),
+            "frame_io": (video.get("decode_sec") or 0.0) + (video.get("write_sec") or 0.0),
+            "assembly": assembly.get("wall_sec"),
+        }
+        # Накладные расходы — всё, что не попало в этапы (пробы, очистка, аудио сверх кадров)
+        total = metrics.get("wall_sec")
+        if total is not None:
+            observed["overhead"] = max(0.0, total - video.get("wall_sec", 0.0) - assembly.get("wall_sec", 0.0))
+        
+        with self.lock:
+            for name, actual in observed.items():
+                if actual is None:
+                    continue
+                if name == "overhead":
+                    rate = actual
+                elif units[name] > 0:
+                    rate = actual / units[name]
+                else:
+                    continue
+                self.coefficients[name] += self.alpha * (rate - self.coefficients[name])
+            self.samples += 1
+        return True
+    
+    def to_dict(self) -> Dict:
+        with self.lock:
+            return {
+                "samples": self.samples,
+                "coefficients": {name: round(value, 6) for name, value in self.coefficients.items()},
+            }
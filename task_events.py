@@ -0,0 +1,107 @@
+"""
+Рассылка обновлений задач подписчикам (SSE /task/{id}/events и WebSocket /ws/tasks)
+
+Очередь вызывает publish() из потоков воркеров; снимок задачи передаётся
+в event loop подписчика через call_soon_threadsafe. У подписчика хранится
+только последний снимок каждой задачи, поэтому медленный клиент получает
+свежее состояние, а не очередь устаревших обновлений.
+"""
+
+import asyncio
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+
+class TaskSubscription:
+    """Подписка на обновления набора задач (живёт в одном event loop)"""
+    
+    def __init__(self, hub: "TaskEventHub", loop: asyncio.AbstractEventLoop):
+        self.hub = hub
+        self.loop = loop
+        self.task_ids: Set[str] = set()
+        self.pending: Dict[str, Dict] = {}
+        self.event = asyncio.Event()
+    
+    def _push(self, snapshot: Dict) -> None:
+        """Вызывается в event loop подписчика"""
+        if snapshot["task_id"] in self.task_ids:
+            self.pending[snapshot["task_id"]] = snapshot
+            self.event.set()
+    
+    def watch(self, task_ids: Iterable[str]) -> None:
+        self.hub._watch(self, task_ids)
+    
+    def unwatch(self, task_ids: Iterable[str]) -> None:
+        self.hub._unwatch(self, task_ids)
+        for task_id in task_ids:
+            self.pending.pop(task_id, None)
+    
+    async def get(self, timeout: Optional[float] = None) -> List[Dict]:
+        """
+        Ждёт обновлений; возвращает последние снимки изменившихся задач
+        или пустой список по таймауту.
+        """
+        if not self.pending:
+            try:
+                await asyncio.wait_for(self.event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        self.event.clear()
+        updates = list(self.pending.values())
+        self.pending.clear()
+        return updates
+    
+    def close(self) -> None:
+        self.hub._unwatch(self, list(self.task_ids))
+
+
+class TaskEventHub:
+    """Подписчики по task_id; publish() безопасен для вызова из любого потока"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_task: Dict[str, Set[TaskSubscription]] = {}
+    
+    def subscribe(self, task_ids: Iterable[str] = ()) -> TaskSubscription:
+        """Создаёт подписку в текущем event loop"""
+        subscription = TaskSubscription(self, asyncio.get_running_loop())
+        subscription.watch(task_ids)
+        return subscription
+    
+    def _watch(self, subscription: TaskSubscription, task_ids: Iterable[str]) -> None:
+        with self.lock:
+            for task_id in task_ids:
+                subscription.task_ids.add(task_id)
+                self.by_task.setdefault(task_id, set()).add(subscription)
+    
+    def _unwatch(self, subscription: TaskSubscription, task_ids: Iterable[str]) -> None:
+        with self.lock:
+            for task_id in task_ids:
+                subscription.task_ids.discard(task_id)
+                subscribers = self.by_task.get(task_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self.by_task[task_id]
+    
+    def publish(self, task) -> None:
+        """Слушатель очереди: рассылает снимок задачи её подписчикам"""
+        with self.lock:
+            subscribers = list(self.by_task.get(task.task_id, ()))
+        if not subscribers:
+            return
+        
+        snapshot = task.to_public_dict()
+        for subscription in subscribers:
+            try:
+                subscription.loop.call_soon_threadsafe(subscription._push, snapshot)
+            except RuntimeError:
+                # Event loop подписчика уже закрыт
+                subscription.close()
+
+
+# Глобальный хаб событий сервера
+task_events = TaskEventHub()
@@ -0,0 +1,252 @@
+"""
+Метрики выполнения задач: время по этапам, пропускная способность,
+объём прочитанных/записанных данных и пиковая память.
+
+Задачи идут параллельно в одном процессе, поэтому процессные счётчики
+(os.times, ru_maxrss) для них не годятся: CPU этапа — время потока,
+выполнявшего этап (time.thread_time), а память — RSS процесса, который
+фоновый сэмплер снимает только пока задача выполняется.
+
+Метрики сохраняются в ProcessingTask.metrics и агрегируются по завершённым
+задачам для планирования мощностей.
+"""
+
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Optional
+from weakref import WeakSet
+
+try:
+    import resource
+except ImportError:  # Windows: ru_maxrss недоступен
+    resource = None
+
+
+RSS_SAMPLE_INTERVAL_SEC = 0.25  # Период сэмплирования RSS для задач
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Пиковый RSS процесса за всё время работы (МБ) — для бенчмарков, не для задач"""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдаёт килобайты, macOS — байты
+    divisor = 1024 * 1024 if sys.platform == "darwin" else 1024
+    return round(maxrss / divisor, 1)
+
+
+def current_rss_mb() -> Optional[float]:
+    """Текущий RSS процесса (МБ); None, если /proc недоступен (не Linux)"""
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+
+
+class _RssSampler:
+    """Один фоновый поток на процесс: обновляет пик RSS у выполняющихся задач"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: "WeakSet[TaskMetrics]" = WeakSet()
+        self.thread: Optional[threading.Thread] = None
+    
+    def register(self, metrics: "TaskMetrics") -> None:
+        with self.lock:
+            self.metrics.add(metrics)
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True, name="RssSampler")
+                self.thread.start()
+    
+    def unregister(self, metrics: "TaskMetrics") -> None:
+        with self.lock:
+            self.metrics.discard(metrics)
+    
+    def _run(self) -> None:
+        while True:
+            time.sleep(RSS_SAMPLE_INTERVAL_SEC)
+            rss = current_rss_mb()
+            if rss is None:
+                continue
+            with self.lock:
+                running = list(self.metrics)
+            for metrics in running:
+                metrics.observe_rss(rss)
+
+
+_rss_sampler = _RssSampler()
+
+
+def path_size(path) -> int:
+    """Размер файла или суммарный размер файлов папки (без рекурсии), 0 если нет"""
+    path = Path(path)
+    try:
+        if path.is_dir():
+            return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+class TaskMetrics:
+    """
+    Метрики одной задачи.
+    Этапы могут выполняться в разных потоках (аудио-ветка параллельно с кадрами).
+    cpu_sec этапа — CPU потока, выполнявшего этап: другие задачи в него не
+    попадают, но не попадают и потоки intra-op пула torch и процессы ffmpeg.
+    peak_rss_mb — пик RSS процесса за время задачи (память параллельных задач
+    одного процесса не разделить), rss_growth_mb — прирост относительно старта задачи.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.stages: Dict[str, Dict] = {}
+        self.rss_start = current_rss_mb()
+        self.rss_peak = self.rss_start
+        self.finished = False
+        if self.rss_start is not None:
+            _rss_sampler.register(self)
+    
+    def observe_rss(self, rss: float) -> None:
+        with self.lock:
+            if not self.finished:
+                self.rss_peak = max(self.rss_peak or 0.0, rss)
+    
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Замеряет этап. Внутри блока можно заполнить yielded dict:
+        frames, bytes_read, bytes_written и произвольные дополнительные поля.
+        """
+        record = {"frames": 0, "bytes_read": 0, "bytes_written": 0}
+        wall_start = time.perf_counter()
+        cpu_start = time.thread_time()
+        try:
+            yield record
+        finally:
+            self.record(
+                name,
+                wall_sec=time.perf_counter() - wall_start,
+                cpu_sec=time.thread_time() - cpu_start,
+                **record
+            )
+    
+    def record(self, name: str, wall_sec: float, cpu_sec: Optional[float] = None,
+               frames: int = 0, bytes_read: int = 0, bytes_written: int = 0, **extra) -> None:
+        """Добавляет замер этапа (повторные замеры этапа суммируются)"""
+        with self.lock:
+            stage = self.stages.setdefault(name, {
+                "wall_sec": 0.0, "cpu_sec": 0.0,
+                "frames": 0, "bytes_read": 0, "bytes_written": 0,
+            })
+            stage["wall_sec"] += wall_sec
+            stage["cpu_sec"] += cpu_sec or 0.0
+            stage["frames"] += frames
+            stage["bytes_read"] += bytes_read
+            stage["bytes_written"] += bytes_written
+            stage.update(extra)
+    
+    def to_dict(self) -> Dict:
+        """
+        Метрики для сохранения в задаче (JSON). Вызывается по завершении
+        задачи: сэмплирование памяти для неё прекращается.
+        """
+        rss = current_rss_mb()
+        if rss is not None:
+            self.observe_rss(rss)
+        with self.lock:
+            self.finished = True
+        _rss_sampler.unregister(self)
+        
+        with self.lock:
+            stages = {}
+            for name, stage in self.stages.items():
+                item = dict(stage)
+                item["wall_sec"] = round(stage["wall_sec"], 3)
+                item["cpu_sec"] = round(stage["cpu_sec"], 3)
+                item["fps"] = (
+                    round(stage["frames"] / stage["wall_sec"], 2)
+                    if stage["frames"] and stage["wall_sec"] > 0 else None
+                )
+                stages[name] = item
+        
+        return {
+            "stages": stages,
+            "wall_sec": round(time.perf_counter() - self.started, 3),
+            "peak_rss_mb": round(self.rss_peak, 1) if self.rss_peak is not None else None,
+            "rss_growth_mb": (
+                round(self.rss_peak - self.rss_start, 1) if self.rss_start is not None else None
+            ),
+        }
+
+
+class MetricsAggregate:
+    """
+    Инкрементальная сводка по метрикам задач: суммарное и среднее время этапов,
+    пропускная способность (кадров/сек по суммарному времени), объём данных.
+    Задачи добавляются/удаляются по одной, сводка не требует обхода задач.
+    """
+    
+    SUMMED = ("wall_sec", "cpu_sec", "frames", "bytes_read", "bytes_written")
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tasks = 0
+        self.wall_total = 0.0
+        self.peak_rss = None
+        self.stages: Dict[str, Dict] = {}
+    
+    def _apply(self, item: Optional[Dict], sign: int) -> None:
+        if not item:
+            return
+        with self.lock:
+            self.tasks += sign
+            self.wall_total += sign * item.get("wall_sec", 0.0)
+            if sign > 0 and item.get("peak_rss_mb") is not None:
+                # Пик — максимум за всё время, при удалении задач не уменьшается
+                self.peak_rss = max(self.peak_rss or 0.0, item["peak_rss_mb"])
+            
+            for name, stage in item.get("stages", {}).items():
+                total = self.stages.setdefault(name, dict.fromkeys(("count",) + self.SUMMED, 0))
+                total["count"] += sign
+                for key in self.SUMMED:
+                    total[key] += sign * (stage.get(key) or 0)
+                if total["count"] <= 0:
+                    del self.stages[name]
+    
+    def add(self, item: Optional[Dict]) -> None:
+        """Учитывает метрики задачи (TaskMetrics.to_dict)"""
+        self._apply(item, 1)
+    
+    def remove(self, item: Optional[Dict]) -> None:
+        """Исключает ранее учтённые метрики задачи"""
+        self._apply(item, -1)
+    
+    def to_dict(self) -> Dict:
+        with self.lock:
+            stages = {}
+            for name, total in self.stages.items():
+                item = dict(total)
+                item["wall_sec_avg"] = round(total["wall_sec"] / total["count"], 3)
+                item["fps"] = (
+                    round(total["frames"] / total["wall_sec"], 2)
+                    if total["frames"] and total["wall_sec"] > 0 else None
+                )
+                item["wall_sec"] = round(total["wall_sec"], 3)
+                item["cpu_sec"] = round(total["cpu_sec"], 3)
+                stages[name] = item
+            
+            return {
+                "tasks": self.tasks,
+                "wall_sec_total": round(self.wall_total, 3),
+                "wall_sec_avg": round(self.wall_total / self.tasks, 3) if self.tasks else None,
+                "peak_rss_mb_max": self.peak_rss,
+                "stages": stages,
+            }
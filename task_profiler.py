@@ -0,0 +1,207 @@
+"""
+Профилирование отдельных задач на сервере (profile=true в /upload
+или выборка SERVER_CONFIG["profile_sample_rate"]).
+
+Сэмплирующий профайлер раз в profile_interval_ms снимает стеки потоков
+задачи (sys._current_frames) — накладные расходы не зависят от числа
+вызовов Python-функций. Результат:
+  {task_id}.collapsed — свёрнутые стеки для flamegraph.pl / speedscope;
+  {task_id}.txt       — топ функций по собственному и полному времени;
+  {task_id}.prof      — pstats (только profile_mode="cprofile", поток задачи).
+Файлы лежат в LOGS_FOLDER/profiles, ссылки — в ProcessingTask.profile_files.
+"""
+
+import cProfile
+import functools
+import logging
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, Optional
+
+from server_config import SERVER_CONFIG, PROFILES_FOLDER
+from queue_processor import processing_queue
+
+logger = logging.getLogger("queue_processor")
+
+# Активные профайлеры по task_id (для потоков, присоединяющихся к задаче)
+_active: Dict[str, "TaskProfiler"] = {}
+_active_lock = threading.Lock()
+
+
+def _frame_name(code, cache: Dict) -> str:
+    """Имя кадра стека: модуль.функция (кэш по code object)"""
+    name = cache.get(code)
+    if name is None:
+        module = code.co_filename.rsplit("/", 1)[-1].rsplit("\\", 1)[-1]
+        if module.endswith(".py"):
+            module = module[:-3]
+        name = f"{module}.{getattr(code, 'co_qualname', code.co_name)}"
+        cache[code] = name
+    return name
+
+
+class StackSampler:
+    """Сэмплирует стеки выбранных потоков в фоновом потоке"""
+    
+    def __init__(self, interval_sec: float):
+        self.interval_sec = interval_sec
+        self.threads: Dict[int, str] = {}  # thread id -> корень стека (task / audio ...)
+        self.counts: Counter = Counter()
+        self.samples = 0
+        self.names: Dict = {}
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True, name="StackSampler")
+    
+    def add_thread(self, thread_id: int, label: str) -> None:
+        self.threads[thread_id] = label
+    
+    def remove_thread(self, thread_id: int) -> None:
+        self.threads.pop(thread_id, None)
+    
+    def _run(self) -> None:
+        while not self.stop_event.wait(self.interval_sec):
+            frames = sys._current_frames()
+            for thread_id, label in list(self.threads.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame.f_code, self.names))
+                    frame = frame.f_back
+                stack.append(label)
+                self.counts[";".join(reversed(stack))] += 1
+            self.samples += 1
+            del frames
+    
+    def start(self) -> None:
+        self.thread.start()
+    
+    def stop(self) -> None:
+        self.stop_event.set()
+        self.thread.join()
+    
+    def collapsed(self) -> str:
+        """Формат flamegraph.pl: 'корень;...;лист N' по строке на стек"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+    
+    def summary(self, top: int = 30) -> str:
+        """Топ функций по собственным (лист стека) и полным сэмплам"""
+        self_counts: Counter = Counter()
+        total_counts: Counter = Counter()
+        for stack, count in self.counts.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            self_counts[frames[-1]] += count
+            for name in set(frames):
+                total_counts[name] += count
+        
+        total = sum(self.counts.values()) or 1
+        lines = [f"samples: {total}, interval: {self.interval_sec * 1000:.0f} ms", ""]
+        for title, counts in (("self", self_counts), ("total", total_counts)):
+            lines.append(f"{title:>8} {'%':>6}  function")
+            for name, count in counts.most_common(top):
+                lines.append(f"{count:>8} {count / total * 100:>6.1f}  {name}")
+            lines.append("")
+        return "\n".join(lines)
+
+
+class TaskProfiler:
+    """Профиль одной задачи: сэмплер стеков и, опционально, cProfile потока задачи"""
+    
+    def __init__(self, task_id: str, mode: Optional[str] = None, interval_ms: Optional[float] = None):
+        self.task_id = task_id
+        self.mode = mode or SERVER_CONFIG["profile_mode"]
+        interval_ms = interval_ms or SERVER_CONFIG["profile_interval_ms"]
+        self.sampler = StackSampler(interval_ms / 1000)
+        self.cprofile = cProfile.Profile() if self.mode == "cprofile" else None
+        self.started = 0.0
+    
+    def join_thread(self, label: str) -> None:
+        """Добавляет текущий поток к сэмплированию задачи"""
+        self.sampler.add_thread(threading.get_ident(), label)
+    
+    def leave_thread(self) -> None:
+        self.sampler.remove_thread(threading.get_ident())
+    
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        self.join_thread("task")
+        self.sampler.start()
+        if self.cprofile:
+            self.cprofile.enable()
+    
+    def stop(self) -> None:
+        if self.cprofile:
+            self.cprofile.disable()
+        self.sampler.stop()
+    
+    def save(self) -> Dict[str, str]:
+        """Пишет файлы профиля, возвращает {вид: имя файла в PROFILES_FOLDER}"""
+        PROFILES_FOLDER.mkdir(parents=True, exist_ok=True)
+        files = {
+            "collapsed": f"{self.task_id}.collapsed",
+            "summary": f"{self.task_id}.txt",
+        }
+        (PROFILES_FOLDER / files["collapsed"]).write_text(self.sampler.collapsed(), encoding="utf-8")
+        header = f"task: {self.task_id}\nwall: {time.perf_counter() - self.started:.2f} s\n"
+        (PROFILES_FOLDER / files["summary"]).write_text(header + self.sampler.summary(), encoding="utf-8")
+        if self.cprofile:
+            files["pstats"] = f"{self.task_id}.prof"
+            self.cprofile.dump_stats(str(PROFILES_FOLDER / files["pstats"]))
+        return files
+
+
+def profile_task(func):
+    """
+    Декоратор обработчика задачи (первый аргумент — task_id): профилирует
+    вызов, если у задачи включён profile, и сохраняет ссылки на файлы.
+    """
+    @functools.wraps(func)
+    def wrapper(task_id: str, *args, **kwargs):
+        task = processing_queue.get_task(task_id)
+        if not task or not task.profile:
+            return func(task_id, *args, **kwargs)
+        
+        profiler = TaskProfiler(task_id)
+        with _active_lock:
+            _active[task_id] = profiler
+        profiler.start()
+        try:
+            return func(task_id, *args, **kwargs)
+        finally:
+            profiler.stop()
+            with _active_lock:
+                _active.pop(task_id, None)
+            try:
+                files = profiler.save()
+                processing_queue.update_task(task_id, profile_files=files)
+                logger.info(f"[PROFILE] {task_id}: {profiler.sampler.samples} samples -> {PROFILES_FOLDER}")
+            except Exception as e:
+                logger.warning(f"[WARN] Failed to save profile {task_id}: {e}")
+    return wrapper
+
+
+def profile_thread(label: str):
+    """
+    Декоратор для функций, выполняющихся в других потоках от имени задачи
+    (первый аргумент — task_id): их стеки попадают в профиль задачи под корнем label.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(task_id: str, *args, **kwargs):
+            with _active_lock:
+                profiler = _active.get(task_id)
+            if profiler is None:
+                return func(task_id, *args, **kwargs)
+            profiler.join_thread(label)
+            try:
+                return func(task_id, *args, **kwargs)
+            finally:
+                profiler.leave_thread()
+        return wrapper
+    return decorator
+
@@ -0,0 +1,252 @@
+"""
+Выбор следующей задачи защиты: классы приоритета и честная доля
+пользователей (deficit round robin).
+
+Два уровня DRR: между классами приоритета (SERVER_CONFIG["priority_classes"]:
+класс -> вес) и внутри класса — между пользователями (SERVER_CONFIG["user_weights"],
+по умолчанию вес 1). В свой ход поток получает квант drr_quantum_sec * вес
+и тратит его на предсказанное время задач (predicted_sec), поэтому доля
+считается в секундах обработки, а не в штуках: пользователь с 200 роликами
+не блокирует остальных, а любой непустой поток обслуживается хотя бы раз
+за круг — голодания нет ни у пользователей, ни у низкого класса.
+
+Задачи одного пользователя упорядочены по predicted_sec с поправкой на
+ожидание (queue_aging_factor): короткие первыми, длинные не застревают.
+Выбор — O(потоков за ход + log задач пользователя) вместо сортировки
+всех ожидающих задач.
+"""
+
+import heapq
+import math
+from collections import deque
+from datetime import datetime
+from typing import Callable, Deque, Dict, Hashable, List, Optional, Tuple
+
+from server_config import SERVER_CONFIG
+
+
+def task_cost(task) -> float:
+    """Стоимость задачи для DRR (сек); без предсказания — один квант"""
+    if task.predicted_sec is None:
+        return float(SERVER_CONFIG["drr_quantum_sec"])
+    return task.predicted_sec
+
+
+class TaskHeap:
+    """Задачи одного пользователя: куча с ленивым удалением"""
+    
+    def __init__(self):
+        self.heap: List[Tuple[float, str, str]] = []
+        self.tasks: Dict[str, object] = {}  # task_id -> задача (живые элементы кучи)
+    
+    def __len__(self) -> int:
+        return len(self.tasks)
+    
+    @staticmethod
+    def key(task) -> Tuple[float, str, str]:
+        # predicted - aging * (now - created): сдвиг на now у всех задач одинаков,
+        # поэтому порядок задаёт постоянный ключ predicted + aging * created
+        try:
+            created = datetime.fromisoformat(task.created_at).timestamp()
+        except ValueError:
+            created = 0.0
+        score = task_cost(task) + SERVER_CONFIG["queue_aging_factor"] * created
+        return (score, task.created_at, task.task_id)
+    
+    def push(self, task) -> None:
+        self.tasks[task.task_id] = task
+        heapq.heappush(self.heap, self.key(task))
+    
+    def remove(self, task) -> bool:
+        if self.tasks.pop(task.task_id, None) is None:
+            return False
+        if len(self.heap) > 2 * len(self.tasks) + 64:
+            # Слишком много удалённых элементов — перестраиваем кучу
+            self.heap = [entry for entry in self.heap if entry[-1] in self.tasks]
+            heapq.heapify(self.heap)
+        return True
+    
+    def peek(self):
+        while self.heap:
+            task = self.tasks.get(self.heap[0][-1])
+            if task is not None:
+                return task
+            heapq.heappop(self.heap)
+        return None
+    
+    def pop(self):
+        task = self.peek()
+        if task is not None:
+            heapq.heappop(self.heap)
+            del self.tasks[task.task_id]
+        return task
+    
+    def clone(self) -> "TaskHeap":
+        copy = TaskHeap()
+        copy.heap = list(self.heap)
+        copy.tasks = dict(self.tasks)
+        return copy
+
+
+class DeficitRoundRobin:
+    """
+    Deficit round robin над потоками (TaskHeap или вложенные DeficitRoundRobin).
+    
+    Args:
+        route: задача -> ключ потока
+        weight: ключ потока -> вес (доля кванта)
+        make: ключ потока -> новый пустой поток
+    """
+    
+    def __init__(self, route: Callable[[object], Hashable], weight: Callable[[Hashable], float],
+                 make: Callable[[Hashable], object]):
+        self.route = route
+        self.weight = weight
+        self.make = make
+        self.flows: Dict[Hashable, object] = {}
+        self.deficit: Dict[Hashable, float] = {}
+        self.active: Deque[Hashable] = deque()  # Круг потоков, первый — текущий
+        self.granted = False                    # Текущий поток уже получил квант за этот ход
+        self.size = 0
+    
+    def __len__(self) -> int:
+        return self.size
+    
+    def push(self, task) -> None:
+        key = self.route(task)
+        flow = self.flows.get(key)
+        if flow is None:
+            flow = self.flows[key] = self.make(key)
+            self.deficit[key] = 0.0
+            self.active.append(key)
+        flow.push(task)
+        self.size += 1
+    
+    def remove(self, task) -> bool:
+        """Убирает задачу без списания дефицита (отмена, смена статуса)"""
+        flow = self.flows.get(self.route(task))
+        if flow is None or not flow.remove(task):
+            return False
+        self.size -= 1
+        return True
+    
+    def _drop_current(self) -> None:
+        key = self.active.popleft()
+        del self.flows[key]
+        del self.deficit[key]
+        self.granted = False
+    
+    def _select(self) -> Optional[Tuple[int, int]]:
+        """
+        Следующий поток без изменения состояния: (позиция в круге, число
+        пропущенных кругов). Круги, в которых ни одному потоку не хватает
+        дефицита, не прокручиваются по одному: поток на k-м круге имеет
+        deficit + (k + 1) * квант (текущий, уже получивший квант, — на один меньше),
+        поэтому для каждого потока k считается сразу. Пустые потоки и потоки
+        с нулевым весом пропускаются; None — выбрать нечего.
+        """
+        quantum = SERVER_CONFIG["drr_quantum_sec"]
+        best = None
+        for position, key in enumerate(self.active):
+            head = self.flows[key].peek()
+            if head is None:
+                continue
+            owed = task_cost(head) - self.deficit[key]
+            granted = 1 if position == 0 and self.granted else 0
+            grant = quantum * self.weight(key)
+            if owed <= 0:
+                rounds = 0
+            elif grant > 0:
+                rounds = max(0, math.ceil(owed / grant - 1e-9) - 1 + granted)
+            else:
+                continue
+            if best is None or rounds < best[1]:
+                best = (position, rounds)
+        return best
+    
+    def _commit(self, position: int, rounds: int) -> None:
+        """Выдаёт кванты за пропущенные круги и делает выбранный поток текущим"""
+        quantum = SERVER_CONFIG["drr_quantum_sec"]
+        for i, key in enumerate(self.active):
+            visits = rounds + (1 if i <= position else 0) - (1 if i == 0 and self.granted else 0)
+            if visits > 0:
+                self.deficit[key] += visits * quantum * self.weight(key)
+        self.active.rotate(-position)
+        self.granted = True
+        # Опустевшие потоки (задачи удалены) выходят из круга, дефицит сгорает
+        for key in [key for key in self.active if not len(self.flows[key])]:
+            self.active.remove(key)
+            del self.flows[key]
+            del self.deficit[key]
+    
+    def peek(self):
+        """Задача, которую вернёт pop (состояние не меняется)"""
+        selected = self._select()
+        if selected is None:
+            return None
+        return self.flows[self.active[selected[0]]].peek()
+    
+    def pop(self):
+        """Следующая задача по DRR (списывает её стоимость с дефицита потока)"""
+        selected = self._select()
+        if selected is None:
+            return None
+        self._commit(*selected)
+        key = self.active[0]
+        flow = self.flows[key]
+        task = flow.pop()
+        self.deficit[key] -= task_cost(task)
+        self.size -= 1
+        if not len(flow):
+            self._drop_current()
+        return task
+    
+    def clone(self) -> "DeficitRoundRobin":
+        copy = DeficitRoundRobin(self.route, self.weight, self.make)
+        copy.flows = {key: flow.clone() for key, flow in self.flows.items()}
+        copy.deficit = dict(self.deficit)
+        copy.active = deque(self.active)
+        copy.granted = self.granted
+        copy.size = self.size
+        return copy
+    
+    def order(self, limit: Optional[int] = None) -> list:
+        """Задачи в порядке будущего выбора (состояние не меняется)"""
+        copy = self.clone()
+        tasks = []
+        while limit is None or len(tasks) < limit:
+            task = copy.pop()
+            if task is None:
+                break
+            tasks.append(task)
+        return tasks
+    
+    def summary(self) -> Dict:
+        """Ожидающие задачи по потокам: {ключ: {pending, deficit[, flows]}}"""
+        result = {}
+        for key in self.active:
+            flow = self.flows[key]
+            result[key] = {"pending": len(flow), "deficit_sec": round(self.deficit[key], 1)}
+            if isinstance(flow, DeficitRoundRobin):
+                result[key]["flows"] = len(flow.flows)
+        return result
+
+
+def task_priority(task) -> str:
+    """Класс приоритета задачи (неизвестный или пустой — класс по умолчанию)"""
+    if task.priority in SERVER_CONFIG["priority_classes"]:
+        return task.priority
+    return SERVER_CONFIG["default_priority"]
+
+
+def make_scheduler() -> DeficitRoundRobin:
+    """Планировщик очереди: DRR по классам приоритета, внутри класса — по пользователям"""
+    return DeficitRoundRobin(
+        route=task_priority,
+        weight=lambda priority: SERVER_CONFIG["priority_classes"].get(priority, 1),
+        make=lambda priority: DeficitRoundRobin(
+            route=lambda task: task.user_id,
+            weight=lambda user_id: SERVER_CONFIG["user_weights"].get(user_id, 1),
+            make=lambda user_id: TaskHeap(),
+        ),
+    )
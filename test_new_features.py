@@ -28,13 +28,6 @@ except ImportError as e:
     print(f"   ✗ Ошибка импорта cv2: {e}")
     sys.exit(1)
 
-try:
-    import librosa
-    print("   ✓ librosa загружена успешно")
-except ImportError as e:
-    print(f"   ✗ Ошибка импорта librosa: {e}")
-    sys.exit(1)
-
 # Test 2: Проверка GPU/CPU
 print("\n2️⃣  Проверка GPU/CPU...")
 cuda_available = torch.cuda.is_available()
@@ -0,0 +1,12 @@
+"""
+Общая настройка тестов: корень репозитория в sys.path и отдельная база
+очереди (processing_queue загружает её при импорте queue_processor)
+"""
+
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+os.environ.setdefault("QUEUE_DB_FOLDER", tempfile.mkdtemp(prefix="mc_tests_"))
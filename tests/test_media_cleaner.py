@@ -0,0 +1,111 @@
+"""Тесты media_cleaner: сетка тайлов, RMS огибающей аудио, чекпоинт кадров"""
+
+import numpy as np
+import pytest
+import torch
+
+import media_cleaner
+from media_cleaner import AudioProcessor, VideoProcessor
+
+
+@pytest.fixture
+def processor(monkeypatch):
+    # Сетке тайлов модель не нужна — заглушка вместо ResNet18
+    monkeypatch.setattr(media_cleaner, "_model", torch.nn.Identity())
+    return VideoProcessor(tiled=True, tile_size=224)
+
+
+# ──── СЕТКА ТАЙЛОВ ───────────────────────────────────────────────────────────
+
+@pytest.mark.parametrize("h, w", [(1080, 1920), (720, 1280), (360, 640), (223, 225), (1, 1), (100, 3000)])
+def test_tile_grid_covers_frame_once(processor, h, w):
+    coverage = np.zeros((h, w), dtype=int)
+    for y0, y1, x0, x1 in processor.tile_grid(h, w):
+        assert 0 <= y0 < y1 <= h and 0 <= x0 < x1 <= w
+        coverage[y0:y1, x0:x1] += 1
+    assert (coverage == 1).all()
+
+
+def test_tile_grid_tile_size(processor):
+    tiles = processor.tile_grid(1080, 1920)
+    assert len(tiles) == 5 * 9
+    for y0, y1, x0, x1 in tiles:
+        assert 0.75 * 224 <= y1 - y0 <= 1.5 * 224
+        assert 0.75 * 224 <= x1 - x0 <= 1.5 * 224
+
+
+def test_tile_grid_small_frame_is_one_tile(processor):
+    assert processor.tile_grid(100, 150) == [(0, 100, 0, 150)]
+
+
+# ──── RMS ОГИБАЮЩЕЙ АУДИО ────────────────────────────────────────────────────
+
+def reference_rms(y: np.ndarray, frame_length: int, hop: int) -> np.ndarray:
+    """RMS по кадрам сигнала, дополненного нулями (как librosa.feature.rms, center=True)"""
+    padded = np.pad(y.astype(np.float64), frame_length // 2)
+    n_frames = 1 + len(y) // hop
+    return np.array([
+        np.sqrt(np.mean(np.square(padded[k * hop:k * hop + frame_length])))
+        for k in range(n_frames)
+    ])
+
+
+def streamed_rms(audio: np.ndarray, block_size: int, frame_length: int, hop: int) -> np.ndarray:
+    blocks = (audio[start:start + block_size] for start in range(0, len(audio), block_size))
+    energies, n_samples = AudioProcessor._segment_energies(blocks, hop)
+    assert n_samples == len(audio)
+    return AudioProcessor._rms_from_energies(energies, n_samples, frame_length, hop)
+
+
+@pytest.mark.parametrize("n_samples", [48000 * 2 + 123, 4096, 511, 1])
+def test_rms_matches_reference(n_samples):
+    rng = np.random.default_rng(0)
+    audio = (rng.standard_normal((n_samples, 2)) * 0.1).astype(np.float32)
+    expected = reference_rms(audio.mean(axis=1), 2048, 512)
+    rms = streamed_rms(audio, 512 * 16, 2048, 512)
+    assert rms.shape == expected.shape
+    np.testing.assert_allclose(rms, expected, rtol=1e-4, atol=1e-7)
+
+
+def test_rms_independent_of_block_size():
+    rng = np.random.default_rng(1)
+    audio = rng.uniform(-1, 1, (44100, 1)).astype(np.float32)
+    single = streamed_rms(audio, len(audio), 2048, 512)
+    for block_size in (512, 512 * 3, 512 * 64):
+        np.testing.assert_allclose(streamed_rms(audio, block_size, 2048, 512), single, rtol=1e-5)
+
+
+# ──── ЧЕКПОИНТ КАДРОВ ────────────────────────────────────────────────────────
+
+PARAMS = {
+    "input_size": 123456, "total_frames": 250, "size": [1280, 720],
+    "start_frame": 0, "end_frame": 250, "every_n_frames": 10,
+    "video_strength_mult": 1.0, "epsilon": 0.12, "num_eot": 4, "tiled": False,
+}
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    VideoProcessor._save_checkpoint(path, PARAMS, 120, 12)
+    
+    assert VideoProcessor._load_checkpoint(path, dict(PARAMS)) == {
+        "params": PARAMS, "frame_idx": 120, "noisy_frames": 12
+    }
+    assert list(tmp_path.iterdir()) == [path]  # Временный файл заменён атомарно
+
+
+@pytest.mark.parametrize("change", [
+    {"input_size": 654321}, {"size": [720, 1280]}, {"every_n_frames": 5},
+    {"epsilon": 0.2}, {"tiled": True}, {"end_frame": 200},
+])
+def test_checkpoint_with_other_params_is_ignored(tmp_path, change):
+    path = tmp_path / "checkpoint.json"
+    VideoProcessor._save_checkpoint(path, PARAMS, 120, 12)
+    assert VideoProcessor._load_checkpoint(path, {**PARAMS, **change}) is None
+
+
+def test_missing_or_broken_checkpoint_is_ignored(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    assert VideoProcessor._load_checkpoint(path, PARAMS) is None
+    path.write_text('{"params": {', encoding="utf-8")
+    assert VideoProcessor._load_checkpoint(path, PARAMS) is None
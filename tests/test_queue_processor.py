@@ -0,0 +1,200 @@
+"""Тесты queue_processor: индексы задач, постраничная выборка, возобновление задач, допуск по загрузке"""
+
+import json
+import random
+import threading
+from collections import Counter
+
+import pytest
+
+import queue_processor
+from queue_processor import ProcessingTask, TaskIndex, VideoProcessingQueue
+from server_config import SERVER_CONFIG, TaskStatus, TaskType
+
+STATUSES = [TaskStatus.PENDING, TaskStatus.PROCESSING, TaskStatus.COMPLETED,
+            TaskStatus.FAILED, TaskStatus.CANCELLED]
+
+
+def make_task(i: int, status: str = TaskStatus.COMPLETED, user_id=None, **fields) -> ProcessingTask:
+    return ProcessingTask(
+        task_id=f"t{i:04d}", input_video=f"v{i}.mp4", status=status,
+        created_at=f"2026-01-01T00:00:00.{i:06d}", user_id=user_id, **fields
+    )
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = VideoProcessingQueue()
+    queue.reset(tasks_db=tmp_path / "tasks.json")
+    return queue
+
+
+# ──── ИНДЕКСЫ ────────────────────────────────────────────────────────────────
+
+def test_task_index_order():
+    index = TaskIndex()
+    tasks = [make_task(i) for i in range(10)]
+    for task in random.Random(0).sample(tasks, len(tasks)):
+        index.add(task)
+    index.remove(tasks[3])
+    index.remove(make_task(99))  # Нет в индексе — без ошибки
+    
+    expected = [task.task_id for task in tasks if task is not tasks[3]]
+    assert len(index) == 9
+    assert list(index.ids()) == expected
+    assert list(index.ids_desc()) == expected[::-1]
+    assert list(index.ids_desc(before=TaskIndex.key(tasks[5]))) == ["t0004", "t0002", "t0001", "t0000"]
+
+
+def test_indexes_follow_status_changes(queue):
+    rng = random.Random(1)
+    queue.reset(
+        make_task(i, status=rng.choice(STATUSES), user_id=rng.choice(["a", "b", None]))
+        for i in range(40)
+    )
+    
+    for _ in range(100):
+        task_id = rng.choice(list(queue.tasks))
+        queue.update_task(task_id, status=rng.choice(STATUSES))
+        
+        tasks = sorted(queue.tasks.values(), key=TaskIndex.key)
+        counts = Counter(task.status for task in tasks)
+        stats = queue.get_statistics()
+        assert stats["total"] == len(tasks)
+        for status in STATUSES:
+            assert stats[status] == counts[status]
+            assert [task.task_id for task in queue.get_all_tasks(status)] == \
+                [task.task_id for task in tasks if task.status == status]
+        for user_id in ("a", "b"):
+            assert [task.task_id for task in queue.get_user_tasks(user_id)] == \
+                [task.task_id for task in tasks if task.user_id == user_id]
+
+
+def test_reset_rebuilds_indexes(queue):
+    queue.reset([make_task(i, user_id="a") for i in range(5)])
+    queue.reset([make_task(10, status=TaskStatus.FAILED, user_id="b")])
+    
+    assert queue.get_statistics()["total"] == 1
+    assert queue.count_tasks(TaskStatus.COMPLETED) == 0
+    assert queue.get_user_tasks("a") == []
+    assert [task.task_id for task in queue.get_user_tasks("b")] == ["t0010"]
+
+
+# ──── ПОСТРАНИЧНАЯ ВЫБОРКА ───────────────────────────────────────────────────
+
+def walk_pages(queue, limit: int, **filters) -> list:
+    """task_id всех страниц list_tasks_page подряд, следуя ключу следующей страницы"""
+    ids, after = [], None
+    while True:
+        page, after = queue.list_tasks_page(limit=limit, after=after, **filters)
+        assert len(page) <= limit
+        ids += [task.task_id for task in page]
+        if after is None:
+            return ids
+        assert len(page) == limit
+
+
+@pytest.mark.parametrize("filters", [
+    {}, {"user_id": "a"}, {"status": TaskStatus.FAILED},
+    {"user_id": "b", "status": TaskStatus.COMPLETED}, {"user_id": "nobody"},
+])
+@pytest.mark.parametrize("limit", [1, 7, 50])
+def test_pages_match_full_scan(queue, filters, limit):
+    rng = random.Random(2)
+    queue.reset(
+        make_task(i, status=rng.choice([TaskStatus.COMPLETED, TaskStatus.FAILED]), user_id=rng.choice("ab"))
+        for i in range(30)
+    )
+    expected = [
+        task.task_id for task in sorted(queue.tasks.values(), key=TaskIndex.key, reverse=True)
+        if all(getattr(task, key) == value for key, value in filters.items())
+    ]
+    assert walk_pages(queue, limit, **filters) == expected
+
+
+def test_new_tasks_do_not_shift_pages(queue):
+    queue.reset(make_task(i) for i in range(10))
+    first, after = queue.list_tasks_page(limit=4)
+    queue.reset(list(queue.tasks.values()) + [make_task(i) for i in range(10, 15)])
+    rest, _ = queue.list_tasks_page(limit=50, after=after)
+    
+    assert [task.task_id for task in first] == ["t0009", "t0008", "t0007", "t0006"]
+    assert [task.task_id for task in rest] == [f"t{i:04d}" for i in range(5, -1, -1)]
+
+
+# ──── ВОЗОБНОВЛЕНИЕ ПОСЛЕ ПЕРЕЗАПУСКА ────────────────────────────────────────
+
+def test_stuck_tasks_resume_or_fail_on_load(queue, tmp_path, monkeypatch):
+    monkeypatch.setattr(queue_processor, "INPUT_FOLDER", tmp_path)
+    (tmp_path / "v1.mp4").write_bytes(b"video")
+    (tmp_path / "v2.mp4").write_bytes(b"video")
+    limit = SERVER_CONFIG["max_task_resumes"]
+    tasks = [
+        make_task(1, status=TaskStatus.PROCESSING),                 # Вход на месте — в очередь
+        make_task(2, status=TaskStatus.PROCESSING, resumes=limit),  # Лимит возобновлений исчерпан
+        make_task(3, status=TaskStatus.PROCESSING),                 # Входного файла нет
+    ]
+    queue.tasks_db.write_text(json.dumps({task.task_id: task.to_dict() for task in tasks}), encoding="utf-8")
+    
+    queue.load_tasks()
+    
+    resumed = queue.get_task("t0001")
+    assert (resumed.status, resumed.resumes) == (TaskStatus.PENDING, 1)
+    assert [task.task_id for task in queue.get_pending_tasks(limit=10)] == ["t0001"]
+    for task_id in ("t0002", "t0003"):
+        assert queue.get_task(task_id).status == TaskStatus.FAILED
+    # Результат очистки сохранён в базу
+    saved = json.loads(queue.tasks_db.read_text(encoding="utf-8"))
+    assert saved["t0001"]["status"] == TaskStatus.PENDING
+
+
+# ──── ДОПУСК ПО ЗАГРУЗКЕ ОЧЕРЕДИ ─────────────────────────────────────────────
+
+@pytest.fixture
+def busy_limits(monkeypatch):
+    monkeypatch.setitem(SERVER_CONFIG, "max_backlog_sec", 100)
+    monkeypatch.setitem(SERVER_CONFIG, "busy_retry_after_sec", 5)
+
+
+def test_admit_thresholds(queue, busy_limits):
+    queue.worker_count = 2
+    assert queue.admit(10_000) == (True, 0)  # Пустая очередь принимает любую задачу
+    
+    queue.reset([
+        make_task(1, status=TaskStatus.PENDING, predicted_sec=90),
+        make_task(2, status=TaskStatus.PROCESSING, predicted_sec=60),
+        # Не входят в загрузку: завершённые и задачи других типов
+        make_task(3, status=TaskStatus.COMPLETED, predicted_sec=1000),
+        make_task(4, status=TaskStatus.PENDING, predicted_sec=1000, task_type=TaskType.COMPRESS),
+    ])
+    assert queue.backlog_sec() == 75
+    assert queue.admit(50) == (True, 0)      # (150 + 50) / 2 = 100 — ровно предел
+    assert queue.admit(51) == (False, 5)     # Превышение меньше минимального Retry-After
+    assert queue.admit(100) == (False, 25)   # (150 + 100) / 2 - 100
+    
+    queue.update_task("t0002", status=TaskStatus.COMPLETED)
+    assert queue.backlog_sec() == 45
+    assert queue.admit(100) == (True, 0)
+
+
+def test_admit_and_create_holds_limit_under_concurrency(queue, busy_limits, monkeypatch):
+    queue.worker_count = 1
+    monkeypatch.setattr(queue.cost_model, "predict", lambda video_info, every_n_frames: 30.0)
+    start = threading.Barrier(20)
+    results = []
+    
+    def upload():
+        start.wait()
+        results.append(queue.admit_and_create("v.mp4", user_id="u"))
+    
+    threads = [threading.Thread(target=upload) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    created = [task_id for task_id, _ in results if task_id]
+    assert len(created) == 3  # 3 * 30 <= 100 < 4 * 30
+    assert sorted(queue.tasks) == sorted(created)
+    assert queue.backlog_sec() == 90
+    assert all(retry_after >= 5 for task_id, retry_after in results if task_id is None)
@@ -0,0 +1,56 @@
+"""Тесты server_app: курсор постраничного списка /tasks"""
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import server_app
+from queue_processor import ProcessingTask, processing_queue
+from server_config import TaskStatus
+
+
+@pytest.fixture
+def client(tmp_path):
+    # Без контекстного менеджера lifespan не запускается — воркеров нет
+    processing_queue.reset(tasks_db=tmp_path / "tasks.json")
+    yield TestClient(server_app.app)
+    processing_queue.reset()
+
+
+@pytest.mark.parametrize("key", [
+    ("2026-01-01T00:00:00.000001", "ab12cd34"),
+    ("время|с|разделителем", "id"),
+])
+def test_cursor_round_trip(key):
+    cursor = server_app._encode_cursor(key)
+    assert "=" not in cursor
+    assert server_app._decode_cursor(cursor) == key
+
+
+@pytest.mark.parametrize("cursor", ["!!!", "bm8tc2VwYXJhdG9y", "_w"])
+def test_bad_cursor_is_400(cursor):
+    with pytest.raises(HTTPException) as error:
+        server_app._decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+
+def test_tasks_pages_follow_next_cursor(client):
+    processing_queue.reset(
+        ProcessingTask(task_id=f"t{i:04d}", input_video=f"v{i}.mp4", status=TaskStatus.COMPLETED,
+                       created_at=f"2026-01-01T00:00:00.{i:06d}", user_id="u" if i % 3 else None)
+        for i in range(25)
+    )
+    
+    ids, params = [], {"user_id": "u", "limit": 4, "fields": "task_id,status"}
+    while True:
+        response = client.get("/tasks", params=params)
+        assert response.status_code == 200
+        data = response.json()
+        assert all(set(task) == {"task_id", "status"} for task in data["tasks"])
+        ids += [task["task_id"] for task in data["tasks"]]
+        if not data["next_cursor"]:
+            break
+        params["cursor"] = data["next_cursor"]
+    
+    assert ids == [f"t{i:04d}" for i in range(24, -1, -1) if i % 3]
+    assert client.get("/tasks", params={"cursor": "!!!"}).status_code == 400
@@ -0,0 +1,106 @@
+"""Тесты task_scheduler: доли классов и пользователей, peek/pop/order"""
+
+import random
+from collections import Counter
+from types import SimpleNamespace
+
+import pytest
+
+from server_config import SERVER_CONFIG
+from task_scheduler import make_scheduler
+
+
+@pytest.fixture(autouse=True)
+def scheduler_config(monkeypatch):
+    monkeypatch.setitem(SERVER_CONFIG, "priority_classes", {"interactive": 4, "batch": 1})
+    monkeypatch.setitem(SERVER_CONFIG, "default_priority", "interactive")
+    monkeypatch.setitem(SERVER_CONFIG, "user_weights", {})
+    monkeypatch.setitem(SERVER_CONFIG, "drr_quantum_sec", 5)
+    monkeypatch.setitem(SERVER_CONFIG, "queue_aging_factor", 0.0)
+
+
+def make_task(i: int, user_id: str = "u", priority: str = "interactive", predicted_sec: float = 5.0):
+    return SimpleNamespace(
+        task_id=f"t{i:04d}", created_at=f"2026-01-01T00:00:00.{i:06d}",
+        user_id=user_id, priority=priority, predicted_sec=predicted_sec,
+    )
+
+
+def fill(scheduler, tasks) -> list:
+    for task in tasks:
+        scheduler.push(task)
+    return tasks
+
+
+# ──── ДОЛИ ───────────────────────────────────────────────────────────────────
+
+@pytest.mark.parametrize("interactive_sec, batch_sec", [(5.0, 5.0), (12.0, 3.0), (2.0, 20.0)])
+def test_class_weights_share_processing_time(interactive_sec, batch_sec):
+    scheduler = make_scheduler()
+    fill(scheduler, [make_task(i, predicted_sec=interactive_sec) for i in range(2000)])
+    fill(scheduler, [make_task(10000 + i, priority="batch", predicted_sec=batch_sec) for i in range(2000)])
+    
+    # Доля — в секундах обработки за много кругов (100 кругов по 25 с)
+    seconds = Counter()
+    while sum(seconds.values()) < 2500:
+        task = scheduler.pop()
+        seconds[task.priority] += task.predicted_sec
+    assert seconds["interactive"] / seconds["batch"] == pytest.approx(4.0, rel=0.1)
+
+
+def test_low_class_is_not_starved():
+    scheduler = make_scheduler()
+    fill(scheduler, [make_task(i) for i in range(100)])
+    batch = fill(scheduler, [make_task(1000, priority="batch")])[0]
+    assert batch in [scheduler.pop() for _ in range(5)]
+
+
+def test_users_alternate_within_class():
+    scheduler = make_scheduler()
+    fill(scheduler, [make_task(i, user_id="bulk") for i in range(200)])
+    fill(scheduler, [make_task(1000 + i, user_id="single") for i in range(3)])
+    
+    users = [scheduler.pop().user_id for _ in range(8)]
+    assert users[:6] in (["bulk", "single"] * 3, ["single", "bulk"] * 3)
+    assert users[6:] == ["bulk", "bulk"]
+
+
+def test_user_weights(monkeypatch):
+    monkeypatch.setitem(SERVER_CONFIG, "user_weights", {"vip": 3})
+    scheduler = make_scheduler()
+    fill(scheduler, [make_task(i, user_id="vip") for i in range(100)])
+    fill(scheduler, [make_task(1000 + i, user_id="other") for i in range(100)])
+    
+    counts = Counter(scheduler.pop().user_id for _ in range(80))
+    assert counts == {"vip": 60, "other": 20}
+
+
+# ──── PEEK / POP / ORDER ─────────────────────────────────────────────────────
+
+def test_peek_and_order_predict_pop():
+    rng = random.Random(0)
+    scheduler = make_scheduler()
+    pending = []
+    for i in range(600):
+        action = rng.random()
+        if action < 0.5 or not pending:
+            task = make_task(i, user_id=rng.choice("abc"), priority=rng.choice(["interactive", "batch"]),
+                             predicted_sec=rng.choice([None, 1.0, 5.0, 17.0]))
+            scheduler.push(task)
+            pending.append(task)
+        elif action < 0.6:
+            task = pending.pop(rng.randrange(len(pending)))
+            assert scheduler.remove(task)
+        else:
+            order = scheduler.order(limit=5)
+            expected = scheduler.peek()
+            assert order[0] is expected
+            task = scheduler.pop()
+            assert task is expected
+            pending.remove(task)
+        assert len(scheduler) == len(pending)
+    
+    order = scheduler.order()
+    assert sorted(task.task_id for task in order) == sorted(task.task_id for task in pending)
+    assert [scheduler.pop() for _ in order] == order
+    assert scheduler.peek() is None and scheduler.pop() is None
@@ -1,133 +1,314 @@
 """
 Веб интерфейс для Media Cleaner Server
-Flask приложение с красивым UI
+Асинхронное приложение (FastAPI/Starlette + httpx) с красивым UI
+
+Все обращения к API сервера идут через асинхронные пулы httpx, поэтому
+медленные скачивания и загрузки не занимают потоки и не блокируют
+запросы статуса. Статические файлы отдаются напрямую.
 """
 
-from flask import Flask, render_template, request, jsonify, send_file, redirect, url_for
-from flask_cors import CORS
-import os
-import requests
-from pathlib import Path
-import json
+import asyncio
 import logging
-from datetime import datetime
+import os
 import time
-import threading
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from starlette.background import BackgroundTask
+from starlette.exceptions import HTTPException as StarletteHTTPException
 
 # Логирование
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__, 
-    template_folder='templates',
-    static_folder='static'
-)
-CORS(app)
+BASE_DIR = Path(__file__).resolve().parent
 
 # Конфигурация
 API_SERVER = os.getenv('API_SERVER', 'http://127.0.0.1:8000')
-UPLOAD_FOLDER = Path('./web_uploads')
-UPLOAD_FOLDER.mkdir(exist_ok=True)
+MAX_CONTENT_LENGTH = 2 * 1024 * 1024 * 1024  # 2GB
 
-app.config['UPLOAD_FOLDER'] = str(UPLOAD_FOLDER)
-app.config['MAX_CONTENT_LENGTH'] = 2 * 1024 * 1024 * 1024  # 2GB
+API_POOL_SIZE = int(os.getenv('API_POOL_SIZE', 20))  # Keep-alive соединений к API
+HEALTH_TTL = 5.0            # Кэш /health (сек)
+STATS_TTL = 2.0             # Кэш /stats (сек)
+API_TIMEOUT = httpx.Timeout(10.0)
+HEALTH_TIMEOUT = httpx.Timeout(3.0, connect=2.0)  # Проверка API не должна надолго задерживать страницу
+UPLOAD_TIMEOUT = httpx.Timeout(300.0, connect=10.0)
+DOWNLOAD_TIMEOUT = httpx.Timeout(None, connect=10.0)  # Скачивание может идти долго
+EVENTS_TIMEOUT = httpx.Timeout(None, connect=10.0)    # Поток событий открыт до завершения задачи
 
 # Хранилище активных сессий
 active_sessions = {}
 
 
+# ──── HTTP КЛИЕНТЫ API ───────────────────────────────────────────────────
+class _ApiClients:
+    """
+    Два пула соединений к API: короткие запросы (статус, статистика, отмена)
+    и передачи файлов. Долгие загрузки/скачивания не занимают соединения
+    пула коротких запросов.
+    """
+    
+    def __init__(self):
+        self.api: Optional[httpx.AsyncClient] = None
+        self.transfer: Optional[httpx.AsyncClient] = None
+    
+    def open(self) -> None:
+        self.api = httpx.AsyncClient(
+            base_url=API_SERVER,
+            timeout=API_TIMEOUT,
+            limits=httpx.Limits(max_connections=API_POOL_SIZE, max_keepalive_connections=API_POOL_SIZE)
+        )
+        self.transfer = httpx.AsyncClient(
+            base_url=API_SERVER,
+            limits=httpx.Limits(max_connections=None, max_keepalive_connections=API_POOL_SIZE)
+        )
+    
+    async def close(self) -> None:
+        await self.api.aclose()
+        await self.transfer.aclose()
+
+
+clients = _ApiClients()
+
+
+class _TTLCache:
+    """Кэш ответов API с временем жизни записей (в пределах одного event loop)"""
+    
+    def __init__(self):
+        self.items: Dict[str, Tuple[float, Any]] = {}
+    
+    def get(self, key: str):
+        item = self.items.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if time.monotonic() >= expires:
+            del self.items[key]
+            return None
+        return value
+    
+    def set(self, key: str, value, ttl: float) -> None:
+        self.items[key] = (time.monotonic() + ttl, value)
+
+
+class _SingleFlight:
+    """
+    Объединение одинаковых одновременных запросов: первый запрос к API
+    выполняется, остальные ждут тот же результат (или ошибку).
+    Отключение одного клиента не отменяет запрос для остальных.
+    """
+    
+    def __init__(self):
+        self.calls: Dict[str, asyncio.Future] = {}
+    
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]):
+        future = self.calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(fn())
+            self.calls[key] = future
+            future.add_done_callback(lambda f: self._done(key, f))
+        return await asyncio.shield(future)
+    
+    def _done(self, key: str, future: asyncio.Future) -> None:
+        self.calls.pop(key, None)
+        if not future.cancelled():
+            # Помечаем ошибку полученной, даже если все ожидающие отключились
+            future.exception()
+
+
+_cache = _TTLCache()
+_inflight = _SingleFlight()
+
+
+async def _api_get(path: str, timeout: httpx.Timeout = API_TIMEOUT, ttl: float = 0.0):
+    """
+    GET к API через пул соединений. Возвращает (status_code, json или None).
+    Одинаковые одновременные запросы объединяются; при ttl > 0 успешный
+    ответ кэшируется на ttl секунд.
+    """
+    if ttl > 0:
+        cached = _cache.get(path)
+        if cached is not None:
+            return cached
+    
+    async def fetch():
+        response = await clients.api.get(path, timeout=timeout)
+        try:
+            data = response.json()
+        except ValueError:
+            data = None
+        result = (response.status_code, data)
+        if ttl > 0 and response.status_code == 200:
+            _cache.set(path, result, ttl)
+        return result
+    
+    return await _inflight.do(path, fetch)
+
+
+async def _api_online() -> bool:
+    """Доступность API (результат, в том числе offline, кэшируется на HEALTH_TTL)"""
+    cached = _cache.get('health:online')
+    if cached is not None:
+        return cached
+    
+    async def check():
+        try:
+            status_code, _ = await _api_get('/health', timeout=HEALTH_TIMEOUT)
+            online = status_code == 200
+        except httpx.HTTPError:
+            online = False
+        _cache.set('health:online', online, HEALTH_TTL)
+        return online
+    
+    return await _inflight.do('health:online', check)
+
+
+# ──── ПРИЛОЖЕНИЕ ─────────────────────────────────────────────────────────
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Пулы соединений к API живут вместе с приложением"""
+    clients.open()
+    yield
+    await clients.close()
+
+
+app = FastAPI(title="Media Cleaner Web Interface", lifespan=lifespan, docs_url=None, redoc_url=None)
+app.add_middleware(
+    CORSMiddleware,
+    allow_origins=["*"],
+    allow_methods=["*"],
+    allow_headers=["*"],
+)
+app.mount('/static', StaticFiles(directory=BASE_DIR / 'static'), name='static')
+templates = Jinja2Templates(directory=BASE_DIR / 'templates')
+
+
 # ──── ГЛАВНАЯ СТРАНИЦА ────────────────────────────────────────────────────
-@app.route('/')
-def index():
+@app.get('/')
+async def index(request: Request):
     """Главная страница"""
-    try:
-        # Проверить доступность API
-        response = requests.get(f"{API_SERVER}/health", timeout=5)
-        server_status = "online" if response.status_code == 200 else "offline"
-    except:
-        server_status = "offline"
-    
-    return render_template('index.html', server_status=server_status)
+    # Проверить доступность API (из кэша, без ожидания при каждой загрузке страницы)
+    server_status = "online" if await _api_online() else "offline"
+
+    return templates.TemplateResponse(request, 'index.html', {'server_status': server_status})
 
 
 # ──── ЗАГРУЗКА ВИДЕО ──────────────────────────────────────────────────────
-@app.route('/upload', methods=['POST'])
-def upload_video():
-    """API endpoint для загрузки видео"""
+class _UploadTooLarge(Exception):
+    """Тело загрузки превысило MAX_CONTENT_LENGTH"""
+
+
+async def _limited_stream(request: Request, limit: int):
+    """Тело запроса потоком с подсчётом байт (chunked загрузка идёт без content-length)"""
+    received = 0
+    async for chunk in request.stream():
+        received += len(chunk)
+        if received > limit:
+            raise _UploadTooLarge()
+        yield chunk
+
+
+@app.post('/upload')
+async def upload_video(request: Request):
+    """
+    API endpoint для загрузки видео.
+    
+    Тело запроса (multipart с полем file) не разбирается и не сохраняется:
+    оно потоково (chunked) передаётся на /upload API сервера. Параметры
+    обработки передаются в query string.
+    """
     
     try:
         # Проверить файл
-        if 'file' not in request.files:
-            return jsonify({'error': 'No file provided'}), 400
+        content_type = request.headers.get('content-type', '')
+        if not content_type.startswith('multipart/form-data'):
+            return JSONResponse({'error': 'No file provided'}, status_code=400)
         
-        file = request.files['file']
-        
-        if file.filename == '':
-            return jsonify({'error': 'No file selected'}), 400
+        content_length = request.headers.get('content-length')
+        if content_length and int(content_length) > MAX_CONTENT_LENGTH:
+            return JSONResponse({'error': 'Файл слишком большой'}, status_code=413)
         
         # Получить параметры обработки
-        epsilon = float(request.form.get('epsilon', 0.12))
-        video_strength = float(request.form.get('video_strength', 1.0))
-        audio_level = request.form.get('audio_level', 'слабый')
-        every_n_frames = int(request.form.get('every_n_frames', 10))
-        user_id = request.form.get('user_id', 'web_user')
+        args = request.query_params
+        try:
+            epsilon = float(args.get('epsilon', 0.12))
+            video_strength = float(args.get('video_strength', 1.0))
+            every_n_frames = int(args.get('every_n_frames', 10))
+        except ValueError:
+            return JSONResponse({'error': 'Параметры обработки должны быть числами'}, status_code=400)
+        audio_level = args.get('audio_level', 'слабый')
+        user_id = args.get('user_id', 'web_user')
+        filename = args.get('filename')
         
         # Валидация параметров
         if not (0.04 <= epsilon <= 0.20):
-            return jsonify({'error': 'Epsilon должен быть между 0.04 и 0.20'}), 400
+            return JSONResponse({'error': 'Epsilon должен быть между 0.04 и 0.20'}, status_code=400)
         
         if not (1.0 <= video_strength <= 2.0):
-            return jsonify({'error': 'Strength должен быть между 1.0 и 2.0'}), 400
+            return JSONResponse({'error': 'Strength должен быть между 1.0 и 2.0'}, status_code=400)
         
         if not (1 <= every_n_frames <= 30):
-            return jsonify({'error': 'Frames должен быть между 1 и 30'}), 400
+            return JSONResponse({'error': 'Frames должен быть между 1 и 30'}, status_code=400)
         
-        # Сохранить файл временно
-        import uuid
-        unique_id = str(uuid.uuid4())[:8]
-        temp_filename = f"{unique_id}_{file.filename}"
-        temp_path = os.path.join(app.config['UPLOAD_FOLDER'], temp_filename)
-        file.save(temp_path)
+        logger.info(f"📥 Передача загрузки на API сервер: {filename or 'video'}")
         
-        logger.info(f"📥 Файл загружен: {temp_filename}")
+        # Отправить на API сервер тем же multipart телом, без промежуточного файла
+        params = {
+            'epsilon': epsilon,
+            'video_strength': video_strength,
+            'audio_level': audio_level,
+            'every_n_frames': every_n_frames,
+            'user_id': user_id,
+        }
+        if args.get('profile'):
+            params['profile'] = args.get('profile')
+        if args.get('priority'):
+            params['priority'] = args.get('priority')
         
-        # Отправить на API сервер
-        with open(temp_path, 'rb') as f:
-            files = {'file': (file.filename, f)}
-            params = {
-                'epsilon': epsilon,
-                'video_strength': video_strength,
-                'audio_level': audio_level,
-                'every_n_frames': every_n_frames,
-                'user_id': user_id,
-            }
-            
-            response = requests.post(
-                f"{API_SERVER}/upload",
-                files=files,
+        try:
+            response = await clients.transfer.post(
+                '/upload',
+                content=_limited_stream(request, MAX_CONTENT_LENGTH),
+                headers={'Content-Type': content_type},
                 params=params,
-                timeout=30
+                timeout=UPLOAD_TIMEOUT
             )
-        
-        # Удалить временный файл
-        try:
-            os.remove(temp_path)
-        except:
-            pass
+        except _UploadTooLarge:
+            return JSONResponse({'error': 'Файл слишком большой'}, status_code=413)
         
         if response.status_code != 200:
-            return jsonify({'error': 'Ошибка при загрузке на сервер обработки'}), 500
+            try:
+                detail = response.json().get('detail')
+            except ValueError:
+                detail = None
+            # Перегрузка API (429): клиенту нужно знать, когда повторить
+            headers = {}
+            if 'retry-after' in response.headers:
+                headers['Retry-After'] = response.headers['retry-after']
+            return JSONResponse(
+                {'error': detail or 'Ошибка при загрузке на сервер обработки'},
+                status_code=response.status_code,
+                headers=headers
+            )
         
         result = response.json()
         
         if result['status'] != 'success':
-            return jsonify({'error': result.get('detail', 'Ошибка сервера')}), 500
+            return JSONResponse({'error': result.get('detail', 'Ошибка сервера')}, status_code=500)
         
         task_id = result['task_id']
         
         # Сохранить информацию о задаче в сессию
         active_sessions[task_id] = {
-            'filename': file.filename,
+            'filename': filename,
             'user_id': user_id,
             'created_at': datetime.now().isoformat(),
             'epsilon': epsilon,
@@ -135,158 +316,183 @@ def upload_video():
             'audio_level': audio_level,
         }
         
-        return jsonify({
+        return {
             'status': 'success',
             'task_id': task_id,
             'message': 'Видео загружено и добавлено в очередь'
-        })
+        }
     
     except Exception as e:
         logger.error(f"[ERROR] Upload error: {e}")
-        return jsonify({'error': str(e)}), 500
+        return JSONResponse({'error': str(e)}, status_code=500)
 
 
 # ──── СТАТУС ЗАДАЧИ ──────────────────────────────────────────────────────
-@app.route('/api/task/<task_id>')
-def get_task_status(task_id):
+@app.get('/api/task/{task_id}')
+async def get_task_status(task_id: str):
     """Получить статус задачи"""
     
     try:
-        response = requests.get(
-            f"{API_SERVER}/task/{task_id}",
-            timeout=10
-        )
+        # Одинаковые одновременные запросы статуса (несколько вкладок) — один запрос к API
+        status_code, result = await _api_get(f"/task/{task_id}")
         
-        if response.status_code != 200:
-            return jsonify({'error': 'Задача не найдена'}), 404
+        if status_code != 200:
+            return JSONResponse({'error': 'Задача не найдена'}, status_code=404)
         
-        result = response.json()
         task = result['task']
         
-        return jsonify({
+        return {
             'status': 'success',
             'task': task
-        })
+        }
     
     except Exception as e:
         logger.error(f"[ERROR] Task status error: {e}")
-        return jsonify({'error': str(e)}), 500
+        return JSONResponse({'error': str(e)}, status_code=500)
+
+
+# ──── ПОТОК СОБЫТИЙ ЗАДАЧИ ───────────────────────────────────────────────
+@app.get('/api/task/{task_id}/events')
+async def task_events(task_id: str, request: Request):
+    """Поток обновлений задачи (SSE) — проксируется с API сервера без буферизации"""
+    
+    try:
+        headers = {}
+        if request.headers.get('last-event-id'):
+            headers['Last-Event-ID'] = request.headers['last-event-id']
+        upstream = await clients.transfer.send(
+            clients.transfer.build_request('GET', f"/task/{task_id}/events",
+                                           headers=headers, timeout=EVENTS_TIMEOUT),
+            stream=True
+        )
+        
+        if upstream.status_code != 200:
+            await upstream.aclose()
+            return JSONResponse({'error': 'Задача не найдена'}, status_code=404)
+        
+        async def relay():
+            # Соединение с API закрывается и при отключении браузера
+            try:
+                async for chunk in upstream.aiter_raw():
+                    yield chunk
+            finally:
+                await upstream.aclose()
+        
+        return StreamingResponse(
+            relay(),
+            media_type='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+    
+    except Exception as e:
+        logger.error(f"[ERROR] Task events error: {e}")
+        return JSONResponse({'error': str(e)}, status_code=500)
 
 
 # ──── СКАЧАТЬ ВИДЕО ──────────────────────────────────────────────────────
-@app.route('/api/download/<task_id>')
-def download_video(task_id):
-    """Скачать обработанное видео"""
+@app.get('/api/download/{task_id}')
+async def download_video(task_id: str):
+    """Скачать обработанное видео (потоком из API, без буферизации файла)"""
     
     try:
-        response = requests.get(
-            f"{API_SERVER}/download/{task_id}",
-            stream=True,
-            timeout=30
+        upstream = await clients.transfer.send(
+            clients.transfer.build_request('GET', f"/download/{task_id}", timeout=DOWNLOAD_TIMEOUT),
+            stream=True
         )
         
-        if response.status_code != 200:
-            return jsonify({'error': 'Видео не готово'}), 400
+        if upstream.status_code != 200:
+            await upstream.aclose()
+            return JSONResponse({'error': 'Видео не готово'}, status_code=400)
         
         # Отправить файл клиенту
         filename = f"protected_{task_id}.mp4"
+        headers = {'Content-Disposition': f'attachment; filename="{filename}"'}
+        if 'content-length' in upstream.headers:
+            headers['Content-Length'] = upstream.headers['content-length']
         
-        return send_file(
-            response.raw,
-            as_attachment=True,
-            download_name=filename,
-            mimetype='video/mp4'
+        return StreamingResponse(
+            upstream.aiter_raw(),
+            media_type='video/mp4',
+            headers=headers,
+            background=BackgroundTask(upstream.aclose)
         )
     
     except Exception as e:
         logger.error(f"[ERROR] Download error: {e}")
-        return jsonify({'error': str(e)}), 500
+        return JSONResponse({'error': str(e)}, status_code=500)
 
 
 # ──── ОТМЕНА ЗАДАЧИ ──────────────────────────────────────────────────────
-@app.route('/api/cancel/<task_id>', methods=['POST'])
-def cancel_task(task_id):
+@app.post('/api/cancel/{task_id}')
+async def cancel_task(task_id: str):
     """Отменить задачу"""
     
     try:
-        response = requests.post(
-            f"{API_SERVER}/cancel/{task_id}",
-            timeout=10
-        )
+        response = await clients.api.post(f"/cancel/{task_id}")
         
         if response.status_code != 200:
-            return jsonify({'error': 'Не удалось отменить задачу'}), 400
+            return JSONResponse({'error': 'Не удалось отменить задачу'}, status_code=400)
         
-        return jsonify({'status': 'success', 'message': 'Задача отменена'})
+        return {'status': 'success', 'message': 'Задача отменена'}
     
     except Exception as e:
         logger.error(f"[ERROR] Cancel error: {e}")
-        return jsonify({'error': str(e)}), 500
+        return JSONResponse({'error': str(e)}, status_code=500)
 
 
 # ──── СТАТИСТИКА СЕРВЕРА ─────────────────────────────────────────────────
-@app.route('/api/stats')
-def get_stats():
+@app.get('/api/stats')
+async def get_stats():
     """Получить статистику сервера"""
     
     try:
-        response = requests.get(
-            f"{API_SERVER}/stats",
-            timeout=10
-        )
+        status_code, result = await _api_get("/stats", ttl=STATS_TTL)
         
-        if response.status_code != 200:
-            return jsonify({'error': 'Ошибка получения статистики'}), 500
+        if status_code != 200:
+            return JSONResponse({'error': 'Ошибка получения статистики'}, status_code=500)
         
-        return response.json()
+        return result
     
     except Exception as e:
         logger.error(f"[ERROR] Stats error: {e}")
-        return jsonify({'error': str(e)}), 500
+        return JSONResponse({'error': str(e)}, status_code=500)
 
 
 # ──── ПРОВЕРКА СЕРВЕРА ───────────────────────────────────────────────────
-@app.route('/api/health')
-def health():
+@app.get('/api/health')
+async def health():
     """Проверка здоровья API сервера"""
     
-    try:
-        response = requests.get(
-            f"{API_SERVER}/health",
-            timeout=5
-        )
-        
-        if response.status_code == 200:
-            return jsonify({'status': 'healthy', 'api': 'online'})
-        else:
-            return jsonify({'status': 'unhealthy', 'api': 'offline'}), 503
-    
-    except:
-        return jsonify({'status': 'unhealthy', 'api': 'offline'}), 503
+    if await _api_online():
+        return {'status': 'healthy', 'api': 'online'}
+    return JSONResponse({'status': 'unhealthy', 'api': 'offline'}, status_code=503)
 
 
 # ──── ОШИБКА 404 ─────────────────────────────────────────────────────────
-@app.errorhandler(404)
-def not_found(error):
-    """Обработка 404 ошибок"""
-    return render_template('404.html'), 404
+@app.exception_handler(StarletteHTTPException)
+async def http_error(request: Request, exc: StarletteHTTPException):
+    """Обработка 404 (страница) и прочих HTTP ошибок (JSON)"""
+    if exc.status_code == 404:
+        return templates.TemplateResponse(request, '404.html', status_code=404)
+    return JSONResponse({'error': exc.detail}, status_code=exc.status_code)
 
 
 # ──── ОШИБКА 500 ─────────────────────────────────────────────────────────
-@app.errorhandler(500)
-def server_error(error):
+@app.exception_handler(Exception)
+async def server_error(request: Request, exc: Exception):
     """Обработка 500 ошибок"""
-    return jsonify({'error': 'Internal server error'}), 500
+    return JSONResponse({'error': 'Internal server error'}, status_code=500)
 
 
 # ──── ЗАПУСК ───────────────────────────────────────────────────────────
 def run_web_interface(host: str = "0.0.0.0", port: int = 5000, debug: bool = False):
     """Запуск веб интерфейса"""
+    import uvicorn
     
     logger.info(f"[API] Web interface running on http://{host}:{port}")
     logger.info(f"📡 API сервер: {API_SERVER}")
     
-    app.run(host=host, port=port, debug=debug, use_reloader=False)
+    uvicorn.run(app, host=host, port=port, log_level="debug" if debug else "info")
 
 
 if __name__ == '__main__':